@@ -0,0 +1,316 @@
+# this script benchmarks the parse callbacks of the spiders, in pages per second, so parse throughput can be tracked per page type
+#
+# usage (from the directory that contains scrapy.cfg):
+#   python bench_parse.py                   # the built-in fixture pages
+#   python bench_parse.py --archive         # the pages recorded in the crawl archive (see fashionbroda/archive.py)
+#   python bench_parse.py --check           # only check that extract_album() gives the same output as the XPath version
+#   python bench_parse.py --repeat 5 --pages 500
+#
+# benchmarked callbacks: ImagesSpider.parse_album (and the extractor alone, next to the XPath version it replaced),
+# AlbumsSpider.parse_category and FashionBrodaSpider.parse. Every page is a fresh response, so HTML parsing is included.
+
+# import argparse to read the command line options
+import argparse
+
+# import re and sys for the XPath reference extractor and the exit code of --check
+import re
+import sys
+
+# import time to measure the callbacks
+import time
+
+# import Scrapy's response and request classes to build the pages, and its helpers to build spiders outside of a crawl
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+from scrapy.utils.test import get_crawler
+
+# import the crawl archive, to benchmark on recorded pages
+from fashionbroda.archive import archive_path
+from fashionbroda.responsestore import ResponseStore
+
+# import the album page extractor and the spiders whose callbacks are benchmarked
+from fashionbroda.extractors import extract_album
+from fashionbroda.spiders.albums import AlbumsSpider
+from fashionbroda.spiders.fashion_broda import FashionBrodaSpider
+from fashionbroda.spiders.images import ImagesSpider
+
+# the site the fixture pages are built for
+SITE = "https://fashionbroda.x.yupoo.com"
+
+# the context the spiders find in request meta, the same for every page
+CTX = {
+    "seller": "fashionbroda",
+    "contact": "+00 000 000",
+    "category": "Brands",
+    "category_text": "Brands",
+    "category_link": f"{SITE}/categories/4190405",
+    "page_url": f"{SITE}/categories/4190405",
+    "page_number": 1,
+}
+
+# spiders built for the benchmark must not open the crawl state stores
+SPIDER_SETTINGS = {"DEADLETTER_ENABLED": False, "LOG_LEVEL": "ERROR"}
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def xpath_extract_album(response):
+    """The XPath version of extract_album(), as parse_album ran it before, the reference of --check."""
+    product_images = [
+        response.urljoin(url.strip())
+        for url in response.xpath(
+            '//img[contains(@class,"image__portrait")]/@data-origin-src'
+        ).getall()
+    ]
+    size_chart_images = [
+        response.urljoin(url.strip())
+        for url in response.xpath(
+            '//img[contains(@class,"image__landscape")]/@data-origin-src'
+        ).getall()
+    ]
+    raw_description = response.xpath("//meta[@name='description']/@content").get()
+
+    product_data = {}
+    for data in raw_description.split("\n") if raw_description else []:
+        if ":" not in data:
+            continue
+        key, value = data.split(":", 1)
+        clean_key = re.sub(r"[•●・◦◘○◉⦿⦾▪▫]", "", key).lower().strip().replace(" ", "_")
+        clean_value = value.strip()
+        if clean_key == "price":
+            numeric_string = "".join(c for c in clean_value if c.isdigit())
+            try:
+                clean_value = int(numeric_string)
+            except ValueError:
+                pass
+        if clean_key in ("sizes", "size") and isinstance(clean_value, str):
+            clean_value = [s for s in re.split(r"[,\-/\s]+", clean_value.strip()) if s]
+        if clean_value == "" or clean_value == []:
+            clean_value = None
+        product_data[clean_key] = clean_value
+    return product_images, size_chart_images, product_data
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+# the navigation, header and footer every yupoo page carries, so the fixtures have a realistic DOM size
+def page_chrome(body):
+    links = "".join(
+        f'<li><a class="yupoo-collapse-item" href="/categories/{4190000 + i}">Brand {i}</a></li>'
+        for i in range(120)
+    )
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>fashionbroda</title>'
+        '<meta name="keywords" content="fashionbroda"><link rel="stylesheet" href="/app.css"></head>'
+        f'<body><header class="showheader"><h1>fashionbroda</h1></header><nav><ul>{links}</ul></nav>'
+        f'<main>{body}</main><footer><p>yupoo</p><img src="/logo.png"></footer></body></html>'
+    )
+
+
+def album_page(album_id, images=24, size_charts=2):
+    description = "\n".join(
+        [
+            "• Brand: Fashion Broda",
+            "● Price: ¥ 1,280",
+            "Sizes: S, M - L / XL",
+            "◦ Material: cotton: 100%",
+            "Color:",
+            "new arrival",
+        ]
+    )
+    photos = "".join(
+        f'<div class="image__imagewrap"><img class="autocover image__img image__portrait" '
+        f'data-origin-src="//photo.yupoo.com/fashionbroda/{album_id:x}{i:02d}/big.jpg " '
+        f'src="//photo.yupoo.com/fashionbroda/{album_id:x}{i:02d}/small.jpg"></div>'
+        for i in range(images)
+    )
+    charts = "".join(
+        f'<div class="image__imagewrap"><img class="autocover image__img image__landscape" '
+        f'data-origin-src="//photo.yupoo.com/fashionbroda/{album_id:x}c{i}/big.jpg"></div>'
+        for i in range(size_charts)
+    )
+    body = page_chrome(f'<div class="showalbum__children">{photos}{charts}</div>')
+    return body.replace(
+        '<meta name="keywords"',
+        f'<meta name="description" content="{description}"><meta name="keywords"',
+    )
+
+
+def category_page(page, total=20, albums=40):
+    children = "".join(
+        f'<a class="album__main" href="/albums/{100000 + page * albums + i}?uid=1&isSubCate=false&referrercate=4190405">'
+        f'<div class="album__title">Album {i}</div></a>'
+        for i in range(albums)
+    )
+    pagination = (
+        f'<div class="pagination__main"><span class="pagination__active">{page}</span>'
+        f'<a title="next page" href="/categories/4190405?page={page + 1}">next</a>'
+        f'<a title="last page" href="/categories/4190405?page={total}">last</a>'
+        f'<span class="pagination__jumpwrap"><input name="page" max="{total}">{total} pages</span></div>'
+    )
+    return page_chrome(
+        f'<div class="categories__children">{children}</div>{pagination}'
+    )
+
+
+def categories_page():
+    headers = "".join(
+        f'<div class="yupoo-collapse-header"><a href="/categories/{4190400 + i}?isSubCate=false">{category}</a></div>'
+        for i, category in enumerate(FashionBrodaSpider.categories)
+    )
+    return page_chrome(f"<pre>WhatsApp: +00 000 000</pre>{headers}")
+
+
+def fixture_pages(pages):
+    """Return the built-in fixture pages, as {page type: [(url, body)]}."""
+    return {
+        "album": [
+            (f"{SITE}/albums/{100000 + i}?uid=1", album_page(100000 + i).encode())
+            for i in range(pages)
+        ],
+        "category": [
+            (
+                f"{SITE}/categories/4190405?page={2 + i % 19}",
+                category_page(2 + i % 19).encode(),
+            )
+            for i in range(pages)
+        ],
+        "categories": [(f"{SITE}/categories/", categories_page().encode())] * pages,
+    }
+
+
+def archive_pages(pages):
+    """Return up to `pages` pages of every type recorded in the crawl archive, as {page type: [(url, body)]}."""
+    archive = ResponseStore(archive_path(get_project_settings()))
+    found = {"album": [], "category": [], "categories": []}
+    for url, status, headers, body in archive.records("%/albums/%", pages):
+        found["album"].append((url, body))
+    for url, status, headers, body in archive.records("%/categories/%"):
+        page_type = (
+            "categories" if url.rstrip("/").endswith("/categories") else "category"
+        )
+        if len(found[page_type]) < pages:
+            found[page_type].append((url, body))
+    archive.close()
+    return found
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def build_spider(spider_cls):
+    crawler = get_crawler(spider_cls, settings_dict=SPIDER_SETTINGS)
+    crawler.spider = spider_cls.from_crawler(crawler)
+    return crawler.spider
+
+
+def responses(pages, meta):
+    for url, body in pages:
+        yield HtmlResponse(
+            url=url, body=body, encoding="utf-8", request=Request(url, meta=dict(meta))
+        )
+
+
+def bench(name, pages, callback, meta, repeat):
+    """Run a callback over every page `repeat` times, and print the best run's pages per second."""
+    if not pages:
+        print(f"{name:<32} no pages")
+        return
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for response in responses(pages, meta):
+            for _ in callback(response) or ():
+                pass
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(
+        f"{name:<32} {len(pages) / best:>10.0f} pages/s {best / len(pages) * 1000:>8.3f} ms/page"
+    )
+
+
+def check(pages):
+    """Compare extract_album() with the XPath version on every album page, return the number of differences."""
+    differences = 0
+    for response in responses(pages, {}):
+        expected, actual = xpath_extract_album(response), extract_album(response)
+        if expected != actual:
+            differences += 1
+            print(
+                f"Different output for {response.url}:\n  xpath: {expected}\n  fast:  {actual}"
+            )
+    print(f"Checked {len(pages)} album pages, {differences} different")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the parse callbacks of the spiders"
+    )
+    parser.add_argument("--pages", type=int, default=200, help="pages per page type")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per benchmark, the best one is kept"
+    )
+    parser.add_argument(
+        "--archive", action="store_true", help="use the pages of the crawl archive"
+    )
+    parser.add_argument(
+        "--check", action="store_true", help="only check the album extractor"
+    )
+    args = parser.parse_args()
+    # building a crawler checks the reactor of the TWISTED_REACTOR setting, nothing is crawled
+    install_reactor(get_project_settings().get("TWISTED_REACTOR"))
+
+    pages = archive_pages(args.pages) if args.archive else fixture_pages(args.pages)
+    # the extractor must give the XPath version's output on every page before its speed means anything
+    if check(pages["album"]):
+        sys.exit(1)
+    if args.check:
+        return
+
+    album_meta = {"ctx": {**CTX, "album_url": f"{SITE}/albums/100000?uid=1"}}
+    category_meta = {
+        "ctx": {
+            k: CTX[k]
+            for k in ("seller", "contact", "category", "category_text", "category_link")
+        },
+        "page_total": 20,
+    }
+    bench(
+        "extract_album (xpath)",
+        pages["album"],
+        lambda r: [xpath_extract_album(r)],
+        {},
+        args.repeat,
+    )
+    bench(
+        "extract_album", pages["album"], lambda r: [extract_album(r)], {}, args.repeat
+    )
+    bench(
+        "ImagesSpider.parse_album",
+        pages["album"],
+        build_spider(ImagesSpider).parse_album,
+        album_meta,
+        args.repeat,
+    )
+    bench(
+        "AlbumsSpider.parse_category",
+        pages["category"],
+        build_spider(AlbumsSpider).parse_category,
+        category_meta,
+        args.repeat,
+    )
+    bench(
+        "FashionBrodaSpider.parse",
+        pages["categories"],
+        build_spider(FashionBrodaSpider).parse,
+        {},
+        args.repeat,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
 import json
-import re
 from pathlib import Path
 
+# the normalizer the spider uses too, so the cleaned feed matches what a fresh crawl would extract,
+# clean_product_data() stays importable from this script
+from fashionbroda.normalize import clean_product_data, clean_product_data_column
+
+# import the delta feed reader and the album identity, only the albums that changed since the previous run are cleaned
+from fashionbroda.fingerprints import changed_albums
+from fashionbroda.planner import album_key
+
 # Define the path to the JSON file
 # Based on the context: /home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/images_paths.json
 # Adjusting to relative path assuming script is run from project root:
@@ -10,57 +17,8 @@ from pathlib import Path
 JSON_FILE_PATH = Path(
     "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/images_paths.json"
 )
-
-
-def clean_product_data(product_data):
-    """
-    Cleans the product_data dictionary values using the same logic as the spider.
-    """
-    if not product_data:
-        return {}
-
-    cleaned_data = {}
-
-    for key, value in product_data.items():
-        # The keys are already processed in the JSON (e.g. "price", "style_code"),
-        # so we don't need to re-clean keys typically, but we should clean the VALUES.
-
-        # However, the spider logic cleaned keys from raw description.
-        # Here we are iterating over already extracted keys.
-        # We will assume keys are fine or just clean values.
-        # But wait, we might want to re-apply logic if the JSON has raw-ish data?
-        # The user's request is to apply the logic:
-        # "if they are empty return none, just like i have in the sizes key field"
-
-        clean_key = key  # Key is already a string in JSON
-        clean_value = value  # Value from JSON
-
-        # In the spider, value comes from raw string splitting.
-        # In JSON, it might already be int (price) or string.
-
-        # Handle Price (Ensure int if possible, though JSON might already have int)
-        if clean_key == "price":
-            if isinstance(clean_value, str):
-                numeric_string = "".join(
-                    character for character in clean_value if character.isdigit()
-                )
-                try:
-                    clean_value = int(numeric_string)
-                except ValueError:
-                    pass  # Keep as is
-            # If it's already int, do nothing
-
-        # Handle Sizes
-        if clean_key in ("sizes", "size") and isinstance(clean_value, str):
-            clean_value = [s for s in re.split(r"[,\-/\s]+", clean_value.strip()) if s]
-
-        # Unified Empty Check
-        if clean_value == "" or clean_value == []:
-            clean_value = None
-
-        cleaned_data[clean_key] = clean_value
-
-    return cleaned_data
+# the added / changed / unchanged status of every album of the last images run, written next to images_paths.json
+DELTA_FILE_PATH = JSON_FILE_PATH.with_name("images_delta.jsonl")
 
 
 def main():
@@ -76,14 +34,23 @@ def main():
         print(f"Error reading JSON: {e}")
         return
 
-    print(f"Processing {len(data)} items...")
-
-    processed_count = 0
-    for item in data:
-        if "product_data" in item:
-            original_data = item["product_data"]
-            item["product_data"] = clean_product_data(original_data)
-            processed_count += 1
+    # the spider already normalizes product_data and an unchanged album is what a previous run already cleaned,
+    # so only the added and changed albums are cleaned again, without a delta feed every album is
+    changed = changed_albums(DELTA_FILE_PATH)
+    items = [
+        item
+        for item in data
+        if "product_data" in item
+        and (changed is None or album_key(item.get("album_url", "")) in changed)
+    ]
+    print(f"Processing {len(items)} of {len(data)} items...")
+
+    # clean the product_data of those items in one go, column by column (see fashionbroda/normalize.py)
+    for item, product_data in zip(
+        items, clean_product_data_column([item["product_data"] for item in items])
+    ):
+        item["product_data"] = product_data
+    processed_count = len(items)
 
     print("Saving cleaned data...")
     try:
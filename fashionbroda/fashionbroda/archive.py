@@ -0,0 +1,206 @@
+# Record-and-replay crawl archive, to re-run the parsers offline
+#
+# Changing parse_category or parse_album used to mean a full network recrawl to regenerate the feeds.
+# ArchiveRecorderMiddleware records every page a crawl downloads in an indexed, compressed archive,
+# and ArchiveReplayHandler serves the spiders from that archive instead of the network, so re-extracting the whole catalog
+# only costs the parsing (CPU) and runs with no delay, no proxy and no rate limit.
+#
+# The archive is one SQLite file (ARCHIVE_PATH, CRAWL_STATE_DIR/archive.sqlite by default) shared by all spiders,
+# laid out like a WARC file reduced to what Scrapy needs: a ResponseStore (see responsestore.py), the same store as the
+# HTTP cache, where every response is indexed by request fingerprint and identical bodies are compressed and stored once.
+#
+# Records are indexed by request fingerprint (see urls.py), so a replayed request finds its record whatever tracking
+# parameters its URL carries. Images are not recorded, the ImagesPipeline reuses the files already in IMAGES_STORE.
+#
+# record while crawling:   scrapy crawl catalog -s ARCHIVE_RECORD=True
+# replay with no network:  scrapy crawl catalog -s ARCHIVE_REPLAY=True
+
+# import Path to build the default archive path
+from pathlib import Path
+
+# import Scrapy signals, the base class of download handlers and the exception that disables a component
+from scrapy import signals
+from scrapy.core.downloader.handlers.base import BaseDownloadHandler
+from scrapy.exceptions import NotConfigured
+
+# import Scrapy's Headers class and the helper that picks the right Response class (HtmlResponse, ...) for archived data
+from scrapy.http.headers import Headers
+from scrapy.responsetypes import responsetypes
+
+# import the response store, the archive shares its layout with the HTTP cache
+from fashionbroda.responsestore import ResponseStore
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# headers that describe the body as it came over the wire, the archive stores it decoded
+TRANSFER_HEADERS = (b"Content-Encoding", b"Content-Length", b"Transfer-Encoding")
+
+
+def archive_path(settings):
+    """Return the archive file of a crawl, ARCHIVE_PATH or CRAWL_STATE_DIR/archive.sqlite."""
+    return settings.get("ARCHIVE_PATH") or str(
+        Path(settings.get("CRAWL_STATE_DIR")) / "archive.sqlite"
+    )
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class ArchiveRecorderMiddleware:
+    """
+    Downloader middleware that records the pages a crawl downloads in the archive.
+
+    Settings:
+        ARCHIVE_RECORD: Turn recording on, off by default
+        ARCHIVE_PATH: The archive file, defaults to CRAWL_STATE_DIR/archive.sqlite
+        ARCHIVE_COMPRESSION_LEVEL: Compression level, defaults to the codec's default
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.archive = None
+        level = crawler.settings.get("ARCHIVE_COMPRESSION_LEVEL")
+        self.level = int(level) if level is not None else None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # a replayed crawl has nothing new to record
+        if not crawler.settings.getbool("ARCHIVE_RECORD") or crawler.settings.getbool(
+            "ARCHIVE_REPLAY"
+        ):
+            raise NotConfigured
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.archive = ResponseStore(archive_path(self.crawler.settings))
+
+    def spider_closed(self, spider):
+        self.archive.close()
+        self.archive = None
+
+    def process_response(self, request, response):
+        if self.archive is None:
+            return response
+        # images are not re-parsed, and a 304 has no body, the previous record of the page stays
+        if response.status == 304 or response.headers.get(
+            b"Content-Type", b""
+        ).startswith(b"image/"):
+            return response
+
+        # this middleware runs after HttpCompressionMiddleware, the body is already decoded
+        headers = {
+            key: value
+            for key, value in response.headers.items()
+            if key not in TRANSFER_HEADERS
+        }
+        # a redirected page is recorded under every URL of the redirect chain, the spider requested the first one
+        fingerprinter = self.crawler.request_fingerprinter
+        requests = [request] + [
+            request.replace(url=url) for url in request.meta.get("redirect_urls", [])
+        ]
+        for recorded in requests:
+            self.archive.put(
+                fingerprinter.fingerprint(recorded).hex(),
+                response.url,
+                response.status,
+                headers,
+                response.body,
+                self.level,
+            )
+        self.crawler.stats.inc_value("archive/recorded")
+        return response
+
+
+class ArchiveReplayHandler(BaseDownloadHandler):
+    """
+    Download handler that answers http(s) requests from the archive, without any network access.
+
+    A request that was never recorded gets an empty 404 response, so the crawl goes on with what the archive has.
+    """
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        self.archive = ResponseStore(archive_path(crawler.settings))
+
+    async def download_request(self, request):
+        record = self.archive.get(
+            self.crawler.request_fingerprinter.fingerprint(request).hex()
+        )
+        if record is None:
+            self.crawler.stats.inc_value("archive/replay_missing")
+            return responsetypes.from_args(url=request.url)(
+                url=request.url, status=404, flags=["archive"]
+            )
+
+        url, status, headers, body, _ = record
+        self.crawler.stats.inc_value("archive/replayed")
+        headers = Headers(headers)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        # keep the requested URL, redirects were already followed when the page was recorded
+        return respcls(
+            url=request.url,
+            status=status,
+            headers=headers,
+            body=body,
+            flags=["archive"],
+        )
+
+    async def close(self):
+        self.archive.close()
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class ArchiveReplayAddon:
+    """
+    Add-on that switches a crawl to replay mode when ARCHIVE_REPLAY is set.
+
+    It routes http(s) downloads to ArchiveReplayHandler and drops everything that only makes sense on the network:
+    download delays, the session / proxy middleware, conditional revalidation and the HTTP cache.
+    Stored images are kept as they are, however old, since there is nothing to download them again from.
+
+    It also keeps the replay away from the state of the real crawls: the pages missing from the archive come back
+    as 404s, they are not dead letters, and the album fingerprints are compared with and promoted to a scratch store
+    (CRAWL_STATE_DIR/replay/), so the next real run still diffs against the last real one.
+    """
+
+    def update_settings(self, settings):
+        if not settings.getbool("ARCHIVE_REPLAY"):
+            return
+
+        handler = "fashionbroda.archive.ArchiveReplayHandler"
+        settings["DOWNLOAD_HANDLERS"]["http"] = handler
+        settings["DOWNLOAD_HANDLERS"]["https"] = handler
+        settings["DOWNLOADER_MIDDLEWARES"][
+            "fashionbroda.middlewares.SessionMiddleware"
+        ] = None
+        settings["DOWNLOADER_MIDDLEWARES"][
+            "fashionbroda.revalidation.ConditionalRequestMiddleware"
+        ] = None
+
+        # parsing is the only cost left, let as many pages through as the CPU can parse,
+        # at spider priority so the project settings give way but -s options still win
+        for name, value in (
+            ("DOWNLOAD_DELAY", 0),
+            ("RANDOMIZE_DOWNLOAD_DELAY", False),
+            ("AUTOTHROTTLE_ENABLED", False),
+            ("CONCURRENT_REQUESTS", 64),
+            ("CONCURRENT_REQUESTS_PER_DOMAIN", 64),
+            ("HTTPCACHE_ENABLED", False),
+            ("RETRY_ENABLED", False),
+            ("IMAGES_EXPIRES", 100 * 365),
+            ("DEADLETTER_ENABLED", False),
+            (
+                "ALBUM_FINGERPRINTS_PATH",
+                str(
+                    Path(settings.get("CRAWL_STATE_DIR"))
+                    / "replay"
+                    / "album_fingerprints.sqlite"
+                ),
+            ),
+        ):
+            settings.set(name, value, priority="spider")
@@ -0,0 +1,112 @@
+# Backpressure for spider start() generators
+#
+# Scrapy pulls requests out of start() as fast as it can whenever the downloader is busy, so with a large manifest
+# the scheduler queue (and every pending Request object in it) grows far faster than 10 concurrent downloads can drain it.
+# StartBackpressure lets start() pause between two requests while the crawl is saturated, and resume once it has drained:
+#
+# - scheduler backlog: requests enqueued but not dequeued yet, read from the scheduler/* stats so it works with any scheduler
+# - downloads: requests in the downloader, which includes every image download queued by the ImagesPipeline
+#
+# start() pauses as soon as either value reaches its high-water mark, and resumes only once both are back under
+# their low-water marks (hysteresis), so it does not flap between pausing and resuming on every request.
+
+# import deferLater to sleep without blocking the reactor, whatever reactor is installed
+from twisted.internet.task import deferLater
+
+# import the helper that lets an async def function await a Twisted Deferred
+from scrapy.utils.defer import maybe_deferred_to_future
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class StartBackpressure:
+    """
+    Pause a start() generator while the scheduler backlog or in-flight downloads are above their high-water marks.
+
+    Settings:
+        START_BACKLOG_HIGH_WATER / START_BACKLOG_LOW_WATER: scheduler backlog marks, in requests
+        START_DOWNLOADS_HIGH_WATER / START_DOWNLOADS_LOW_WATER: downloader marks, in requests (pages and media)
+        START_BACKPRESSURE_POLL_SECS: how often the marks are checked while paused
+    """
+
+    def __init__(
+        self,
+        crawler,
+        backlog_high,
+        backlog_low,
+        downloads_high,
+        downloads_low,
+        poll_secs,
+    ):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.backlog_high = backlog_high
+        self.backlog_low = backlog_low
+        self.downloads_high = downloads_high
+        self.downloads_low = downloads_low
+        self.poll_secs = poll_secs
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            crawler,
+            backlog_high=settings.getint("START_BACKLOG_HIGH_WATER", 1000),
+            backlog_low=settings.getint("START_BACKLOG_LOW_WATER", 500),
+            downloads_high=settings.getint("START_DOWNLOADS_HIGH_WATER", 200),
+            downloads_low=settings.getint("START_DOWNLOADS_LOW_WATER", 100),
+            poll_secs=settings.getfloat("START_BACKPRESSURE_POLL_SECS", 0.5),
+        )
+
+    def backlog(self):
+        """Return the number of requests waiting in the scheduler."""
+        enqueued = self.stats.get_value("scheduler/enqueued", 0)
+        dequeued = self.stats.get_value("scheduler/dequeued", 0)
+        return enqueued - dequeued
+
+    def downloads(self):
+        """Return the number of requests in the downloader, queued or transferring, pages and media alike."""
+        engine = self.crawler.engine
+        if engine is None or engine.downloader is None:
+            return 0
+        return len(engine.downloader.active)
+
+    def saturated(self):
+        """Return True when either value reached its high-water mark."""
+        return (
+            self.backlog() >= self.backlog_high
+            or self.downloads() >= self.downloads_high
+        )
+
+    def drained(self):
+        """Return True when both values are back under their low-water marks."""
+        return (
+            self.backlog() <= self.backlog_low
+            and self.downloads() <= self.downloads_low
+        )
+
+    async def wait(self):
+        """
+        Return immediately unless the crawl is saturated, otherwise sleep until it has drained.
+
+        Call this from start() before yielding each request.
+        """
+        if not self.saturated():
+            return
+
+        self.stats.inc_value("start/backpressure_pauses")
+        self.crawler.spider.logger.debug(
+            f"start() paused: backlog={self.backlog()} downloads={self.downloads()}"
+        )
+        # import the reactor here and not at module level, importing it too early would install the default reactor
+        # instead of the asyncio reactor configured in TWISTED_REACTOR
+        from twisted.internet import reactor
+
+        waited = 0.0
+        while not self.drained():
+            # sleep on the reactor, so downloads and callbacks keep running while start() waits
+            await maybe_deferred_to_future(
+                deferLater(reactor, self.poll_secs, lambda: None)
+            )
+            waited += self.poll_secs
+        self.stats.inc_value("start/backpressure_wait_secs", waited)
@@ -0,0 +1,74 @@
+# Compression helpers shared by the on-disk caches and archives
+#
+# zstandard compresses HTML much faster than zlib at a better ratio, but it is an extra dependency,
+# so it is used when it is installed and zlib (standard library) is the fallback.
+# Every blob starts with a one byte codec tag, so data written with one codec can still be read after switching to the other.
+
+# import zlib, the fallback codec, it is part of the standard library
+import zlib
+
+# import zstandard when it is installed (pip install zstandard)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# the codec tags written in front of every compressed blob
+ZLIB_TAG = b"z"
+ZSTD_TAG = b"Z"
+
+# the codec used to compress new data
+CODEC = "zstd" if zstandard is not None else "zlib"
+
+# zstandard compressors and decompressors are reusable, build them once per level
+_zstd_compressors = {}
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+
+def compress(data, level=None):
+    """
+    Compress bytes with zstandard when it is installed, zlib otherwise.
+
+    Args:
+        data (bytes): The data to compress
+        level (int, optional): Compression level, defaults to 3 for zstd and 6 for zlib
+
+    Returns:
+        bytes: The codec tag followed by the compressed data
+    """
+    if zstandard is not None:
+        level = 3 if level is None else level
+        compressor = _zstd_compressors.get(level)
+        if compressor is None:
+            compressor = _zstd_compressors[level] = zstandard.ZstdCompressor(
+                level=level
+            )
+        return ZSTD_TAG + compressor.compress(data)
+    return ZLIB_TAG + zlib.compress(data, 6 if level is None else level)
+
+
+def decompress(blob):
+    """
+    Decompress a blob written by compress(), whichever codec wrote it.
+
+    Args:
+        blob (bytes): The codec tag followed by the compressed data
+
+    Returns:
+        bytes: The original data
+
+    Raises:
+        ValueError: If the codec tag is unknown, or the blob is zstd compressed and zstandard is not installed
+    """
+    tag, data = blob[:1], blob[1:]
+    if tag == ZLIB_TAG:
+        return zlib.decompress(data)
+    if tag == ZSTD_TAG:
+        if _zstd_decompressor is None:
+            raise ValueError(
+                "zstd compressed data needs zstandard: pip install zstandard"
+            )
+        return _zstd_decompressor.decompress(data)
+    raise ValueError(f"Unknown compression tag: {tag!r}")
@@ -0,0 +1,195 @@
+# Interned crawl contexts, so album requests and image items do not each carry their own copy of the category data
+#
+# Every album request used to carry its full ctx dict in meta, and every ImageItem copied it again.
+# The seller, contact, category, category_text and category_link strings are the same for thousands of albums,
+# yet JOBDIR pickled all of them once per queued request, and every item waiting on its image downloads held its own copy.
+#
+# ContextRegistry keeps each distinct combination of those shared fields once, under a short context id:
+#
+# - compact():  {seller, contact, category, ..., album_url} -> {"ctx_id": "3f2a...", "page_url", "page_number", "album_url"}
+# - hydrate():  the reverse, used by the spider callbacks before validating the context
+# - hydrate_item(): fills an item back in place, only at export time (see HydrateContextPipeline)
+#
+# The context id is a hash of the shared field values, not a counter, so it is the same in every process and on every run.
+# When JOBDIR is set the registry lives in spider.state, which Scrapy saves in JOBDIR, so requests still queued on disk
+# can be hydrated after a resume even before start() has read their manifest row again.
+
+# import hashlib to derive deterministic context ids
+import hashlib
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# the fields shared by every album of a category, these are the ones stored once in the registry
+SHARED_CTX_FIELDS = (
+    "seller",
+    "contact",
+    "category",
+    "category_text",
+    "category_link",
+)
+
+# the shared fields kept on each category membership recorded by the planner (see planner.MEMBERSHIP_FIELDS)
+MEMBERSHIP_SHARED_FIELDS = ("category", "category_text", "category_link")
+
+
+def context_id(ctx):
+    """
+    Return the deterministic id of the shared fields of a context.
+
+    Args:
+        ctx (dict): A context containing every field of SHARED_CTX_FIELDS
+
+    Returns:
+        str: A 16 character hexadecimal id
+    """
+    # join with a unit separator, it never appears in the scraped values, so two different contexts can never join to the same string
+    joined = "\x1f".join(str(ctx[field]) for field in SHARED_CTX_FIELDS)
+    return hashlib.sha1(joined.encode()).hexdigest()[:16]
+
+
+class ContextRegistry:
+    """
+    Store every distinct set of shared context fields once, keyed by context id.
+
+    Args:
+        contexts (dict, optional): The dict to store the contexts in, e.g. spider.state["contexts"] so it survives a resume
+    """
+
+    def __init__(self, contexts=None):
+        self.contexts = contexts if contexts is not None else {}
+
+    def __len__(self):
+        return len(self.contexts)
+
+    def intern(self, ctx):
+        """
+        Register the shared fields of a context and return their id.
+
+        Args:
+            ctx (dict): A context containing every field of SHARED_CTX_FIELDS
+
+        Returns:
+            str: The context id
+        """
+        ctx_id = context_id(ctx)
+        if ctx_id not in self.contexts:
+            self.contexts[ctx_id] = {field: ctx[field] for field in SHARED_CTX_FIELDS}
+        return ctx_id
+
+    def lookup(self, ctx_id):
+        """
+        Return the shared fields registered under a context id.
+
+        Raises:
+            ValueError: If the id was never registered, the same error validate_ctx_fields_values() raises for bad data
+        """
+        try:
+            return self.contexts[ctx_id]
+        except KeyError:
+            raise ValueError(f"Unknown context id: {ctx_id}") from None
+
+    def compact(self, ctx):
+        """
+        Replace the shared fields of a context (and of its category memberships) with context ids.
+
+        Args:
+            ctx (dict): A validated context
+
+        Returns:
+            dict: The compact context, with a "ctx_id" key instead of the shared fields
+        """
+        compact = {
+            key: value for key, value in ctx.items() if key not in SHARED_CTX_FIELDS
+        }
+        compact["ctx_id"] = self.intern(ctx)
+
+        # the planner's memberships repeat the category fields too, they share the album's seller and contact
+        categories = ctx.get("categories")
+        if categories:
+            compact["categories"] = [
+                {
+                    key: value
+                    for key, value in membership.items()
+                    if key not in MEMBERSHIP_SHARED_FIELDS
+                }
+                | {
+                    "ctx_id": self.intern(
+                        {
+                            "seller": ctx["seller"],
+                            "contact": ctx["contact"],
+                            **membership,
+                        }
+                    )
+                }
+                for membership in categories
+            ]
+        return compact
+
+    def hydrate(self, compact):
+        """
+        Return the full context of a compact context, contexts without a "ctx_id" are returned as a copy.
+
+        Args:
+            compact (dict): A context returned by compact(), or a full context
+
+        Returns:
+            dict: The full context
+
+        Raises:
+            ValueError: If a context id is unknown
+        """
+        ctx = dict(compact)
+        ctx_id = ctx.pop("ctx_id", None)
+        if ctx_id is None:
+            return ctx
+
+        ctx.update(self.lookup(ctx_id))
+        categories = ctx.get("categories")
+        if categories:
+            ctx["categories"] = [self.hydrate_membership(m) for m in categories]
+        return ctx
+
+    def hydrate_membership(self, membership):
+        # memberships only carry the category fields, in the planner's field order
+        membership = dict(membership)
+        ctx_id = membership.pop("ctx_id", None)
+        if ctx_id is None:
+            return membership
+        shared = self.lookup(ctx_id)
+        return {field: shared[field] for field in MEMBERSHIP_SHARED_FIELDS} | membership
+
+    def hydrate_item(self, item):
+        """
+        Fill the shared fields of an item in place, and drop its context ids.
+
+        Args:
+            item (scrapy.Item | dict): An item built from a compact context
+
+        Returns:
+            scrapy.Item | dict: The same item
+        """
+        ctx_id = item.pop("ctx_id", None)
+        if ctx_id is None:
+            return item
+        for field, value in self.lookup(ctx_id).items():
+            item[field] = value
+        if item.get("categories"):
+            item["categories"] = [
+                self.hydrate_membership(m) for m in item["categories"]
+            ]
+        return item
+
+    def shared_fields(self, item):
+        """
+        Return the shared fields of an item, whether it is compact or already hydrated.
+
+        Args:
+            item (scrapy.Item | dict): The item
+
+        Returns:
+            dict: The shared fields, missing ones are left out
+        """
+        ctx_id = item.get("ctx_id")
+        if ctx_id is not None:
+            return self.lookup(ctx_id)
+        return {field: item[field] for field in SHARED_CTX_FIELDS if field in item}
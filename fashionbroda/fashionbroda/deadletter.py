@@ -0,0 +1,258 @@
+# Persistent dead-letter queue of the requests that failed after their retries
+#
+# When a category page, an album page or an image still failed once RetryMiddleware gave up, the only evidence used to be
+# a log line, and recovering meant re-running the whole spider. The spiders' errbacks and ImagesPipeline.item_completed
+# now record every such failure in CRAWL_STATE_DIR/deadletter.sqlite (DEADLETTER_PATH), one entry per spider and URL:
+#
+# - kind:     "category" (albums spider), "album" (images spider) or "media" (an image of an album)
+# - meta:     what the request needs to be sent again, the full (hydrated) ctx and, for category pages, the page count
+# - reason:   the last error, e.g. "HTTP 503" or "TimeoutError: ..."
+# - attempts: the failed download attempts so far, summed over the runs (retries of page requests included)
+#
+# An entry is removed as soon as its URL succeeds, in any run, so the store only lists what is still missing.
+# Each spider replays only its entries with -a deadletter=1, failed images are re-fetched through their album,
+# the images that are already stored are not downloaded again:
+#
+#   scrapy crawl albums -a deadletter=1
+#   scrapy crawl images -a deadletter=1 -s JOBDIR=crawls/images_deadletter
+#   python -m fashionbroda.deadletter  # list the entries per spider, kind and reason
+
+# import argparse for the command line interface
+import argparse
+
+# import json to store the request meta
+import json
+
+# import time to timestamp the failures
+import time
+
+# import Path to build the default store path
+from pathlib import Path
+
+# import the exceptions that are not failures of the site: a dropped request, or a response the spider did not handle
+from scrapy.exceptions import IgnoreRequest
+from scrapy.spidermiddlewares.httperror import HttpError
+
+# import the base class of the SQLite stores, it opens the file and batches the writes
+from fashionbroda.sqlitestore import SqliteStore
+
+# import the URL canonicalizer, entries are keyed by canonical URL so a success removes them whatever URL it came from
+from fashionbroda.urls import canonicalize_url
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS letters (
+    spider TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    first_failed REAL NOT NULL,
+    last_failed REAL NOT NULL,
+    PRIMARY KEY (spider, kind, url)
+) WITHOUT ROWID;
+"""
+
+
+def dead_letter_path(settings):
+    """Return the dead-letter store of a crawl, DEADLETTER_PATH or CRAWL_STATE_DIR/deadletter.sqlite."""
+    return settings.get("DEADLETTER_PATH") or str(
+        Path(settings.get("CRAWL_STATE_DIR")) / "deadletter.sqlite"
+    )
+
+
+class DeadLetterStore(SqliteStore):
+    """
+    The requests that failed after their retries, per spider, with what is needed to send them again.
+
+    Args:
+        path (str | Path): The SQLite file, created if it does not exist
+        commit_every (int): Number of writes grouped in one transaction
+    """
+
+    schema = SCHEMA
+    commit_every = 100
+
+    def record(self, spider, kind, url, meta, reason, attempts=1, now=None):
+        """
+        Record a failed request, an entry that failed before keeps its first failure time and adds up the attempts.
+
+        Args:
+            spider (str): The spider name
+            kind (str): "category", "album" or "media"
+            url (str): The request URL
+            meta (dict): JSON serializable meta to send the request again, e.g. {"ctx": {...}}
+            reason (str): Why it failed
+            attempts (int): Number of download attempts this failure stands for, retries included
+            now (float | None): The failure time, defaults to the current time
+        """
+        now = time.time() if now is None else now
+        self.write(
+            "INSERT INTO letters (spider, kind, url, meta, reason, attempts, first_failed, last_failed) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (spider, kind, url) DO UPDATE SET meta = excluded.meta, reason = excluded.reason, "
+            "attempts = attempts + excluded.attempts, last_failed = excluded.last_failed",
+            (
+                spider,
+                kind,
+                canonicalize_url(url),
+                json.dumps(meta, ensure_ascii=False),
+                reason,
+                attempts,
+                now,
+                now,
+            ),
+        )
+
+    def remove(self, spider, kind, url):
+        """Forget a request once it succeeded."""
+        self.write(
+            "DELETE FROM letters WHERE spider = ? AND kind = ? AND url = ?",
+            (spider, kind, canonicalize_url(url)),
+        )
+
+    def entries(self, spider, kinds=None):
+        """
+        Return the entries of a spider, oldest failure first.
+
+        Args:
+            spider (str): The spider name
+            kinds (tuple[str, ...] | None): Only the entries of these kinds
+
+        Returns:
+            list[tuple[str, str, dict, str, int]]: (kind, url, meta, reason, attempts) rows
+        """
+        sql = "SELECT kind, url, meta, reason, attempts FROM letters WHERE spider = ?"
+        params = [spider]
+        if kinds:
+            sql += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+        # fetch everything first, the replay removes entries while it consumes them
+        rows = self.db.execute(sql + " ORDER BY first_failed", params).fetchall()
+        return [
+            (kind, url, json.loads(meta), reason, attempts)
+            for kind, url, meta, reason, attempts in rows
+        ]
+
+    def summary(self):
+        """Return (spider, kind, reason, entries, attempts) rows, the most frequent failures first."""
+        return self.db.execute(
+            "SELECT spider, kind, reason, COUNT(*), SUM(attempts) FROM letters "
+            "GROUP BY spider, kind, reason ORDER BY spider, COUNT(*) DESC"
+        ).fetchall()
+
+    def purge(self, spider):
+        """Drop every entry of a spider, e.g. after the failed albums were removed from the site."""
+        self.write("DELETE FROM letters WHERE spider = ?", (spider,))
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def dead_letters(spider):
+    """
+    Return the dead-letter store of a spider, opened on first use, or None when dead letters are disabled.
+
+    A crawl replayed from the archive (ARCHIVE_REPLAY) never touches the site, ArchiveReplayAddon disables them.
+    """
+    settings = spider.crawler.settings
+    if not settings.getbool("DEADLETTER_ENABLED", True):
+        return None
+    store = getattr(spider, "_dead_letters", None)
+    if store is None:
+        store = spider._dead_letters = DeadLetterStore(dead_letter_path(settings))
+    return store
+
+
+def close_dead_letters(spider):
+    """Close the dead-letter store of a spider, if it was opened."""
+    store = getattr(spider, "_dead_letters", None)
+    if store is not None:
+        store.close()
+        spider._dead_letters = None
+
+
+def is_failure(failure):
+    """
+    Return True if a request failure should be recorded.
+
+    Requests dropped on purpose (tombstoned albums, offsite links, ...) raise IgnoreRequest, they did not fail,
+    HttpError is an IgnoreRequest too, but it means the site answered with an error status.
+    """
+    return failure.check(HttpError) is not None or failure.check(IgnoreRequest) is None
+
+
+def failure_reason(failure):
+    """Describe a request failure in one line, e.g. "HTTP 503" or "TimeoutError: ..."."""
+    if failure.check(HttpError):
+        return f"HTTP {failure.value.response.status}"
+    return f"{type(failure.value).__name__}: {failure.value}".rstrip(": ")
+
+
+def failed_attempts(request):
+    """Return how many times a request was downloaded before it failed for good, retries included."""
+    return request.meta.get("retry_times", 0) + 1
+
+
+def record_failure(spider, kind, failure, meta):
+    """
+    Record the failure of a spider request, it is the body of the spiders' errbacks.
+
+    Args:
+        spider (scrapy.Spider): The spider
+        kind (str): "category" or "album"
+        failure (twisted.python.failure.Failure): The failure passed to the errback
+        meta (dict): JSON serializable meta to send the request again
+    """
+    store = dead_letters(spider)
+    if store is None or not is_failure(failure):
+        return
+    request = failure.request
+    reason = failure_reason(failure)
+    spider.logger.warning(f"Dead letter ({kind}): {request.url} failed with {reason}")
+    spider.crawler.stats.inc_value(f"deadletter/{kind}")
+    # the first URL of a redirect chain, it is the one the spider requested
+    url = request.meta.get("redirect_urls", [request.url])[0]
+    store.record(spider.name, kind, url, meta, reason, failed_attempts(request))
+
+
+def record_success(spider, kind, response):
+    """Remove the entry of a request that succeeded, if it had failed before."""
+    store = dead_letters(spider)
+    if store is not None:
+        url = response.meta.get("redirect_urls", [response.url])[0]
+        store.remove(spider.name, kind, url)
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def main():
+    # default to the project's settings, the same ones the spiders use
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    parser = argparse.ArgumentParser(
+        description="List the dead-letter entries of every spider"
+    )
+    parser.add_argument(
+        "--path", default=dead_letter_path(settings), help="DEADLETTER_PATH"
+    )
+    parser.add_argument(
+        "--purge", metavar="SPIDER", help="drop every entry of this spider"
+    )
+    args = parser.parse_args()
+
+    store = DeadLetterStore(args.path)
+    if args.purge:
+        store.purge(args.purge)
+        print(f"Purged the dead letters of {args.purge}")
+    for spider, kind, reason, count, attempts in store.summary():
+        print(f"{spider} {kind}: {count} entries, {attempts} attempts, {reason}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+# Persistent Bloom filter dupefilter, so a new run can skip the albums earlier runs already processed
+#
+# The in-run dupefilter (SqliteDupeFilter, see queues.py) keeps its fingerprints in JOBDIR, and CleanJobDirExtension deletes JOBDIR
+# once a crawl finishes, so every run starts cold and fetches every album again.
+# BloomDupeFilter keeps a second, persistent set of fingerprints in CRAWL_STATE_DIR, outside JOBDIR:
+#
+# - only requests that opt in with meta={"persist_seen": True} are checked against it (album pages),
+#   category listing pages are never persisted, they are how new albums get discovered
+# - a fingerprint is recorded once the album's item went through every pipeline (item_scraped) with all its images
+#   downloaded (failed_images, set by ImagesPipeline), so an album whose page, parsing, pipelines or images failed
+#   is retried by the next run
+# - the set is a Bloom filter in a memory-mapped file: fixed size, whatever the number of fingerprints,
+#   with a false-positive rate chosen by DUPEFILTER_BLOOM_ERROR_RATE (a false positive skips an album that was never fetched)
+# - it is split into generations: when the newest one is full a new one is started, and the oldest ones are dropped,
+#   so old fingerprints age out and the false-positive rate stays bounded
+#
+# enable it with: scrapy crawl images -s DUPEFILTER_CLASS=fashionbroda.dupefilters.BloomDupeFilter
+# and manage it with: python -m fashionbroda.dupefilters inspect|reset|age <spider name>
+#
+# NOTE: a skipped album is not exported again, so images.json (written with overwrite: True) only lists the albums
+# this run fetched. Keep the previous runs' feeds, or reset the filter before a run that must export the whole catalog.
+#
+# NOTE: several processes may share one filter (e.g. shards), a concurrent write can very rarely lose a bit,
+# which only means an album is fetched again.
+
+# import argparse for the command line interface
+import argparse
+
+# import math to size the filter from its capacity and error rate
+import math
+
+# import mmap to map the filter file into memory, pages are loaded by the OS on demand
+import mmap
+
+# import struct to read and write the file header
+import struct
+
+# import time to record when a generation was created
+import time
+
+# import Path to manage the generation files
+from pathlib import Path
+
+# import Scrapy signals to record fingerprints once their item is scraped
+from scrapy import signals
+
+# import Response, the item signals carry a Failure instead when the item came from an errback
+from scrapy.http import Response
+
+# import the JOBDIR helper, so the in-run fingerprints keep working with pause / resume
+from scrapy.utils.job import job_dir
+
+# import the SQLite JOBDIR dupefilter, it still deduplicates every request within a run
+from fashionbroda.queues import SqliteDupeFilter
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# file header: magic, version, number of hash functions, number of bits, capacity, count, error rate, creation time
+HEADER = struct.Struct("<8sIIQQQdd")
+# the bit array starts after a fixed size header, so the header can grow without moving the bits
+HEADER_SIZE = 64
+MAGIC = b"FBBLOOM1"
+VERSION = 1
+
+# offset of the count field in the header, it is updated in place on every new fingerprint
+COUNT_OFFSET = struct.calcsize("<8sIIQQ")
+
+
+class BloomFilter:
+    """
+    A Bloom filter of request fingerprints stored in a memory-mapped file.
+
+    Args:
+        path (str | Path): The filter file, created if it does not exist
+        capacity (int): Number of fingerprints the filter is sized for, used when the file is created
+        error_rate (float): False-positive rate at capacity, used when the file is created
+    """
+
+    def __init__(self, path, capacity=10_000_000, error_rate=0.001):
+        self.path = Path(path)
+        if not self.path.exists():
+            self.create(self.path, capacity, error_rate)
+
+        self.file = open(self.path, "r+b")
+        self.mmap = mmap.mmap(self.file.fileno(), 0)
+        (
+            magic,
+            version,
+            self.num_hashes,
+            self.num_bits,
+            self.capacity,
+            self.count,
+            self.error_rate,
+            self.created,
+        ) = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{self.path} is not a Bloom filter file")
+
+    @staticmethod
+    def create(path, capacity, error_rate):
+        # optimal size for n items at false-positive rate p: m = -n ln(p) / ln(2)^2 bits and k = m / n ln(2) hash functions
+        num_bits = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(
+                HEADER.pack(
+                    MAGIC,
+                    VERSION,
+                    num_hashes,
+                    num_bits,
+                    capacity,
+                    0,
+                    error_rate,
+                    time.time(),
+                ).ljust(HEADER_SIZE, b"\0")
+            )
+            # a sparse file, the blocks are only allocated once bits are set in them
+            f.truncate(HEADER_SIZE + (num_bits + 7) // 8)
+
+    def positions(self, fingerprint):
+        # double hashing: the fingerprint is already a uniform hash (SHA1), so its first 16 bytes give two independent 64 bit hashes
+        h1 = int.from_bytes(fingerprint[:8], "little")
+        h2 = int.from_bytes(fingerprint[8:16], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def __contains__(self, fingerprint):
+        data = self.mmap
+        for bit in self.positions(fingerprint):
+            if not data[HEADER_SIZE + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def add(self, fingerprint):
+        """
+        Add a fingerprint to the filter.
+
+        Args:
+            fingerprint (bytes): A request fingerprint, at least 16 bytes
+
+        Returns:
+            bool: True if the fingerprint was (probably) already in the filter
+        """
+        data = self.mmap
+        present = True
+        for bit in self.positions(fingerprint):
+            offset = HEADER_SIZE + (bit >> 3)
+            mask = 1 << (bit & 7)
+            if not data[offset] & mask:
+                data[offset] |= mask
+                present = False
+        if not present:
+            self.count += 1
+            struct.pack_into("<Q", data, COUNT_OFFSET, self.count)
+        return present
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def estimated_error_rate(self):
+        """Return the current false-positive rate, estimated from the number of fingerprints added."""
+        return (
+            1 - math.exp(-self.num_hashes * self.count / self.num_bits)
+        ) ** self.num_hashes
+
+    def flush(self):
+        self.mmap.flush()
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class GenerationalBloomFilter:
+    """
+    A set of Bloom filter generations in one directory, the newest one takes new fingerprints.
+
+    A fingerprint is present if any generation contains it. When the newest generation is full, a new one is started,
+    and only the `generations` newest ones are kept, so the oldest fingerprints are forgotten.
+
+    Args:
+        directory (str | Path): Directory of the generation files
+        capacity (int): Capacity of each generation
+        error_rate (float): False-positive rate of each generation at capacity
+        generations (int): Number of generations kept
+    """
+
+    def __init__(self, directory, capacity=10_000_000, error_rate=0.001, generations=2):
+        self.directory = Path(directory)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.generations = generations
+        self.filters = [BloomFilter(path) for path in self.generation_paths()]
+        if not self.filters:
+            self.rotate()
+
+    def generation_paths(self):
+        return sorted(self.directory.glob("gen-*.bloom"))
+
+    def rotate(self):
+        """Start a new generation, and drop the oldest ones beyond the number of generations kept."""
+        paths = self.generation_paths()
+        number = int(paths[-1].stem.split("-")[1]) + 1 if paths else 1
+        path = self.directory / f"gen-{number:06d}.bloom"
+        self.filters.append(BloomFilter(path, self.capacity, self.error_rate))
+        while len(self.filters) > self.generations:
+            oldest = self.filters.pop(0)
+            oldest.close()
+            oldest.path.unlink()
+
+    def __contains__(self, fingerprint):
+        # the newest generation is the most likely to contain a recent fingerprint, check it first
+        return any(fingerprint in bloom for bloom in reversed(self.filters))
+
+    def add(self, fingerprint):
+        if fingerprint in self:
+            return True
+        if self.filters[-1].full:
+            self.rotate()
+        self.filters[-1].add(fingerprint)
+        return False
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    def close(self):
+        for bloom in self.filters:
+            bloom.flush()
+            bloom.close()
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class BloomDupeFilter(SqliteDupeFilter):
+    """
+    SqliteDupeFilter that also skips the requests processed by previous runs, remembered in a persistent Bloom filter.
+
+    Settings:
+        DUPEFILTER_BLOOM_DIR: Directory of the filters, defaults to CRAWL_STATE_DIR/seen, one subdirectory per spider
+        DUPEFILTER_BLOOM_CAPACITY: Number of fingerprints per generation
+        DUPEFILTER_BLOOM_ERROR_RATE: False-positive rate of a full generation
+        DUPEFILTER_BLOOM_GENERATIONS: Number of generations kept before the oldest fingerprints are forgotten
+    """
+
+    def __init__(self, crawler, path=None, debug=False):
+        super().__init__(
+            path,
+            debug,
+            fingerprinter=crawler.request_fingerprinter,
+            commit_every=crawler.settings.getint("SQLITE_QUEUE_COMMIT_EVERY", 500),
+        )
+        self.crawler = crawler
+        self.bloom = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dupefilter = cls(
+            crawler,
+            job_dir(crawler.settings),
+            crawler.settings.getbool("DUPEFILTER_DEBUG"),
+        )
+        # record an album once its item is scraped, not when it is scheduled or its page came back,
+        # so an album that failed anywhere between the download and the last pipeline is retried next run
+        crawler.signals.connect(dupefilter.item_scraped, signal=signals.item_scraped)
+        return dupefilter
+
+    def open(self):
+        settings = self.crawler.settings
+        directory = settings.get("DUPEFILTER_BLOOM_DIR") or str(
+            Path(settings.get("CRAWL_STATE_DIR")) / "seen"
+        )
+        self.bloom = GenerationalBloomFilter(
+            Path(directory) / self.crawler.spider.name,
+            capacity=settings.getint("DUPEFILTER_BLOOM_CAPACITY", 10_000_000),
+            error_rate=settings.getfloat("DUPEFILTER_BLOOM_ERROR_RATE", 0.001),
+            generations=settings.getint("DUPEFILTER_BLOOM_GENERATIONS", 2),
+        )
+        self.logger.info(
+            f"Persistent dupefilter {self.bloom.directory} holds ~{len(self.bloom)} fingerprints"
+        )
+
+    def request_seen(self, request):
+        # requests processed by a previous run are skipped, the rest goes through the usual in-run deduplication
+        if (
+            request.meta.get("persist_seen")
+            and self.fingerprinter.fingerprint(request) in self.bloom
+        ):
+            self.crawler.stats.inc_value("dupefilter/persistent_filtered")
+            return True
+        return super().request_seen(request)
+
+    def item_scraped(self, item, response, spider):
+        if not isinstance(response, Response) or response.request is None:
+            return
+        request = response.request
+        if not request.meta.get("persist_seen"):
+            return
+        # some images of the album failed, it stays unseen so the next run fetches them again
+        if item.get("failed_images"):
+            self.crawler.stats.inc_value("dupefilter/persistent_incomplete")
+            return
+        if not self.bloom.add(self.fingerprinter.fingerprint(request)):
+            self.crawler.stats.inc_value("dupefilter/persistent_added")
+
+    def close(self, reason):
+        super().close(reason)
+        if self.bloom is not None:
+            self.bloom.close()
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def main():
+    # default to the project's CRAWL_STATE_DIR, the same directory the dupefilter uses
+    from fashionbroda.settings import CRAWL_STATE_DIR
+
+    parser = argparse.ArgumentParser(
+        description="Inspect, reset or age out the persistent Bloom dupefilter of a spider"
+    )
+    parser.add_argument("command", choices=("inspect", "reset", "age"))
+    parser.add_argument("spider", help="spider name, e.g. images")
+    parser.add_argument(
+        "--dir",
+        default=str(Path(CRAWL_STATE_DIR) / "seen"),
+        help="DUPEFILTER_BLOOM_DIR",
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        default=1,
+        help="age: number of existing generations to keep next to the new one, the older ones are dropped",
+    )
+    args = parser.parse_args()
+
+    directory = Path(args.dir) / args.spider
+    paths = sorted(directory.glob("gen-*.bloom"))
+
+    if args.command == "inspect":
+        if not paths:
+            print(f"No filter in {directory}")
+            return
+        for path in paths:
+            bloom = BloomFilter(path)
+            print(
+                f"{path.name}: {bloom.count}/{bloom.capacity} fingerprints, "
+                f"{bloom.num_bits // 8} bytes, {bloom.num_hashes} hashes, "
+                f"error rate {bloom.estimated_error_rate():.2e} (target {bloom.error_rate:.0e}), "
+                f"created {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(bloom.created))}"
+            )
+            bloom.close()
+
+    elif args.command == "reset":
+        for path in paths:
+            path.unlink()
+        print(f"Removed {len(paths)} generations from {directory}")
+
+    elif args.command == "age":
+        if not paths:
+            print(f"No filter in {directory}")
+            return
+        # start a new generation sized like the newest one, then drop everything older than the `keep` newest existing ones
+        newest = BloomFilter(paths[-1])
+        capacity, error_rate = newest.capacity, newest.error_rate
+        newest.close()
+        bloom = GenerationalBloomFilter(
+            directory, capacity, error_rate, generations=args.keep + 1
+        )
+        bloom.rotate()
+        bloom.close()
+        kept = min(len(paths), args.keep)
+        print(f"Started a new generation, kept {kept} and dropped {len(paths) - kept}")
+
+
+if __name__ == "__main__":
+    main()
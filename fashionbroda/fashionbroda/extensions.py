@@ -1,7 +1,19 @@
+# import math to place the lag samples in log-scaled histogram buckets
+import math
 import os
 import shutil
 
+# import sys, threading, time and traceback for the reactor lag watchdog, it runs in its own thread
+import sys
+import threading
+import time
+import traceback
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet.task import LoopingCall
+
+from fashionbroda.queues import compact_queue_files
 
 
 class CleanJobDirExtension:
@@ -9,6 +21,11 @@ class CleanJobDirExtension:
     This extension automatically deletes the JOBDIR directory when a spider
     finishes successfully. This ensures that the next run starts fresh
     unless the previous run was interrupted mid-operation.
+
+    When the run is interrupted instead, the SQLite disk queues in JOBDIR
+    (see queues.py) are compacted, so the paused crawl takes no more disk
+    space than its pending requests and resumes from one file per queue.
+    The dupefilter table (requests.seen.sqlite) is compacted with them.
     """
 
     @classmethod
@@ -39,3 +56,191 @@ class CleanJobDirExtension:
                     spider.logger.debug(
                         f"JOBDIR {jobdir} does not exist, skipping cleanup."
                     )
+            return
+
+        # the crawl was interrupted, keep JOBDIR for the resume but give back the space of the requests already popped
+        jobdir = spider.settings.get("JOBDIR")
+        if (
+            jobdir
+            and os.path.exists(jobdir)
+            and spider.settings.getbool("JOBDIR_COMPACT", True)
+        ):
+            try:
+                compacted, reclaimed = compact_queue_files(jobdir)
+            except Exception as e:
+                spider.logger.error(f"Failed to compact JOBDIR {jobdir}: {e}")
+                return
+            if compacted:
+                spider.logger.info(
+                    f"Compacted {compacted} queue files in JOBDIR {jobdir}, reclaimed {reclaimed} bytes"
+                )
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class LagHistogram:
+    """
+    Histogram of lag samples in log-scaled buckets, its size is fixed however long the crawl runs.
+
+    Bucket 0 holds the lags up to `smallest`, bucket i the lags up to smallest * growth**i, and the last bucket
+    everything above. A percentile is the upper bound of its bucket, so it is at most `growth` times the true value.
+
+    Args:
+        smallest (float): Upper bound of the first bucket, in seconds
+        largest (float): Lag from which every sample falls in the last bucket, in seconds
+        growth (float): Ratio between the bounds of two consecutive buckets
+    """
+
+    def __init__(self, smallest=0.001, largest=600.0, growth=1.05):
+        self.smallest = smallest
+        self.growth = growth
+        self.counts = [0] * (math.ceil(math.log(largest / smallest, growth)) + 1)
+        self.count = 0
+        # the largest lag is kept exactly, it bounds the last bucket and the percentiles
+        self.max = 0.0
+
+    def add(self, lag):
+        if lag <= self.smallest:
+            index = 0
+        else:
+            index = min(
+                len(self.counts) - 1,
+                math.ceil(math.log(lag / self.smallest, self.growth)),
+            )
+        self.counts[index] += 1
+        self.count += 1
+        self.max = max(self.max, lag)
+
+    def percentile(self, fraction):
+        """Return the nearest-rank percentile of the samples, e.g. fraction=0.99 for p99, 0 when there are none."""
+        if not self.count:
+            return 0
+        rank = min(self.count, max(1, round(fraction * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        # the last bucket has no upper bound, the largest lag is the only one known
+        if index == len(self.counts) - 1:
+            return self.max
+        return min(self.max, self.smallest * self.growth**index)
+
+
+class ReactorLagMonitor:
+    """
+    Measure how late the reactor runs its timed calls, and show what blocks it when it stalls.
+
+    Everything in a crawl (downloads, callbacks, pipelines, middlewares) runs on the reactor thread, so one slow
+    parse or a blocking call in a pipeline stops all of them. A LoopingCall samples the loop every REACTOR_LAG_INTERVAL
+    seconds: the lag is how long after its scheduled time the sample ran. The samples are summarized in the stats when
+    the spider closes (reactor_lag/p50_ms, p90_ms, p99_ms, max_ms, samples, and stalls above the threshold), they are
+    kept in a fixed-size histogram (LagHistogram), so the percentiles are within 5% and memory does not grow with the run.
+
+    A watchdog thread notices when no sample ran for more than REACTOR_LAG_THRESHOLD seconds past its scheduled time,
+    while the reactor is still blocked, and logs the stack of the reactor thread, i.e. the code that blocks it.
+
+    Settings:
+        REACTOR_LAG_ENABLED: Turn the monitor on, on by default
+        REACTOR_LAG_INTERVAL: Seconds between two samples
+        REACTOR_LAG_THRESHOLD: Lag in seconds from which the reactor counts as stalled and its stack is logged
+        REACTOR_LAG_MAX_DUMPS: Most stacks logged per run, so a crawl that keeps stalling does not flood the log
+    """
+
+    def __init__(self, crawler, interval, threshold, max_dumps):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = interval
+        self.threshold = threshold
+        self.max_dumps = max_dumps
+        self.samples = LagHistogram()
+        self.ticks = 0
+        self.task = None
+        # set on the reactor thread at every sample, read by the watchdog
+        self.heartbeat = time.monotonic()
+        self.reactor_thread = None
+        self.watchdog = None
+        self.stopped = threading.Event()
+        self.dumps = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("REACTOR_LAG_ENABLED", True):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            interval=settings.getfloat("REACTOR_LAG_INTERVAL", 0.5),
+            threshold=settings.getfloat("REACTOR_LAG_THRESHOLD", 2.0),
+            max_dumps=settings.getint("REACTOR_LAG_MAX_DUMPS", 5),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        # spider_opened is sent on the reactor thread, the one the watchdog inspects
+        self.reactor_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        # withCount: a late sample is told how many intervals passed, its lag is measured against the first one it missed
+        self.task = LoopingCall.withCount(self.sample)
+        self.task.start(self.interval, now=False)
+        self.watchdog = threading.Thread(
+            target=self.watch, name="reactor-lag-watchdog", daemon=True
+        )
+        self.watchdog.start()
+
+    def sample(self, count):
+        scheduled = self.task.starttime + (self.ticks + 1) * self.interval
+        self.ticks += count
+        lag = max(0.0, self.task.clock.seconds() - scheduled)
+        self.heartbeat = time.monotonic()
+        self.samples.add(lag)
+        if lag >= self.threshold:
+            self.stats.inc_value("reactor_lag/stalls")
+            self.crawler.spider.logger.warning(
+                f"Reactor was blocked for {lag:.2f}s (REACTOR_LAG_THRESHOLD is {self.threshold}s)"
+            )
+
+    def watch(self):
+        # the heartbeat of the stall whose stack was already logged, a stall is only dumped once
+        dumped = None
+        while not self.stopped.wait(min(self.interval, self.threshold / 2)):
+            heartbeat = self.heartbeat
+            late = time.monotonic() - heartbeat - self.interval
+            if late < self.threshold or heartbeat == dumped:
+                continue
+            dumped = heartbeat
+            if self.dumps >= self.max_dumps:
+                continue
+            frame = sys._current_frames().get(self.reactor_thread)
+            if frame is None:
+                continue
+            self.dumps += 1
+            stack = "".join(traceback.format_stack(frame))
+            self.crawler.spider.logger.warning(
+                f"Reactor blocked for {late:.2f}s so far, reactor thread stack:\n{stack}"
+            )
+            # the innermost frame, so the stats tell where the last stall was without reading the log
+            code = frame.f_code
+            self.stats.set_value(
+                "reactor_lag/last_stall_at",
+                f"{code.co_filename}:{frame.f_lineno} in {code.co_name}",
+            )
+            self.stats.set_value("reactor_lag/stack_dumps", self.dumps)
+
+    def spider_closed(self, spider, reason):
+        self.stopped.set()
+        if self.task is not None and self.task.running:
+            self.task.stop()
+        if self.watchdog is not None:
+            self.watchdog.join()
+
+        self.stats.set_value("reactor_lag/samples", self.samples.count)
+        for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            self.stats.set_value(
+                f"reactor_lag/{name}_ms",
+                round(self.samples.percentile(fraction) * 1000, 1),
+            )
+        self.stats.set_value("reactor_lag/max_ms", round(self.samples.max * 1000, 1))
@@ -0,0 +1,124 @@
+# Fast extractor for yupoo album pages, used by ImagesSpider.parse_album
+#
+# parse_album used to run two contains(@class, ...) XPath scans over the whole DOM, a third one for the description meta tag,
+# a re.sub() per description line and a response.urljoin() per image URL, for every album of the catalog.
+# extract_album() walks the parsed tree once, only visiting <img> and <meta> elements, uses precompiled patterns,
+# and joins all image URLs against the page's base URL computed once. The description is normalized by normalize.py.
+#
+# The output is the same as the XPath version's, in the same document order, tests/test_extractors.py compares both
+# on the built-in fixture pages of bench_parse.py, and bench_parse.py --check on the pages of the crawl archive (see archive.py).
+#
+# With IMAGES_PARSE_WORKERS > 0, ExtractorPool runs extract_album() in worker processes: the spider ships the page body
+# and gets plain lists and dicts back, so HTML parsing no longer blocks the reactor thread (downloads, pipelines, middlewares)
+# and the images spider uses more than one core without being split into shard processes.
+
+# import asyncio to await the worker processes from the asyncio reactor
+import asyncio
+
+# import multiprocessing and the process pool that runs the extractions
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# import urljoin to join the image URLs against the base URL, like response.urljoin() does
+from urllib.parse import urljoin
+
+# import Scrapy's base URL helper, it honours the page's <base href> tag like response.urljoin()
+from scrapy.utils.response import get_base_url
+
+# import the response class the worker processes rebuild the page with
+from scrapy.http import HtmlResponse
+
+# import the shared product_data normalizer
+from fashionbroda.normalize import normalize_description
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# the class names of the product photos and of the size charts, matched as substrings like XPath's contains()
+PRODUCT_IMAGE_CLASS = "image__portrait"
+SIZE_CHART_CLASS = "image__landscape"
+
+
+def extract_album(response):
+    """
+    Extract the image URLs and the product description of an album page in a single pass over its tree.
+
+    Args:
+        response (scrapy.http.HtmlResponse): An album page
+
+    Returns:
+        tuple[list[str], list[str], dict]: (product image URLs, size chart image URLs, product data)
+    """
+    product_paths = []
+    size_chart_paths = []
+    raw_description = None
+
+    # the tree parsel already built for the response, so nothing is parsed twice
+    for element in response.selector.root.iter("img", "meta"):
+        if element.tag == "img":
+            src = element.get("data-origin-src")
+            if src is None:
+                continue
+            css_class = element.get("class") or ""
+            # an image can carry both classes, like the XPath version it then goes to both lists
+            if PRODUCT_IMAGE_CLASS in css_class:
+                product_paths.append(src.strip())
+            if SIZE_CHART_CLASS in css_class:
+                size_chart_paths.append(src.strip())
+        # only the first description meta tag that has a content counts, like //meta[@name='description']/@content .get(),
+        # a tag without one is skipped, not taken as an empty description
+        elif raw_description is None and element.get("name") == "description":
+            content = element.get("content")
+            if content is not None:
+                raw_description = content
+
+    base_url = get_base_url(response)
+    return (
+        [urljoin(base_url, path) for path in product_paths],
+        [urljoin(base_url, path) for path in size_chart_paths],
+        normalize_description(raw_description),
+    )
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def extract_album_page(url, body, encoding):
+    """
+    Rebuild an album page from its body and extract it, the function the worker processes run.
+
+    Args:
+        url (str): The page URL, image URLs are joined against it (or its <base href>)
+        body (bytes): The page body
+        encoding (str): The page encoding, as the spider's response detected it
+
+    Returns:
+        tuple[list[str], list[str], dict]: The same as extract_album()
+    """
+    return extract_album(HtmlResponse(url=url, body=body, encoding=encoding))
+
+
+class ExtractorPool:
+    """
+    Worker processes that extract album pages off the reactor thread.
+
+    Args:
+        workers (int): Number of worker processes
+    """
+
+    def __init__(self, workers):
+        # spawned, not forked: forking the crawler process would copy its reactor, threads and open files into every worker
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def extract(self, response):
+        """Extract an album page in a worker process, see extract_album()."""
+        return await asyncio.wrap_future(
+            self.executor.submit(
+                extract_album_page, response.url, response.body, response.encoding
+            )
+        )
+
+    def close(self):
+        # the crawl is over, pending extractions have nowhere to go
+        self.executor.shutdown(wait=True, cancel_futures=True)
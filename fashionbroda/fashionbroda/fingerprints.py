@@ -0,0 +1,154 @@
+# Album change fingerprints, so downstream steps only reprocess the albums that changed
+#
+# Every images run rewrites images.json in full, so clean_json, slug, supabaseupload and sdb_upload reprocess the whole catalog.
+# album_fingerprint() hashes what an album page contains (its image URLs and its normalized product data),
+# and AlbumFingerprintStore keeps the fingerprint of every album from the previous run in CRAWL_STATE_DIR,
+# so each album of this run can be classified as:
+#
+# - added:     the album was never fingerprinted before
+# - changed:   its fingerprint differs from the previous run
+# - unchanged: same fingerprint, downstream steps can skip it
+#
+# changed_albums() reads the images_delta feed back: clean_json only cleans the added and changed albums,
+# and sdb_upload only uploads them.
+#
+# The new fingerprints are only staged while the crawl runs, and become the reference for the next run once the crawl finished,
+# so an interrupted run does not hide its changes from the next one.
+
+# import hashlib to hash the album contents
+import hashlib
+
+# import os to tell the runs of concurrent processes apart
+import os
+
+# import json to serialize the album contents in a stable form
+import json
+
+# import time to record when an album was last seen
+import time
+
+# import Path to check for the delta feed
+from pathlib import Path
+
+# import the manifest reader, to stream the delta feed
+from fashionbroda.manifests import iter_manifest
+
+# import the album identity, so the same album listed with another ?referrercate= keeps its fingerprint
+from fashionbroda.planner import album_key
+
+# import the base class of the SQLite stores, it opens the file and batches the writes
+from fashionbroda.sqlitestore import SqliteStore
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# the fields that make up an album's content, the category context is not part of it
+FINGERPRINT_FIELDS = ("product_images", "size_chart_images", "product_data")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+    album TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    pending TEXT,
+    pending_run TEXT,
+    last_seen REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def album_fingerprint(item):
+    """
+    Return the fingerprint of an album's content.
+
+    product_data is serialized with sorted keys, so the same data always hashes the same,
+    whatever order the description lines were parsed in.
+
+    Args:
+        item (ImageItem | dict): The parsed album
+
+    Returns:
+        str: A SHA1 hexadecimal digest
+    """
+    content = {field: item.get(field) for field in FINGERPRINT_FIELDS}
+    serialized = json.dumps(
+        content, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha1(serialized.encode()).hexdigest()
+
+
+def changed_albums(delta_path):
+    """
+    Return the albums the images_delta feed lists as added or changed, the ones downstream steps must process.
+
+    Args:
+        delta_path (str | Path): The images_delta.jsonl feed of the last images run
+
+    Returns:
+        set[str] | None: Their album keys (see planner.album_key), None when there is no delta feed and everything must be processed
+    """
+    if not Path(delta_path).exists():
+        return None
+    return {
+        album_key(row["album_url"])
+        for row in iter_manifest(delta_path)
+        if row.get("album_url") and row.get("change_status") != "unchanged"
+    }
+
+
+class AlbumFingerprintStore(SqliteStore):
+    """
+    The fingerprints of the previous run, and the staged fingerprints of the current one.
+
+    Several processes (e.g. shards) can share the store, each one only promotes the fingerprints it staged itself.
+
+    Args:
+        path (str | Path): The SQLite file, created if it does not exist
+        commit_every (int): Number of albums staged per transaction
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, path, commit_every=None):
+        super().__init__(path, commit_every)
+        # the id of this run, so close() only promotes the fingerprints this process staged
+        self.run_id = f"{os.getpid()}-{time.time()}"
+
+    def classify(self, album_url, fingerprint):
+        """
+        Compare an album's fingerprint with the previous run, and stage it for the next run.
+
+        Args:
+            album_url (str): The album URL
+            fingerprint (str): The album's fingerprint in this run
+
+        Returns:
+            str: "added", "changed" or "unchanged"
+        """
+        key = album_key(album_url)
+        row = self.db.execute(
+            "SELECT fingerprint FROM albums WHERE album = ?", (key,)
+        ).fetchone()
+        # written in batches, other processes sharing the store wait for our write lock in between
+        self.write(
+            "INSERT INTO albums (album, pending, pending_run, last_seen) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (album) DO UPDATE SET pending = excluded.pending, "
+            "pending_run = excluded.pending_run, last_seen = excluded.last_seen",
+            (key, fingerprint, self.run_id, time.time()),
+        )
+        if row is None or row[0] is None:
+            return "added"
+        return "unchanged" if row[0] == fingerprint else "changed"
+
+    def close(self, promote):
+        """
+        Commit the staged fingerprints, and make them the reference for the next run when promote is True.
+
+        Args:
+            promote (bool): True when the crawl finished, False when it was interrupted
+        """
+        if promote:
+            self.write(
+                "UPDATE albums SET fingerprint = pending, pending = NULL, pending_run = NULL "
+                "WHERE pending_run = ?",
+                (self.run_id,),
+            )
+        super().close()
@@ -0,0 +1,477 @@
+# Shared on-disk crawl frontier, so several worker processes (or boxes) can work through one crawl
+#
+# Scrapy's default scheduler keeps its queue in memory, or in JOBDIR files that only one process can use at a time,
+# so a running crawl can't take on more workers. FrontierScheduler replaces the scheduler with a SQLite file
+# that every worker opens (a local disk, or a network share for several boxes):
+#
+# - enqueue: a request is stored once, the "seen" table deduplicates fingerprints across all workers
+# - lease:   a worker takes a batch of pending requests and marks them as leased until now + FRONTIER_LEASE_SECS
+# - ack:     a row is deleted once its request is completely done: the callback's output consumed and every item it
+#            yielded through the item pipelines (image downloads included), or the errback run for a failed request.
+#            A retry, a redirect or a re-enqueued copy of a leased request gets a new row, which replaces the old one
+# - renew:   a worker extends its leases while it still works on them, so a slow album is not handed to another worker
+# - re-lease: if a worker dies, its leases expire and the requests become available to the other workers again,
+#            whatever it was doing with them (downloading, parsing, downloading images) is done again by another worker
+#
+# so scaling out is just "start another worker":
+#   scrapy crawl images -s SCHEDULER=fashionbroda.frontier.FrontierScheduler
+#
+# NOTE: SQLite WAL mode does not work over network file systems, so the frontier uses the default rollback journal,
+# and every write is a short BEGIN IMMEDIATE transaction to keep lock hold times small.
+#
+# The scheduler only sees requests go in and out, FrontierAckMiddleware tells it when the work of a request is done:
+# as a spider middleware it follows the callback output, as a downloader middleware it catches the failed requests.
+
+# import os and socket to build a default worker id (host:pid)
+import os
+import socket
+
+# import pickle to serialize the request dicts, the same format Scrapy's own disk queues use
+import pickle
+
+# import sqlite3 for the file-backed queue, it is part of the standard library
+import sqlite3
+
+# import time for lease expiry timestamps
+import time
+
+# import deque to hold the batch of requests leased in one transaction
+from collections import deque
+
+# import Path to build the default frontier path
+from pathlib import Path
+
+# import Scrapy signals to ack requests once their items are done
+from scrapy import signals
+
+# import Scrapy's scheduler interface
+from scrapy.core.scheduler import BaseScheduler
+
+# import the exception that disables the ack middleware when another scheduler is used
+from scrapy.exceptions import NotConfigured
+
+# import the Response class to tell the items of a page from the items of an errback, and the item check of the callback output
+from scrapy.http import Response
+from itemadapter import is_item
+
+# import load_object to check the configured scheduler class
+from scrapy.utils.misc import load_object
+
+# import the helper that turns a serialized request dict back into a Request bound to the spider callbacks
+from scrapy.utils.request import request_from_dict
+
+# import LoopingCall to renew the leases on a timer
+from twisted.internet.task import LoopingCall
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    spider TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    payload BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_next ON requests (spider, priority DESC, id);
+CREATE TABLE IF NOT EXISTS seen (
+    spider TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    PRIMARY KEY (spider, fingerprint)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteFrontier:
+    """
+    A request queue with leases, stored in one SQLite file shared by every worker.
+
+    Rows are scoped by spider name, so albums and images workers can share the same file.
+    A row is pending when its lease has expired (lease_expires < now), leased otherwise, and deleted once acked.
+    """
+
+    def __init__(self, path, timeout=60.0):
+        # make sure the parent directory exists, then open the database,
+        # isolation_level=None lets us control transactions explicitly with BEGIN IMMEDIATE
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(path)
+        self.db = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def push(self, spider, priority, payload, fingerprint=None):
+        """
+        Store a request, unless its fingerprint was already seen by any worker.
+
+        Args:
+            spider (str): Spider name
+            priority (int): Request priority, higher is leased first
+            payload (bytes): Serialized request
+            fingerprint (str, optional): Request fingerprint, None for dont_filter requests
+
+        Returns:
+            bool: True if the request was stored, False if it was a duplicate
+        """
+        with self.transaction():
+            if fingerprint is not None:
+                cursor = self.db.execute(
+                    "INSERT OR IGNORE INTO seen (spider, fingerprint) VALUES (?, ?)",
+                    (spider, fingerprint),
+                )
+                # rowcount is 0 when the fingerprint was already there
+                if cursor.rowcount == 0:
+                    return False
+            self.db.execute(
+                "INSERT INTO requests (spider, priority, payload) VALUES (?, ?, ?)",
+                (spider, priority, payload),
+            )
+        return True
+
+    def lease(self, spider, owner, lease_secs, batch=1):
+        """
+        Lease up to `batch` pending requests, highest priority first.
+
+        Args:
+            spider (str): Spider name
+            owner (str): Worker id that holds the lease
+            lease_secs (float): How long the lease lasts before other workers may take the request
+            batch (int): Maximum number of requests to lease
+
+        Returns:
+            list[tuple[int, bytes]]: (row id, payload) pairs
+        """
+        now = time.time()
+        with self.transaction():
+            rows = self.db.execute(
+                "SELECT id, payload FROM requests WHERE spider = ? AND lease_expires < ? "
+                "ORDER BY priority DESC, id LIMIT ?",
+                (spider, now, batch),
+            ).fetchall()
+            self.db.executemany(
+                "UPDATE requests SET lease_owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                [(owner, now + lease_secs, row_id) for row_id, _ in rows],
+            )
+        return rows
+
+    def ack(self, row_id):
+        """Delete a completed request."""
+        with self.transaction():
+            self.db.execute("DELETE FROM requests WHERE id = ?", (row_id,))
+
+    def renew(self, spider, owner, lease_secs):
+        """Extend every lease held by a worker, it is still working on those requests."""
+        with self.transaction():
+            self.db.execute(
+                "UPDATE requests SET lease_expires = ? WHERE spider = ? AND lease_owner = ?",
+                (time.time() + lease_secs, spider, owner),
+            )
+
+    def release(self, spider, owner):
+        """Give back every lease held by a worker, so the others can take the requests right away."""
+        with self.transaction():
+            self.db.execute(
+                "UPDATE requests SET lease_owner = NULL, lease_expires = 0 WHERE spider = ? AND lease_owner = ?",
+                (spider, owner),
+            )
+
+    def count(self, spider):
+        """Return the number of pending and leased requests of a spider."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM requests WHERE spider = ?", (spider,)
+        ).fetchone()[0]
+
+    def has_rows(self, spider):
+        """Return True if a spider has any pending or leased request, without counting them all."""
+        return (
+            self.db.execute(
+                "SELECT 1 FROM requests WHERE spider = ? LIMIT 1", (spider,)
+            ).fetchone()
+            is not None
+        )
+
+    def reset_seen(self, spider):
+        """Forget the fingerprints of a spider, so the next run starts fresh."""
+        with self.transaction():
+            self.db.execute("DELETE FROM seen WHERE spider = ?", (spider,))
+
+    def close(self):
+        self.db.close()
+
+    # small context manager so every write is one short BEGIN IMMEDIATE ... COMMIT transaction
+    def transaction(self):
+        return _Transaction(self.db)
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        # IMMEDIATE takes the write lock up front, so two workers can never lease the same row
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class FrontierScheduler(BaseScheduler):
+    """
+    Scheduler that leases requests from a SqliteFrontier shared by every worker of a crawl.
+
+    Settings:
+        FRONTIER_PATH: Path of the SQLite file, defaults to CRAWL_STATE_DIR/frontier.sqlite
+        FRONTIER_LEASE_SECS: How long a leased request stays invisible to other workers
+        FRONTIER_LEASE_BATCH: How many requests are leased per database transaction
+        FRONTIER_WORKER_ID: Id of this worker, defaults to <hostname>:<pid>
+    """
+
+    def __init__(self, crawler, path, lease_secs, batch, worker_id):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.fingerprinter = crawler.request_fingerprinter
+        self.path = path
+        self.lease_secs = lease_secs
+        self.batch = batch
+        self.worker_id = worker_id
+        self.frontier = None
+        self.spider = None
+        # requests leased in the last transaction, handed to the engine one at a time
+        self.leased = deque()
+        # row id -> parts of its page still being processed: the callback output, plus every item it yielded
+        self.processing = {}
+        # extends the leases of this worker while it runs
+        self.renewal = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        path = settings.get("FRONTIER_PATH") or str(
+            Path(settings.get("CRAWL_STATE_DIR")) / "frontier.sqlite"
+        )
+        scheduler = cls(
+            crawler,
+            path=path,
+            lease_secs=settings.getfloat("FRONTIER_LEASE_SECS", 300),
+            batch=settings.getint("FRONTIER_LEASE_BATCH", 16),
+            worker_id=settings.get("FRONTIER_WORKER_ID")
+            or f"{socket.gethostname()}:{os.getpid()}",
+        )
+        # an item of a page is done once it was exported, dropped, or failed in a pipeline
+        for signal in (signals.item_scraped, signals.item_dropped, signals.item_error):
+            crawler.signals.connect(scheduler.item_done, signal=signal)
+        crawler.signals.connect(scheduler.spider_error, signal=signals.spider_error)
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        self.frontier = SqliteFrontier(self.path)
+        # FrontierAckMiddleware finds the scheduler on the spider
+        spider.frontier_scheduler = self
+        # keep the requests still being worked on, a page and its images can take longer than one lease,
+        # on a timer and not in next_request(), which the engine stops calling while the scraper is busy
+        self.renewal = LoopingCall(
+            self.frontier.renew, spider.name, self.worker_id, self.lease_secs
+        )
+        self.renewal.start(self.lease_secs / 3, now=False)
+        spider.logger.info(
+            f"Using shared frontier {self.path} as worker {self.worker_id} "
+            f"({self.frontier.count(spider.name)} requests pending)"
+        )
+
+    def close(self, reason):
+        if self.renewal is not None and self.renewal.running:
+            self.renewal.stop()
+        # hand back the requests we leased but did not finish, so other workers do not wait for the lease to expire
+        self.frontier.release(self.spider.name, self.worker_id)
+        # once the whole crawl is done (no rows left for any worker), forget the fingerprints so the next run starts fresh,
+        # just like CleanJobDirExtension does for JOBDIR
+        if reason == "finished" and not self.frontier.has_rows(self.spider.name):
+            self.frontier.reset_seen(self.spider.name)
+        self.frontier.close()
+
+    def has_pending_requests(self):
+        # requests leased by other workers count as pending: if one of those workers dies, we will re-lease them
+        return bool(self.leased) or self.frontier.has_rows(self.spider.name)
+
+    def enqueue_request(self, request):
+        fingerprint = (
+            None
+            if request.dont_filter
+            else self.fingerprinter.fingerprint(request).hex()
+        )
+        # never persist the row id of a previous lease, the new row gets its own id when it is leased
+        row_id = request.meta.pop("frontier_id", None)
+        payload = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        stored = self.frontier.push(
+            self.spider.name, request.priority, payload, fingerprint
+        )
+        # a leased request that comes back before its page was processed is a retry, a redirect or a re-enqueued copy
+        # (e.g. SessionMiddleware on a ban), its new row replaces the old one. A request yielded by a callback that
+        # passed its meta along is not, its parent row is acked once the page is done
+        if row_id is not None and row_id not in self.processing:
+            self.frontier.ack(row_id)
+            self.stats.inc_value("frontier/acked")
+        if not stored:
+            self.stats.inc_value("frontier/filtered")
+            return False
+        self.stats.inc_value("frontier/enqueued")
+        self.stats.inc_value("scheduler/enqueued")
+        return True
+
+    def next_request(self):
+        # refill the local batch from the shared frontier when it runs dry
+        if not self.leased:
+            self.leased.extend(
+                self.frontier.lease(
+                    self.spider.name, self.worker_id, self.lease_secs, self.batch
+                )
+            )
+            if not self.leased:
+                return None
+        row_id, payload = self.leased.popleft()
+        request = request_from_dict(pickle.loads(payload), spider=self.spider)
+        # remember the row, so it can be acked once the request is done
+        request.meta["frontier_id"] = row_id
+        self.stats.inc_value("frontier/leased")
+        self.stats.inc_value("scheduler/dequeued")
+        return request
+
+    def ack(self, meta):
+        """Delete the row of a request whose work is done, given its meta."""
+        # drop the id, so the row is acked only once and a re-enqueued Request object gets a row of its own
+        row_id = meta.pop("frontier_id", None)
+        if row_id is None:
+            return
+        self.processing.pop(row_id, None)
+        self.frontier.ack(row_id)
+        self.stats.inc_value("frontier/acked")
+
+    def processing_started(self, meta):
+        """Count one more unfinished part of a page: its callback output, or an item it yielded."""
+        row_id = meta.get("frontier_id")
+        if row_id is not None:
+            self.processing[row_id] = self.processing.get(row_id, 0) + 1
+
+    def processing_done(self, meta):
+        """Count one part of a page as done, and ack its row once no part is left."""
+        row_id = meta.get("frontier_id")
+        if row_id is None or row_id not in self.processing:
+            return
+        self.processing[row_id] -= 1
+        if not self.processing[row_id]:
+            self.ack(meta)
+
+    def item_done(self, item, response, **kwargs):
+        # only the items of a page are counted, an errback's items belong to a request acked with its errback
+        if isinstance(response, Response):
+            self.processing_done(response.meta)
+
+    def spider_error(self, failure, response, spider):
+        # the page never reached its callback (e.g. an exception in a spider middleware) and nothing else will ack it,
+        # an exception raised inside the callback output is handled by FrontierAckMiddleware
+        if (
+            isinstance(response, Response)
+            and response.meta.get("frontier_id") not in self.processing
+        ):
+            self.ack(response.meta)
+
+    def __len__(self):
+        return self.frontier.count(self.spider.name) if self.frontier else 0
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class FrontierAckMiddleware:
+    """
+    Spider and downloader middleware that tells FrontierScheduler when the work of a leased request is done.
+
+    - spider middleware: the callback output of a page is followed, its row is acked once the output is consumed
+      and every item it yielded is done (see FrontierScheduler.item_done), so a worker killed while it parses a page
+      or downloads its images leaves the lease to expire and another worker redoes the page
+    - downloader middleware: a request that failed for good (no middleware retried it) is acked after its errback
+      ran, so the failure is recorded (e.g. in the dead-letter store) before its row goes away
+
+    It must be the closest middleware to the engine on both sides (the lowest order), so it sees the output that
+    actually reaches the scraper and only the failures no other middleware turned into a retry.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not issubclass(
+            load_object(crawler.settings["SCHEDULER"]), FrontierScheduler
+        ):
+            raise NotConfigured
+        return cls(crawler)
+
+    @property
+    def scheduler(self):
+        return getattr(self.crawler.spider, "frontier_scheduler", None)
+
+    def process_spider_output(self, response, result):
+        scheduler = self.scheduler
+        if scheduler is None or "frontier_id" not in response.meta:
+            yield from result
+            return
+        scheduler.processing_started(response.meta)
+        try:
+            for output in result:
+                if is_item(output):
+                    scheduler.processing_started(response.meta)
+                yield output
+        except GeneratorExit:
+            # the crawl stopped reading the output, the page is not done, the lease expires or is released
+            raise
+        except Exception:
+            # the callback raised, re-leasing the page would only raise again
+            scheduler.processing_done(response.meta)
+            raise
+        scheduler.processing_done(response.meta)
+
+    async def process_spider_output_async(self, response, result):
+        scheduler = self.scheduler
+        if scheduler is None or "frontier_id" not in response.meta:
+            async for output in result:
+                yield output
+            return
+        scheduler.processing_started(response.meta)
+        try:
+            async for output in result:
+                if is_item(output):
+                    scheduler.processing_started(response.meta)
+                yield output
+        except GeneratorExit:
+            raise
+        except Exception:
+            scheduler.processing_done(response.meta)
+            raise
+        scheduler.processing_done(response.meta)
+
+    def process_exception(self, request, exception):
+        scheduler = self.scheduler
+        if scheduler is None or "frontier_id" not in request.meta:
+            return None
+        errback = request.errback
+        # without an errback the failure is only logged from here on
+        if errback is None:
+            scheduler.ack(request.meta)
+            return None
+
+        # the errbacks of this project record the failure when they are called, the row is acked right after
+        def ack_after_errback(failure):
+            try:
+                return errback(failure)
+            finally:
+                scheduler.ack(request.meta)
+
+        request.errback = ack_after_errback
+        return None
@@ -0,0 +1,119 @@
+# HTTP cache storage built for this site: compressed, content-addressed bodies and per page type expiration
+#
+# With HTTPCACHE_ENABLED every page Scrapy downloads is stored, and a rerun reads it back from disk instead of the network,
+# so iterating on parse_album or parse_category runs at disk speed. Scrapy's filesystem storage writes 6 files per page
+# and the DBM storage pickles whole responses, neither compresses well nor shares identical bodies.
+#
+# SqliteCacheStorage keeps one SQLite file per spider in HTTPCACHE_DIR, a ResponseStore (see responsestore.py):
+# responses are indexed by request fingerprint, and their bodies are compressed (zstd when installed, see compression.py)
+# and stored once per content, so the same album listed under several categories or an unchanged page costs one body.
+#
+# Every URL gets its own expiration from HTTPCACHE_TTL_POLICIES (regex -> seconds, first match wins),
+# so category listings, which change as albums are added, expire quickly while album pages are kept for weeks.
+# Images are not cached, the ImagesPipeline already skips the files present in IMAGES_STORE.
+#
+# enable it with: scrapy crawl images -s HTTPCACHE_ENABLED=True
+
+# import logging to report where the cache lives
+import logging
+
+# import re to compile the TTL policies
+import re
+
+# import time to timestamp and expire the cached responses
+import time
+
+# import Path to build the cache file path
+from pathlib import Path
+
+# import Scrapy's Headers class and the helper that picks the right Response class (HtmlResponse, ...) for cached data
+from scrapy.http.headers import Headers
+from scrapy.responsetypes import responsetypes
+
+# import the helper that resolves HTTPCACHE_DIR inside the project's .scrapy directory
+from scrapy.utils.project import data_path
+
+# import the response store, the cache shares its layout with the crawl archive
+from fashionbroda.responsestore import ResponseStore
+
+logger = logging.getLogger(__name__)
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class SqliteCacheStorage:
+    """
+    HTTP cache storage with compressed, deduplicated bodies in SQLite and per URL expiration.
+
+    Settings:
+        HTTPCACHE_DIR: Directory of the cache files, one <spider name>.sqlite file per spider
+        HTTPCACHE_TTL_POLICIES: dict of URL regex -> expiration in seconds, the first matching regex wins, 0 never expires
+        HTTPCACHE_EXPIRATION_SECS: Expiration of the URLs no policy matches, 0 never expires
+        HTTPCACHE_SKIP_MEDIA: Do not store image responses
+        HTTPCACHE_COMPRESSION_LEVEL: Compression level, defaults to the codec's default
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.policies = [
+            (re.compile(pattern), int(secs))
+            for pattern, secs in settings.getdict("HTTPCACHE_TTL_POLICIES").items()
+        ]
+        self.skip_media = settings.getbool("HTTPCACHE_SKIP_MEDIA", True)
+        level = settings.get("HTTPCACHE_COMPRESSION_LEVEL")
+        self.level = int(level) if level is not None else None
+        self.store = None
+        self.fingerprinter = None
+
+    def open_spider(self, spider):
+        path = Path(self.cachedir, f"{spider.name}.sqlite")
+        # responses are committed in batches, losing the last ones of a killed run only means fetching them again
+        self.store = ResponseStore(path)
+        self.fingerprinter = spider.crawler.request_fingerprinter
+        logger.debug(f"Using SQLite cache storage in {path}", extra={"spider": spider})
+
+    def close_spider(self, spider):
+        self.store.prune_bodies()
+        self.store.close()
+
+    def ttl_for(self, url):
+        """Return the expiration in seconds of a URL, 0 when it never expires."""
+        for pattern, secs in self.policies:
+            if pattern.search(url):
+                return secs
+        return self.expiration_secs
+
+    def retrieve_response(self, spider, request):
+        """Return the cached response of a request, or None if it is not cached or has expired."""
+        record = self.store.get(self.fingerprinter.fingerprint(request).hex())
+        if record is None:
+            return None  # not cached
+
+        url, status, headers, body, stored_at = record
+        ttl = self.ttl_for(request.url)
+        if 0 < ttl < time.time() - stored_at:
+            return None  # expired
+
+        headers = Headers(headers)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """Store a response, its body is only written if no identical body is stored yet."""
+        if self.skip_media and response.headers.get(b"Content-Type", b"").startswith(
+            b"image/"
+        ):
+            return
+        # a 304 only confirms the copy of a previous run (see revalidation.py), it has no body worth caching
+        if response.status == 304:
+            return
+
+        self.store.put(
+            self.fingerprinter.fingerprint(request).hex(),
+            response.url,
+            response.status,
+            response.headers,
+            response.body,
+            self.level,
+        )
@@ -3,10 +3,16 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
-import scrapy
+# import the mapping base classes the slotted items build on, and the read-only mapping of their (empty) field metadata
+from collections.abc import KeysView, MutableMapping
+from types import MappingProxyType
+
+# import itemadapter, the interface Scrapy's scraper, feed exporters and pipelines use to read and write items
+from itemadapter import ItemAdapter
+from itemadapter.adapter import AdapterInterface
 
 # This file defines the data structure for the items we will be scraping.
-# We create a class that inherits from scrapy.Item, and then we define the fields we want to scrape as scrapy.Field().
+# We create a class that inherits from SlotItem, and then we list the fields we want to scrape in its __slots__.
 # this is schema validation for our scraped data, it helps to ensure that the data we scrape is structured and consistent,
 # and it also makes it easier to export the data in a structured format like JSON or CSV.
 
@@ -15,17 +21,126 @@ import scrapy
 # * and an AlbumItem class for the album data, this helps to keep our code organized and makes it easier to manage different types of data.
 # * it also makes it easier to extend our code in the future if we want to add more fields or types of data.
 
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# scrapy.Item keeps the values of every item in a dict of its own, and the images spider yields one item per album of the catalog.
+# SlotItem stores them in __slots__ instead: no dict per item, one pointer per declared field.
+# It behaves like a scrapy.Item everywhere the project uses one: item["field"], .get(), "field" in item, .pop(),
+# .setdefault(), dict(item), and an undeclared field raises a KeyError. Scrapy and the feed exporters reach it through SlotItemAdapter.
+#
+# NOTE: the fields of an item are exported in the order they are declared in, not in the order they were set.
+
+
+class SlotItem(MutableMapping):
+    """
+    Item whose fields are the names in the __slots__ of its class and of its parent classes.
+
+    Args:
+        *args: A mapping of field values, like dict()
+        **kwargs: More field values
+    """
+
+    __slots__ = ()
+    # field name -> field metadata (always empty), the slots of the class and of its parents, filled in for every subclass
+    fields = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.fields = {
+            name: MappingProxyType({})
+            for klass in reversed(cls.__mro__)
+            for name in klass.__dict__.get("__slots__", ())
+        }
+
+    def __init__(self, *args, **kwargs):
+        for field, value in dict(*args, **kwargs).items():
+            self[field] = value
+
+    def __getitem__(self, field):
+        # only declared fields are looked up, item["get"] must not return the method
+        if field in self.fields:
+            try:
+                return getattr(self, field)
+            except AttributeError:
+                pass
+        raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field not in self.fields:
+            raise KeyError(f"{type(self).__name__} does not support field: {field}")
+        setattr(self, field, value)
+
+    def __delitem__(self, field):
+        if field in self.fields:
+            try:
+                delattr(self, field)
+                return
+            except AttributeError:
+                pass
+        raise KeyError(field)
+
+    def __contains__(self, field):
+        return field in self.fields and hasattr(self, field)
+
+    def __iter__(self):
+        return (field for field in self.fields if hasattr(self, field))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def copy(self):
+        return type(self)(self)
+
+
+class SlotItemAdapter(AdapterInterface):
+    """itemadapter adapter of SlotItem, so Scrapy handles slotted items as items and the feed exporters know their fields."""
+
+    @classmethod
+    def is_item_class(cls, item_class):
+        return issubclass(item_class, SlotItem)
+
+    @classmethod
+    def get_field_meta_from_class(cls, item_class, field_name):
+        return item_class.fields[field_name]
+
+    @classmethod
+    def get_field_names_from_class(cls, item_class):
+        return list(item_class.fields)
+
+    def field_names(self):
+        return KeysView(self.item.fields)
+
+    def __getitem__(self, field_name):
+        return self.item[field_name]
+
+    def __setitem__(self, field_name, value):
+        self.item[field_name] = value
+
+    def __delitem__(self, field_name):
+        del self.item[field_name]
+
+    def __iter__(self):
+        return iter(self.item)
+
+    def __len__(self):
+        return len(self.item)
+
+
+# registered first, so it is the one picked for slotted items as soon as this module is imported
+ItemAdapter.ADAPTER_CLASSES.appendleft(SlotItemAdapter)
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
 
 # we create the base item class to be inherited by other item classes
 # this is useful for code reusability and to avoid duplication of common fields across different item classes, such as seller, contact, category, category_text, and category_link
 # which are common fields for both the main category data and the album data
 # the fashionbrodaitem class is the base item class, this is useful for code reusability and to avoid duplication of common fields across different item classes, such as seller, contact, category, category_text, and category_link
-class FashionbrodaItem(scrapy.Item):
-    seller = scrapy.Field()
-    contact = scrapy.Field()
-    category = scrapy.Field()
-    category_text = scrapy.Field()
-    category_link = scrapy.Field()
+class FashionbrodaItem(SlotItem):
+    __slots__ = ("seller", "contact", "category", "category_text", "category_link")
 
 
 # The AlbumItem class defines the fields for the album data we want to scrape from the album pages, such as page_url, page_number, and album_url.
@@ -34,9 +149,7 @@ class AlbumItem(FashionbrodaItem):
     # define the fields for the album item,
     # this is the data structure for the album data that we will be scraping from the album pages, this includes the metadata about the album as well as
     # the fields for the album data itself, such as the image URLs and descriptions
-    page_url = scrapy.Field()
-    page_number = scrapy.Field()
-    album_url = scrapy.Field()
+    __slots__ = ("page_url", "page_number", "album_url")
 
 
 # we create the ImagesItem class that defines the field for the image data we want to scrape from the albums
@@ -44,8 +157,23 @@ class AlbumItem(FashionbrodaItem):
 class ImageItem(AlbumItem):
     # define the fields for product images in fashionbroda webpage
     # define the fields for the images
-    product_images = scrapy.Field()
-    size_chart_images = scrapy.Field()
-    product_images_paths = scrapy.Field()
-    size_chart_images_paths = scrapy.Field()
-    product_data = scrapy.Field()
+    __slots__ = (
+        "product_images",
+        "size_chart_images",
+        "product_images_paths",
+        "size_chart_images_paths",
+        "product_data",
+        # every category the album is listed under (category, category_text, category_link, page_url, page_number),
+        # filled in by the planner when the same album appears under several categories in albums.json
+        "categories",
+        # id of the shared seller / category fields in the spider's context registry (see context.py),
+        # it is replaced by those fields by HydrateContextPipeline before the item is exported
+        "ctx_id",
+        # hash of the album's image URLs and product data, and how it compares with the previous run (added / changed / unchanged),
+        # filled in by AlbumFingerprintPipeline and exported to the images_delta feed
+        "album_fingerprint",
+        "change_status",
+        # number of images of the album that failed to download, set by ImagesPipeline.item_completed,
+        # BloomDupeFilter only remembers an album whose images all succeeded, so the next run fetches the others again
+        "failed_images",
+    )
@@ -0,0 +1,105 @@
+# Journal of the albums whose images are still being downloaded, so a resumed crawl finishes them
+#
+# JOBDIR only keeps the scheduler's pending requests and the dupefilter's seen fingerprints. Once an album page was parsed,
+# its request is seen, but its ImageItem may still wait on image downloads in ImagesPipeline. Stopping the crawl then
+# lost the album: the resumed crawl filtered its request as seen and nothing ever exported it.
+#
+# MediaJournalPipeline appends one line per album to JOBDIR/media_journal.jsonl when its images are handed to the pipeline,
+# and another when the item was exported (or dropped):
+#
+#   {"op": "pending", "album": "<album_url>", "ctx": {...}}
+#   {"op": "done", "album": "<album_url>"}
+#
+# A resumed spider reads the albums that are pending without being done, and requests them again ahead of the manifest,
+# past the dupefilter. Their images that were already stored are not downloaded again (IMAGES_EXPIRES), and the albums
+# that were exported before the stop are done, so they are neither re-fetched nor lost.
+
+# import json to read and write the journal lines
+import json
+
+# import os to replace the journal atomically when it is compacted
+import os
+
+# import Path to build the journal path
+from pathlib import Path
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+JOURNAL_FILE = "media_journal.jsonl"
+
+
+def journal_path(settings):
+    """Return the media journal of a crawl, in JOBDIR, or None when the crawl has no JOBDIR and cannot be resumed."""
+    jobdir = settings.get("JOBDIR")
+    if not jobdir:
+        return None
+    return Path(jobdir) / JOURNAL_FILE
+
+
+def pending_albums(path):
+    """
+    Read the albums whose images were not all processed when the crawl stopped.
+
+    A truncated last line, written while the process was killed, is ignored.
+
+    Args:
+        path (str | Path | None): The journal, None or a missing file have no pending albums
+
+    Returns:
+        dict[str, dict]: The full context of every pending album, by album URL, in journal order
+    """
+    pending = {}
+    if path is None or not Path(path).exists():
+        return pending
+    with open(path, encoding="utf8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("op") == "pending":
+                pending[entry["album"]] = entry["ctx"]
+            elif entry.get("op") == "done":
+                pending.pop(entry["album"], None)
+    return pending
+
+
+class MediaJournal:
+    """
+    Append-only journal of the albums with image work in flight.
+
+    Opening it compacts the journal to its pending albums, so it never grows across resumes.
+
+    Args:
+        path (str | Path): The journal file, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        pending = pending_albums(self.path)
+        partial = self.path.with_name(self.path.name + ".partial")
+        with open(partial, "w", encoding="utf8") as f:
+            for album, ctx in pending.items():
+                f.write(self.line("pending", album, ctx))
+        os.replace(partial, self.path)
+        # line buffered, every line is handed to the OS as soon as it is written, so a killed process loses at most one
+        self.file = open(self.path, "a", encoding="utf8", buffering=1)
+
+    @staticmethod
+    def line(op, album, ctx=None):
+        entry = {"op": op, "album": album}
+        if ctx is not None:
+            entry["ctx"] = ctx
+        return json.dumps(entry, ensure_ascii=False) + "\n"
+
+    def pending(self, album, ctx):
+        """Record that the images of an album are being downloaded."""
+        self.file.write(self.line("pending", album, ctx))
+
+    def done(self, album):
+        """Record that an album was exported, or dropped, its images no longer need the crawl."""
+        self.file.write(self.line("done", album))
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,252 @@
+# Streaming readers for the JSON manifests that feed our spiders
+#
+# The albums and images spiders used to json.load() the whole upstream feed (fashion_broda.json, albums.json)
+# before yielding a single request, which means the full list stays resident for the whole crawl.
+# The helpers in this module read the same files one row at a time instead, so memory stays flat
+# no matter how big the feed grows.
+#
+# Two on-disk formats are supported:
+# - JSON arrays, the format Scrapy's "json" feed exporter writes (what we have today)
+# - JSON Lines, one object per line, the format Scrapy's "jsonlines" feed exporter writes
+
+# import json to decode the individual rows
+import json
+
+# import regex to skip whitespace between array elements
+import re
+
+# import scrapy exceptions so read errors can close the spider cleanly
+from scrapy.exceptions import CloseSpider
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# how many characters we read from disk at a time while scanning a JSON array,
+# big enough to keep the number of reads low, small enough that the buffer never matters for memory
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# whitespace characters allowed between JSON values (RFC 8259)
+JSON_WHITESPACE = " \t\n\r"
+
+# precompiled pattern used to skip whitespace between array elements without slicing the buffer
+WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+
+# the characters that may follow an array element, a decoded value followed by anything else may be cut off by the chunk
+ELEMENT_DELIMITERS = frozenset(",]" + JSON_WHITESPACE)
+
+# the largest element we keep buffering for, a malformed element fails here instead of buffering the rest of the file
+DEFAULT_MAX_ELEMENT_SIZE = 16 * 1024 * 1024
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def detect_manifest_format(json_file):
+    """
+    Peek at the first non-whitespace character of an open text file to detect its format.
+
+    Args:
+        json_file (TextIO): File opened in text mode, positioned at the start
+
+    Returns:
+        str: "json" for a JSON array, "jsonl" for JSON Lines (an empty file is an empty JSON Lines manifest)
+
+    Raises:
+        json.JSONDecodeError: If the file does not start with '[' or '{'
+    """
+    # read a small prefix and rewind, so the real reader starts from the beginning of the file
+    prefix = json_file.read(DEFAULT_CHUNK_SIZE).lstrip(JSON_WHITESPACE + "\ufeff")
+    json_file.seek(0)
+
+    # a JSON array starts with '[' and a JSON Lines file starts with the first object '{'
+    if prefix.startswith("["):
+        return "json"
+    # an empty file is what a feed exporter leaves when it had no rows to write (FEED_STORE_EMPTY), e.g. an empty .jsonl
+    if prefix.startswith("{") or not prefix:
+        return "jsonl"
+    # anything else cannot be a manifest
+    raise json.JSONDecodeError("Expected a JSON array or JSON Lines", prefix, 0)
+
+
+def iter_json_array(
+    json_file, chunk_size=DEFAULT_CHUNK_SIZE, max_element_size=DEFAULT_MAX_ELEMENT_SIZE
+):
+    """
+    Incrementally decode a top-level JSON array, yielding one element at a time.
+
+    Only the current chunk plus the element being decoded is kept in memory,
+    so this works for arrays that are far larger than the available RAM.
+
+    Args:
+        json_file (TextIO): File opened in text mode containing a JSON array
+        chunk_size (int): Number of characters to read from disk at a time
+        max_element_size (int): Most characters buffered to decode one element, a larger one is reported as malformed
+
+    Yields:
+        object: Each decoded element of the array, in file order
+
+    Raises:
+        json.JSONDecodeError: If the file is not a well formed JSON array
+    """
+    decoder = json.JSONDecoder()
+    # buffer holds characters read from disk, index is the cursor of the next undecoded character,
+    # we move the cursor instead of slicing the buffer so each element costs O(element) and not O(chunk)
+    buffer = ""
+    index = 0
+
+    # helper that drops the consumed prefix and reads more data from disk, returns False once the file is exhausted
+    def fill():
+        nonlocal buffer, index
+        chunk = json_file.read(chunk_size)
+        if not chunk:
+            return False
+        buffer = buffer[index:] + chunk
+        index = 0
+        return True
+
+    # helper that moves the cursor past whitespace, refilling the buffer if it runs dry, returns False at end of file
+    def skip_whitespace():
+        nonlocal index
+        while True:
+            index = WHITESPACE_RE.match(buffer, index).end()
+            if index < len(buffer):
+                return True
+            if not fill():
+                return False
+
+    # find the opening bracket of the array, tolerating a UTF-8 byte order mark
+    if not skip_whitespace():
+        raise json.JSONDecodeError("Expected '[' at the start of the array", "", 0)
+    if buffer[index] == "\ufeff":
+        index += 1
+        skip_whitespace()
+    if buffer[index : index + 1] != "[":
+        raise json.JSONDecodeError(
+            "Expected '[' at the start of the array", buffer, index
+        )
+    index += 1
+
+    # an empty array is a valid (if useless) manifest
+    if not skip_whitespace():
+        raise json.JSONDecodeError("Unterminated JSON array", buffer, index)
+    if buffer[index] == "]":
+        return
+
+    # helper that reads more data for the element at the cursor, returns False at end of file or once the element is too large
+    def refill():
+        if len(buffer) - index >= max_element_size:
+            return False
+        return fill()
+
+    while True:
+        # try to decode one element at the cursor,
+        # if it is cut off by the end of the chunk, read more and try again
+        try:
+            value, end = decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError:
+            if refill():
+                continue
+            raise
+        # a value that is not followed by a delimiter could still continue in the next chunk,
+        # e.g. "12" + "34" or "1.5" + "e-3", so only accept it once we can see a delimiter after it
+        if (end == len(buffer) or buffer[end] not in ELEMENT_DELIMITERS) and refill():
+            continue
+
+        yield value
+        index = end
+
+        # after an element we must see either a comma or the closing bracket
+        if not skip_whitespace():
+            raise json.JSONDecodeError("Unterminated JSON array", buffer, index)
+        if buffer[index] == "]":
+            return
+        if buffer[index] != ",":
+            raise json.JSONDecodeError("Expected ',' or ']'", buffer, index)
+        index += 1
+        if not skip_whitespace():
+            raise json.JSONDecodeError("Unterminated JSON array", buffer, index)
+
+
+def iter_json_lines(json_file):
+    """
+    Decode a JSON Lines file, yielding one object per non-empty line.
+
+    Args:
+        json_file (TextIO): File opened in text mode containing JSON Lines
+
+    Yields:
+        object: Each decoded line, in file order
+
+    Raises:
+        json.JSONDecodeError: If any line is not valid JSON
+    """
+    for line_number, line in enumerate(json_file, start=1):
+        # skip blank lines, exporters sometimes leave a trailing newline
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            # re-raise with the line number so the spider log points at the broken row
+            raise json.JSONDecodeError(
+                f"{e.msg} (line {line_number})", e.doc, e.pos
+            ) from e
+
+
+def iter_manifest(json_file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Stream the rows of a manifest file, whatever its format.
+
+    The file is opened lazily, on the first iteration, and closed when the generator is exhausted or closed.
+
+    Args:
+        json_file_path (str | Path): Path to a JSON array or JSON Lines file
+        chunk_size (int): Number of characters to read from disk at a time (JSON arrays only)
+
+    Yields:
+        object: Each row of the manifest, in file order
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        json.JSONDecodeError: If the file is not a valid JSON array or JSON Lines file
+    """
+    # open the file in read mode with UTF-8 encoding, using a with statement so the file is closed even if the consumer stops early
+    with open(json_file_path, "r", encoding="utf-8") as json_file:
+        if detect_manifest_format(json_file) == "json":
+            yield from iter_json_array(json_file, chunk_size=chunk_size)
+        else:
+            yield from iter_json_lines(json_file)
+
+
+def read_manifest(json_file_path, logger):
+    """
+    Stream manifest rows for a spider's start(), turning read errors into CloseSpider.
+
+    This keeps the error handling the spiders always had (missing file, invalid JSON, anything unexpected),
+    but because rows are decoded lazily an error can now surface after some requests were already yielded.
+
+    Args:
+        json_file_path (str | Path): Path to a JSON array or JSON Lines file
+        logger (logging.Logger | logging.LoggerAdapter): The spider logger, used to report errors
+
+    Yields:
+        object: Each row of the manifest, in file order
+
+    Raises:
+        CloseSpider: If the file is missing or cannot be decoded
+    """
+    try:
+        yield from iter_manifest(json_file_path)
+    # account for the file not being found error
+    except FileNotFoundError:
+        # log the error message that the JSON file was not found at the specified path, this is useful for debugging and monitoring the scraping process
+        logger.error(f"JSON file not found at: {json_file_path}")
+        raise CloseSpider("JSON file not found")
+    # account for JSON decoding errors, which occur when the file is not in valid JSON / JSON Lines format
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid JSON format: {e}")
+        raise CloseSpider("Invalid JSON file")
+    # account for any other unexpected exceptions that may occur during file reading
+    except Exception as e:
+        logger.error(f"Unexpected error reading JSON file: {e}")
+        raise CloseSpider("Error reading JSON file")
@@ -0,0 +1,192 @@
+# The product_data normalizer shared by the album extractor (extractors.py) and the offline cleaner (clean_json.py)
+#
+# Album descriptions are "key: value" lines, e.g. "• Price: ¥ 1,280" or "Sizes: S, M - L / XL". Normalizing them means:
+#
+# - keys:   bullet-like characters removed, lowercased, stripped and snake_cased ("• Style Code" -> "style_code")
+# - price:  only its digits kept and turned into an int, a price with no digits is left as is
+# - sizes:  split into a list on commas, dashes, slashes and whitespace
+# - empty:  empty strings and empty lists become None
+#
+# Bullets and non-digits are dropped with precompiled translation tables instead of a regex or a generator per value.
+# normalize_descriptions() and clean_product_data_column() handle whole lists at once: description lines and values
+# repeat a lot across albums of a catalog, so each distinct one is only normalized once.
+
+# import re for the sizes separators
+import re
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# all bullet-like Unicode characters that prefix the description keys, deleted by str.translate()
+BULLETS = "•●・◦◘○◉⦿⦾▪▫"
+BULLET_TABLE = str.maketrans("", "", BULLETS)
+
+# the separators between the sizes of a "sizes" line, e.g. "S, M - L / XL"
+SIZES_SPLIT_RE = re.compile(r"[,\-/\s]+")
+
+# the keys whose value is a list of sizes
+SIZE_KEYS = ("sizes", "size")
+
+# marks a line or value that was not normalized yet, None is a valid result
+MISSING = object()
+
+
+class DigitsTable(dict):
+    """
+    Translation table that keeps the characters str.isdigit() accepts and deletes every other one.
+
+    Unicode has too many characters to list upfront, so each one is looked up once, on first use, and remembered.
+    """
+
+    def __missing__(self, codepoint):
+        self[codepoint] = kept = codepoint if chr(codepoint).isdigit() else None
+        return kept
+
+
+DIGITS_TABLE = DigitsTable()
+
+
+def normalize_key(key):
+    """Return the product_data key of a description key, e.g. "• Style Code " -> "style_code"."""
+    return key.translate(BULLET_TABLE).lower().strip().replace(" ", "_")
+
+
+def normalize_value(key, value):
+    """
+    Normalize a product_data value according to its (normalized) key.
+
+    Args:
+        key (str): The normalized key
+        value: The value, a stripped string when it comes from a description, anything when it was already extracted
+
+    Returns:
+        The value, an int for a price with digits, a list for sizes, None when it is empty
+    """
+    if key == "price" and isinstance(value, str):
+        try:
+            value = int(value.translate(DIGITS_TABLE))
+        except ValueError:
+            # no digits, keep the text
+            pass
+    elif key in SIZE_KEYS and isinstance(value, str):
+        value = [size for size in SIZES_SPLIT_RE.split(value.strip()) if size]
+
+    if value == "" or value == []:
+        return None
+    return value
+
+
+def normalize_line(line):
+    """Return the (key, value) pair of a description line, None if it is not a "key: value" line."""
+    if ":" not in line:
+        return None
+    # split ONLY once, values may contain colons too
+    key, value = line.split(":", 1)
+    key = normalize_key(key)
+    return key, normalize_value(key, value.strip())
+
+
+def normalize_description(raw_description):
+    """
+    Split an album's description into product data, one "key: value" pair per line.
+
+    NOTE: this is only a partial normalization, prices may still be strings depending on the source formatting,
+    final typing and cleanup belong in the pipelines and post-processing.
+
+    Args:
+        raw_description (str | None): The content of the description meta tag
+
+    Returns:
+        dict: The product data, a later line overrides an earlier one with the same key
+    """
+    product_data = {}
+    if not raw_description:
+        return product_data
+    for line in raw_description.split("\n"):
+        pair = normalize_line(line)
+        if pair is not None:
+            product_data[pair[0]] = pair[1]
+    return product_data
+
+
+def normalize_descriptions(raw_descriptions):
+    """
+    Normalize a whole list of descriptions, each distinct line is only normalized once.
+
+    Args:
+        raw_descriptions (Iterable[str | None]): The descriptions
+
+    Returns:
+        list[dict]: The product data of every description, in order
+    """
+    lines = {}
+    results = []
+    for raw_description in raw_descriptions:
+        product_data = {}
+        if raw_description:
+            for line in raw_description.split("\n"):
+                pair = lines.get(line, MISSING)
+                if pair is MISSING:
+                    pair = lines[line] = normalize_line(line)
+                if pair is not None:
+                    key, value = pair
+                    # sizes are lists, every item gets its own copy
+                    product_data[key] = list(value) if type(value) is list else value
+        results.append(product_data)
+    return results
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def clean_product_data(product_data):
+    """
+    Re-normalize the values of already extracted product data, e.g. from images_paths.json, the keys are kept as they are.
+
+    Args:
+        product_data (dict | None): The product data
+
+    Returns:
+        dict: The cleaned product data
+    """
+    if not product_data:
+        return {}
+    return {key: normalize_value(key, value) for key, value in product_data.items()}
+
+
+def clean_product_data_column(product_datas):
+    """
+    Re-normalize the product data of a whole feed at once, column by column.
+
+    The values of every key are gathered into one column, and each distinct string of a column is normalized once,
+    a catalog has thousands of albums but only a few hundred distinct prices and size ranges.
+
+    Args:
+        product_datas (list[dict | None]): The product data of every item
+
+    Returns:
+        list[dict]: The cleaned product data of every item, in order, the same as clean_product_data() on each one
+    """
+    results = [
+        dict(product_data) if product_data else {} for product_data in product_datas
+    ]
+
+    # key -> [(row, value)], the columns of the feed
+    columns = {}
+    for row, product_data in enumerate(results):
+        for key, value in product_data.items():
+            columns.setdefault(key, []).append((row, value))
+
+    for key, column in columns.items():
+        cleaned = {}
+        for row, value in column:
+            # only strings are worth remembering, and they are the only values that change
+            if type(value) is str:
+                result = cleaned.get(value, MISSING)
+                if result is MISSING:
+                    result = cleaned[value] = normalize_value(key, value)
+                if type(result) is list:
+                    result = list(result)
+            else:
+                result = normalize_value(key, value)
+            results[row][key] = result
+    return results
@@ -7,6 +7,16 @@
 # this helps to avoid naming conflicts and ensures that each image is saved with a unique name based on its content
 import hashlib
 
+# import os and Path to check and refresh the files already in IMAGES_STORE when the server confirms they did not change
+import os
+from pathlib import Path
+
+# import Scrapy signals, to close the album fingerprint store with the crawl's close reason
+from scrapy import signals
+
+# import the exception that disables a pipeline, the media journal needs JOBDIR
+from scrapy.exceptions import NotConfigured
+
 # Import Scrapy's Request class so we can manually generate image download requests
 # inside get_media_requests().
 #
@@ -28,6 +38,42 @@ from scrapy import Request
 from scrapy.pipelines.images import ImagesPipeline
 
 # import the ImageItem class from items.py to structure the scraped data
+from fashionbroda.items import ImageItem
+
+# import the album fingerprint helpers, to tell added, changed and unchanged albums apart
+from fashionbroda.fingerprints import AlbumFingerprintStore, album_fingerprint
+
+# import the dead-letter store, images that failed after their retries are recorded with their album (see deadletter.py)
+from fashionbroda.deadletter import dead_letters
+
+# import the media journal, to finish the albums whose images were in flight when a JOBDIR crawl stopped (see journal.py)
+from fashionbroda.journal import MediaJournal, journal_path
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# the album fields the images spider needs to request the album of an item again
+ALBUM_CTX_FIELDS = (
+    "ctx_id",
+    "seller",
+    "contact",
+    "category",
+    "category_text",
+    "category_link",
+    "page_url",
+    "page_number",
+    "album_url",
+    "categories",
+)
+
+
+# return the full context of an item's album, with the shared fields filled back in when the item is still compact
+def album_context(spider, item):
+    ctx = {field: item[field] for field in ALBUM_CTX_FIELDS if field in item}
+    registry = getattr(spider, "context_registry", None)
+    if registry is not None:
+        ctx = registry.hydrate(ctx)
+    return ctx
+
 
 # *------------------------------------------------------------------------------------------------------------------------------------------------------
 
@@ -39,6 +85,9 @@ class ImagesPipeline(ImagesPipeline):
         # set the referer header to the album URL from the item context, then add a fallback if the album_url is missing, to avoid errors
         # if the album_url is missing, set referer to an empty string
         referer = item.get("album_url", "")
+        # the seller / category / album directories are the same for every image of the item, they are computed once here,
+        # and each request only carries that prefix, not the whole item (see file_path())
+        path_prefix = self.path_prefix(item)
 
         # loop through each product image URL in the item
         # we use item.get("product_images", []) to safely access the product_images field,
@@ -50,9 +99,8 @@ class ImagesPipeline(ImagesPipeline):
                 url=product_image_url,
                 # set the referer header to the album URL from the item context, this is important for servers that require a referer to allow access to the image
                 headers={"Referer": referer},
-                # meta propagation of the info that is in the images.json file and that was defined in the ImageDownloadItem
-                # This metadata allows custom file paths or post-processing logic if needed
-                meta={"item": item, "image_type": "product_image"},
+                # meta propagation of the storage directories of the item's album, file_path() builds the image path from them
+                meta={"path_prefix": path_prefix, "image_type": "product_image"},
                 # this line : 'image_type': 'product_image'
                 # allows us to differentiate between product images and size chart images later, so we can store them in different fields
             )
@@ -65,8 +113,8 @@ class ImagesPipeline(ImagesPipeline):
                 url=size_chart_url,
                 # set the referer header to the album URL from the item context, this is important for servers that require a referer to allow access to the image
                 headers={"Referer": referer},
-                # meta propagation of contextual data already attached to the item
-                meta={"item": item, "image_type": "size_chart_image"},
+                # meta propagation of the storage directories of the item's album
+                meta={"path_prefix": path_prefix, "image_type": "size_chart_image"},
                 # this line : 'image_type': 'size_chart_image'
                 # allows us to differentiate between product images and size chart images later, so we can store them in different fields
             )
@@ -149,17 +197,21 @@ class ImagesPipeline(ImagesPipeline):
 
     # * come back to this and finish the docstring later
 
-    # define the file_path method to determine the file path for each downloaded image using hash-based naming
-    def file_path(self, request, response=None, info=None, *, item=None):
-        # extract the item context from the request meta, this is the metadata we attached to the request in get_media_requests()
-        item = request.meta.get("item", {})
-        # get the data from the item meta
-        seller = self.normalize_category(item.get("seller", "unknown_seller"))
-        category = self.normalize_category(item.get("category", "unknown_category"))
+    # return the seller / category fields of an item, resolving its context id when the item is still compact
+    def shared_context(self, item):
+        registry = getattr(self.crawler.spider, "context_registry", None)
+        if registry is None:
+            return item
+        return registry.shared_fields(item)
+
+    # return the seller/category/album_hash directories of an item's images, the first three levels of file_path()
+    def path_prefix(self, item):
+        # get the shared data from the context registry (or from the item itself when it is not compact)
+        shared = self.shared_context(item)
+        seller = self.normalize_category(shared.get("seller", "unknown_seller"))
+        category = self.normalize_category(shared.get("category", "unknown_category"))
         album_url = item.get("album_url", "unknown_album")
 
-        # define the storage subdirectory based on image type
-
         # Generate a stable, filesystem-safe identifier for the album
         # - album_url is a string (URLs can be long and unsafe for directory names)
         # - .encode() converts the string to bytes (hash functions operate on bytes)
@@ -168,6 +220,14 @@ class ImagesPipeline(ImagesPipeline):
         # - [:10] shortens the hash to keep directory names compact while remaining unique enough
         # Result: the same album URL will always map to the same album directory
         album_hash = hashlib.sha1(album_url.encode()).hexdigest()[:10]
+        return f"{seller}/{category}/{album_hash}"
+
+    # define the file_path method to determine the file path for each downloaded image using hash-based naming
+    def file_path(self, request, response=None, info=None, *, item=None):
+        # the directories of the album, precomputed in get_media_requests(), or computed from the item for a request built elsewhere
+        path_prefix = request.meta.get("path_prefix")
+        if path_prefix is None:
+            path_prefix = self.path_prefix(item or {})
 
         # Generate a unique, deterministic filename for the image
         # - request.url is the full image URL
@@ -212,19 +272,68 @@ class ImagesPipeline(ImagesPipeline):
         # The final result is a deterministic, collision-resistant storage path
         # that mirrors the crawl structure and supports resumable, large-scale scraping
 
-        return f"{seller}/{category}/{album_hash}/{request.meta.get('image_type', 'unknown')}/{image_hash}.jpg"
+        return f"{path_prefix}/{request.meta.get('image_type', 'unknown')}/{image_hash}.jpg"
+
+    # *-------------------------------------------------------------------------------------------------------------------------------------------------
+
+    # return True if a file is already in IMAGES_STORE, only the local filesystem store can be checked
+    def stored_file_exists(self, path):
+        basedir = getattr(self.store, "basedir", None)
+        return basedir is not None and Path(basedir, path).exists()
+
+    # called before every image download, returns the stored file when it is fresh, None to download it
+    def media_to_download(self, request, info, *, item=None):
+        dfd = super().media_to_download(request, info, item=item)
+
+        def mark_revalidation(result):
+            # the file is missing or older than IMAGES_EXPIRES, when it is only expired ask the server if it changed (see revalidation.py),
+            # when it is missing it must be downloaded in full, but we still record its validators
+            if result is None:
+                path = self.file_path(request, info=info, item=item)
+                request.meta["revalidate"] = self.stored_file_exists(path)
+            return result
+
+        return dfd.addCallback(mark_revalidation)
+
+    # called with every image response, a 304 Not Modified keeps the file already in IMAGES_STORE
+    def media_downloaded(self, response, request, info, *, item=None):
+        if response.status != 304:
+            return super().media_downloaded(response, request, info, item=item)
+
+        path = self.file_path(request, response=response, info=info, item=item)
+        # refresh the file's modification time, so it is only revalidated again once IMAGES_EXPIRES has passed
+        os.utime(Path(self.store.basedir, path))
+        self.inc_stats("uptodate")
+        return {
+            "url": request.url,
+            "path": path,
+            "checksum": None,
+            "status": "uptodate",
+        }
 
     # *-------------------------------------------------------------------------------------------------------------------------------------------------
 
     # define the function that will save results after image download is complete
     def item_completed(self, results, item, info):
+        # the chained catalog crawl can also export category and album items, they carry no images, so pass them through untouched
+        if not isinstance(item, ImageItem):
+            return item
+
         # initialize the lists to hold the file paths of downloaded images
         # We use setdefault to ensure lists exist, but we might want to clear them if we are re-populating
         # However, for a single item pipeline pass, initialization is fine.
         item["product_images_paths"] = []
         item["size_chart_images_paths"] = []
-
-        for success, file_info in results:
+        item["failed_images"] = 0
+
+        # results come in the order get_media_requests() yielded the requests: product images, then size charts
+        urls = [*item.get("product_images", []), *item.get("size_chart_images", [])]
+        store = dead_letters(info.spider)
+        for url, (success, file_info) in zip(urls, results):
+            if store is not None:
+                self.record_media_result(
+                    store, info.spider, item, url, success, file_info
+                )
             if success:
                 path = file_info["path"]
                 # Check for the directory name in the path to identify image type properly
@@ -234,4 +343,132 @@ class ImagesPipeline(ImagesPipeline):
                 elif "size_chart_image" in path:
                     # if the path contains 'size_chart_image', we append the path to the size_chart_images_paths list in the item
                     item.setdefault("size_chart_images_paths", []).append(path)
+            else:
+                item["failed_images"] += 1
         return item
+
+    # record a failed image in the dead-letter store with its album context, and forget an image that was downloaded
+    def record_media_result(self, store, spider, item, url, success, file_info):
+        if success:
+            store.remove(spider.name, "media", url)
+            return
+        ctx = album_context(spider, item)
+        # the download errors were already logged by the pipeline, the failure here only says which step failed
+        reason = f"{type(file_info.value).__name__}: {file_info.value}".rstrip(": ")
+        self.crawler.stats.inc_value("deadletter/media")
+        store.record(spider.name, "media", url, {"ctx": ctx}, reason)
+
+
+# *-------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+# define the pipeline that fills the shared context fields back into compact items, right before they are exported
+# items stay compact (just a ctx_id) while they wait on their image downloads, so thousands of them in flight stay small
+class HydrateContextPipeline:
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_item(self, item):
+        # items of spiders without a context registry, and items that were never compacted, pass through untouched
+        registry = getattr(self.crawler.spider, "context_registry", None)
+        if registry is None or "ctx_id" not in item:
+            return item
+        return registry.hydrate_item(item)
+
+
+# *-------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+# define the pipeline that fingerprints every album and compares it with the previous run (see fingerprints.py)
+# it fills album_fingerprint and change_status, which the images_delta feed exports, so downstream steps can skip unchanged albums
+class AlbumFingerprintPipeline:
+    def __init__(self, crawler, path):
+        self.crawler = crawler
+        self.path = path
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            crawler,
+            settings.get("ALBUM_FINGERPRINTS_PATH")
+            or str(Path(settings.get("CRAWL_STATE_DIR")) / "album_fingerprints.sqlite"),
+        )
+        # the spider_closed signal carries the close reason, only a finished crawl makes its fingerprints the new reference
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self):
+        self.store = AlbumFingerprintStore(self.path)
+
+    def spider_closed(self, spider, reason):
+        if self.store is not None:
+            self.store.close(promote=reason == "finished")
+            self.store = None
+
+    def process_item(self, item):
+        # only album items carry a content to fingerprint
+        if not isinstance(item, ImageItem) or "album_url" not in item:
+            return item
+        item["album_fingerprint"] = album_fingerprint(item)
+        item["change_status"] = self.store.classify(
+            item["album_url"], item["album_fingerprint"]
+        )
+        self.crawler.stats.inc_value(f"fingerprints/{item['change_status']}")
+        return item
+
+
+# *-------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+# define the pipeline that journals the albums whose images are being downloaded, in JOBDIR (see journal.py)
+# it runs before ImagesPipeline, so an album is journaled before its first image request, and is done once the item was exported
+class MediaJournalPipeline:
+    def __init__(self, crawler, path):
+        self.crawler = crawler
+        self.path = path
+        self.journal = None
+        # the albums journaled by this run and not done yet
+        self.in_flight = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        # without JOBDIR a stopped crawl cannot be resumed, there is nothing to journal
+        path = journal_path(crawler.settings)
+        if path is None:
+            raise NotConfigured
+        pipeline = cls(crawler, path)
+        # an item is done once it was exported, dropped, or failed in a later pipeline
+        for signal in (signals.item_scraped, signals.item_dropped, signals.item_error):
+            crawler.signals.connect(pipeline.item_done, signal=signal)
+        return pipeline
+
+    def open_spider(self):
+        self.journal = MediaJournal(self.path)
+
+    def close_spider(self):
+        self.journal.close()
+        self.journal = None
+
+    def process_item(self, item):
+        # only items with images wait on ImagesPipeline
+        if not isinstance(item, ImageItem) or not (
+            item.get("product_images") or item.get("size_chart_images")
+        ):
+            return item
+        album = item.get("album_url")
+        if album and album not in self.in_flight:
+            self.journal.pending(album, album_context(self.crawler.spider, item))
+            self.in_flight.add(album)
+        return item
+
+    def item_done(self, item, **kwargs):
+        album = item.get("album_url") if isinstance(item, ImageItem) else None
+        if album in self.in_flight and self.journal is not None:
+            self.journal.done(album)
+            self.in_flight.discard(album)
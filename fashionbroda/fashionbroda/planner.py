@@ -0,0 +1,189 @@
+# Planning stage for the images crawl
+#
+# albums.json lists the same album several times: once under "All categories", once under its brand category,
+# and sometimes again under "Other Brands". Each listing also carries a different ?referrercate=<id> query string,
+# so the images spider used to request the same album once per listing, and whichever copy won decided the recorded category.
+#
+# plan_albums() groups the validated albums.json rows by album identity and merges their category memberships,
+# so every album page (and therefore every image) is fetched exactly once per run, with all categories carried along.
+#
+# Grouping needs every listing of an album, and the last one can be anywhere in the file, so the rows are spilled into a
+# scratch SQLite file first (one sequential pass, nothing kept in memory), then read back sorted by album, in order of
+# first appearance, and merged one album at a time. Memory stays flat however large albums.json grows, like the
+# streaming manifest readers (see manifests.py), only the first request waits for the spill pass.
+
+# import itertools and operator to read the spilled listings back one album at a time
+from itertools import groupby
+from operator import itemgetter
+
+# import json to spill the rows
+import json
+
+# import os, sqlite3 and tempfile for the scratch file of the spill
+import os
+import sqlite3
+import tempfile
+
+# import re to recognize album URLs that are already canonical
+import re
+
+# import the URL canonicalizer, an album is identified by its canonical URL
+from fashionbroda.urls import canonicalize_url
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# categories that group albums from many brands, an album listed under a brand category should be filed under that brand instead
+# the lower the rank, the more specific the category, and the more we prefer it as the album's primary category
+GENERIC_CATEGORY_RANKS = {
+    "Other Brands": 1,
+    "Uncategorized Album": 1,
+    "Brands": 2,
+    "All categories": 2,
+}
+
+# an album URL as canonicalize_url() writes it
+CANONICAL_ALBUM_URL_RE = re.compile(r"https://[a-z0-9.-]+/albums/\d+\?uid=1$")
+
+# the per-listing fields we keep for every category an album appears under
+MEMBERSHIP_FIELDS = (
+    "category",
+    "category_text",
+    "category_link",
+    "page_url",
+    "page_number",
+)
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def album_key(album_url):
+    """
+    Return the identity of an album, its canonical URL without query string.
+
+    Yupoo album URLs look like /albums/<id>?uid=1&isSubCate=false&referrercate=<category id>,
+    only the path identifies the album, the query just records where the link was found.
+    The key agrees with the request fingerprints and the album_url of items (see urls.py).
+
+    Args:
+        album_url (str): Absolute album URL
+
+    Returns:
+        str: The canonical album URL without query string
+    """
+    # the spiders store canonical album URLs, for those cutting the query off is enough, and much faster
+    # than parsing the URL again (the tombstone diff keys millions of rows)
+    if CANONICAL_ALBUM_URL_RE.match(album_url):
+        return album_url.partition("?")[0]
+    return canonicalize_url(album_url).partition("?")[0]
+
+
+def category_rank(category):
+    """
+    Rank a category by how specific it is, brand categories rank 0 and catch-all categories rank higher.
+
+    Args:
+        category (str): Clean category name, as listed in FashionBrodaSpider.categories
+
+    Returns:
+        int: The rank, lower is more specific
+    """
+    return GENERIC_CATEGORY_RANKS.get(category, 0)
+
+
+def merge_listings(rows):
+    """
+    Merge the listings of one album into its planned context.
+
+    The first listing under the most specific category becomes the album's primary context
+    (seller, category, album_url, ...), which is what the image storage path is built from.
+    Every category is recorded once in the "categories" list, in the order it was read.
+
+    Args:
+        rows (Iterable[dict]): The validated rows of one album, in file order
+
+    Returns:
+        dict: The planned context
+    """
+    plan = None
+    for row in rows:
+        membership = {field: row.get(field) for field in MEMBERSHIP_FIELDS}
+
+        # first listing of the album, it becomes the primary context
+        if plan is None:
+            plan = {**row, "categories": [membership]}
+            continue
+
+        # the album was already listed under another category, record this membership once
+        if membership["category"] not in {
+            existing["category"] for existing in plan["categories"]
+        }:
+            plan["categories"].append(membership)
+
+        # promote this listing to primary context if its category is more specific (e.g. "Dior" beats "All categories")
+        if category_rank(row["category"]) < category_rank(plan["category"]):
+            plan = {**row, "categories": plan["categories"]}
+    return plan
+
+
+def plan_albums(rows, stats=None, tmpdir=None):
+    """
+    Group album rows by album identity and merge their category memberships, see merge_listings().
+
+    The rows are spilled to a scratch SQLite file and merged back one album at a time, so only the listings
+    of the current album are in memory.
+
+    Args:
+        rows (Iterable[dict]): Validated albums.json rows
+        stats (StatsCollector, optional): Scrapy stats, to record how many duplicates were merged
+        tmpdir (str | Path | None): Directory of the scratch file, defaults to the system temporary directory
+
+    Yields:
+        dict: One planned context per album, in order of first appearance
+    """
+    if tmpdir is not None:
+        os.makedirs(tmpdir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="plan-", suffix=".sqlite", dir=tmpdir)
+    os.close(fd)
+    db = sqlite3.connect(path, isolation_level=None)
+    try:
+        # a scratch file, nothing to recover if the process dies
+        db.execute("PRAGMA journal_mode=OFF")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute(
+            "CREATE TABLE listings (seq INTEGER PRIMARY KEY, album TEXT NOT NULL, row TEXT NOT NULL)"
+        )
+
+        row_count = 0
+
+        def listings():
+            nonlocal row_count
+            for row in rows:
+                row_count += 1
+                yield album_key(row["album_url"]), json.dumps(row)
+
+        # one transaction for the whole spill, executemany() pulls the rows lazily
+        db.execute("BEGIN")
+        db.executemany("INSERT INTO listings (album, row) VALUES (?, ?)", listings())
+        db.execute("COMMIT")
+        db.execute("CREATE INDEX listings_album ON listings (album, seq)")
+
+        # every listing, grouped by album, the albums in order of their first listing
+        cursor = db.execute(
+            "SELECT l.album, l.row FROM listings l "
+            "JOIN (SELECT album, MIN(seq) AS first FROM listings GROUP BY album) a ON a.album = l.album "
+            "ORDER BY a.first, l.seq"
+        )
+        album_count = 0
+        for _, group in groupby(cursor, key=itemgetter(0)):
+            album_count += 1
+            yield merge_listings(json.loads(row) for _, row in group)
+
+        # record how much work the planner saved, this shows up in the stats dump at the end of the crawl
+        if stats is not None:
+            stats.set_value("planner/rows", row_count)
+            stats.set_value("planner/albums", album_count)
+            stats.set_value("planner/duplicates_merged", row_count - album_count)
+    finally:
+        db.close()
+        os.remove(path)
@@ -0,0 +1,282 @@
+# SQLite disk queues for the JOBDIR scheduler
+#
+# With JOBDIR set, Scrapy's scheduler keeps every pending request in a disk queue, one queue per priority (and per download slot).
+# The default PickleLifoDiskQueue stores them in queuelib chunk files: a resume has to reopen and walk those files,
+# and their space is only given back once a whole chunk has been popped.
+#
+# SqliteLifoDiskQueue / SqliteFifoDiskQueue keep each queue in one SQLite file (<key>.sqlite) instead:
+#
+# - push / pop are a single indexed INSERT / DELETE on the rowid, however many requests are queued
+# - the database runs in WAL mode with synchronous=NORMAL, and writes are committed in batches of SQLITE_QUEUE_COMMIT_EVERY,
+#   so we do not pay one fsync per request
+# - a resume only opens the file and reads its row count, nothing is replayed
+# - compact_queue_files() checkpoints and vacuums the files, CleanJobDirExtension calls it when a crawl is paused
+#
+# The dupefilter has the same problem: RFPDupeFilter appends every fingerprint to JOBDIR/requests.seen as a hex line,
+# and reads the whole file back into a set on resume, so both the file and the memory of a long crawl grow with every request.
+# SqliteDupeFilter keeps the fingerprints in a table of the same kind (JOBDIR/requests.seen.sqlite) instead:
+#
+# - a fingerprint is a 20 byte primary key, looked up through the index, nothing is held in memory
+# - it is committed in batches like the queues, and compacted with them by compact_queue_files()
+# - a requests.seen left by RFPDupeFilter is imported (then removed) when a crawl resumes, so switching does not refetch anything
+#
+# NOTE: a graceful stop (Ctrl+C once) commits everything. A hard kill can lose up to SQLITE_QUEUE_COMMIT_EVERY queue operations,
+# popped requests come back (and are fetched again) and pushed requests are lost, like the buffered default queues.
+
+# import pickle to serialize the request dicts, the same format Scrapy's own disk queues use
+import pickle
+
+# import sqlite3 for the queue files, it is part of the standard library
+import sqlite3
+
+# import Path to build the queue file paths
+from pathlib import Path
+
+# import Scrapy's default dupefilter, SqliteDupeFilter only replaces where its fingerprints are stored
+from scrapy.dupefilters import RFPDupeFilter
+
+# import the JOBDIR helper, the dupefilter table lives in JOBDIR next to the queues
+from scrapy.utils.job import job_dir
+
+# import the helper that turns a serialized request dict back into a Request bound to the spider callbacks
+from scrapy.utils.request import request_from_dict
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# every queue file ends with this suffix, so CleanJobDirExtension can find them under JOBDIR
+QUEUE_FILE_SUFFIX = ".sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload BLOB NOT NULL
+);
+"""
+
+# the dupefilter table, in JOBDIR next to the requests.seen file RFPDupeFilter would write
+DUPEFILTER_FILE = "requests.seen" + QUEUE_FILE_SUFFIX
+
+# WITHOUT ROWID stores each fingerprint once, in the primary key index itself
+DUPEFILTER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (
+    fingerprint BLOB PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+
+class SqliteDiskQueue:
+    """
+    A disk queue of requests stored in one SQLite file, base class of the LIFO and FIFO queues.
+
+    Settings:
+        SQLITE_QUEUE_COMMIT_EVERY: how many push / pop operations are grouped in one transaction
+    """
+
+    # LIFO pops the newest row, FIFO the oldest, both follow the rowid index
+    lifo = False
+
+    def __init__(self, crawler, key, commit_every=500):
+        self.spider = crawler.spider
+        self.path = Path(f"{key}{QUEUE_FILE_SUFFIX}")
+        self.commit_every = commit_every
+        # operations done since the last commit
+        self.uncommitted = 0
+
+        # make sure the parent directory exists, then open the database,
+        # isolation_level=None lets us control transactions explicitly
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path), isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # NORMAL only syncs at checkpoints in WAL mode, the database stays consistent, only the last commits may be lost on power failure
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+        # count the rows once when the queue is opened, then keep the count up to date ourselves
+        self.size = self.db.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+        order = "DESC" if self.lifo else "ASC"
+        self.next_sql = f"SELECT id, payload FROM queue ORDER BY id {order} LIMIT 1"
+        self.db.execute("BEGIN")
+
+    @classmethod
+    def from_crawler(cls, crawler, key, *args, **kwargs):
+        return cls(
+            crawler,
+            key,
+            commit_every=crawler.settings.getint("SQLITE_QUEUE_COMMIT_EVERY", 500),
+        )
+
+    def __len__(self):
+        return self.size
+
+    def push(self, request):
+        try:
+            payload = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        # the scheduler expects ValueError for requests that can't be serialized, and keeps those in memory instead
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            raise ValueError(str(e)) from e
+        self.db.execute("INSERT INTO queue (payload) VALUES (?)", (payload,))
+        self.size += 1
+        self.tick()
+
+    def pop(self):
+        row = self.db.execute(self.next_sql).fetchone()
+        if row is None:
+            return None
+        row_id, payload = row
+        self.db.execute("DELETE FROM queue WHERE id = ?", (row_id,))
+        self.size -= 1
+        self.tick()
+        return request_from_dict(pickle.loads(payload), spider=self.spider)
+
+    def peek(self):
+        row = self.db.execute(self.next_sql).fetchone()
+        if row is None:
+            return None
+        return request_from_dict(pickle.loads(row[1]), spider=self.spider)
+
+    def tick(self):
+        # commit once every commit_every operations, so one fsync covers a whole batch of requests
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.db.execute("COMMIT")
+            self.db.execute("BEGIN")
+            self.uncommitted = 0
+
+    def close(self):
+        self.db.execute("COMMIT")
+        if self.size:
+            # fold the WAL back into the database file, so a resume opens a single file
+            self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.db.close()
+            return
+        # an empty queue is not needed to resume, remove its files like queuelib does for its empty queues
+        self.db.close()
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+
+
+class SqliteLifoDiskQueue(SqliteDiskQueue):
+    """LIFO SQLite disk queue, the replacement for SCHEDULER_DISK_QUEUE (Scrapy defaults to LIFO, a depth-first crawl)."""
+
+    lifo = True
+
+
+class SqliteFifoDiskQueue(SqliteDiskQueue):
+    """FIFO SQLite disk queue, the replacement for SCHEDULER_START_DISK_QUEUE (start requests keep their order)."""
+
+    lifo = False
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class SqliteDupeFilter(RFPDupeFilter):
+    """
+    RFPDupeFilter whose JOBDIR fingerprints are stored in an SQLite table instead of requests.seen and an in-memory set.
+
+    Without JOBDIR there is nothing to persist, and it behaves exactly like RFPDupeFilter.
+
+    Settings:
+        SQLITE_QUEUE_COMMIT_EVERY: how many new fingerprints are grouped in one transaction
+    """
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None, commit_every=500):
+        # the parent class only opens requests.seen when it is given a path, the table replaces it
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.db = None
+        self.commit_every = commit_every
+        # fingerprints added since the last commit
+        self.uncommitted = 0
+        if not path:
+            return
+
+        self.db = sqlite3.connect(
+            str(Path(path, DUPEFILTER_FILE)), isolation_level=None
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(DUPEFILTER_SCHEMA)
+        self.import_seen_file(Path(path, "requests.seen"))
+        self.db.execute("BEGIN")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            job_dir(crawler.settings),
+            crawler.settings.getbool("DUPEFILTER_DEBUG"),
+            fingerprinter=crawler.request_fingerprinter,
+            commit_every=crawler.settings.getint("SQLITE_QUEUE_COMMIT_EVERY", 500),
+        )
+
+    def import_seen_file(self, path):
+        # a crawl paused with RFPDupeFilter resumes with this one, its fingerprints are moved into the table
+        if not path.exists():
+            return
+        self.db.execute("BEGIN")
+        with open(path, encoding="utf-8") as f:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO seen (fingerprint) VALUES (?)",
+                ((bytes.fromhex(line),) for line in f if line.strip()),
+            )
+        self.db.execute("COMMIT")
+        path.unlink()
+
+    def request_seen(self, request):
+        if self.db is None:
+            return super().request_seen(request)
+        # one indexed insert: it only adds a row when the fingerprint is new
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO seen (fingerprint) VALUES (?)",
+            (self.fingerprinter.fingerprint(request),),
+        )
+        if not cursor.rowcount:
+            return True
+        # commit once every commit_every new fingerprints, like the queues
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.db.execute("COMMIT")
+            self.db.execute("BEGIN")
+            self.uncommitted = 0
+        return False
+
+    def close(self, reason):
+        super().close(reason)
+        if self.db is None:
+            return
+        self.db.execute("COMMIT")
+        # fold the WAL back into the database file, like the queues
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.close()
+        self.db = None
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def compact_queue_files(jobdir):
+    """
+    Checkpoint and vacuum every SQLite queue file under a JOBDIR, giving back the space of popped requests.
+
+    The dupefilter table (requests.seen.sqlite) is one of them, so its WAL is folded back too.
+
+    Args:
+        jobdir (str): The JOBDIR of a paused crawl
+
+    Returns:
+        tuple[int, int]: (number of files compacted, bytes reclaimed)
+    """
+    compacted = 0
+    reclaimed = 0
+    for path in Path(jobdir).rglob(f"*{QUEUE_FILE_SUFFIX}"):
+        before = sum(
+            p.stat().st_size for p in (path, Path(f"{path}-wal")) if p.exists()
+        )
+        db = sqlite3.connect(str(path), isolation_level=None)
+        try:
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            db.execute("VACUUM")
+        finally:
+            db.close()
+        compacted += 1
+        reclaimed += before - path.stat().st_size
+    return compacted, reclaimed
@@ -0,0 +1,134 @@
+# Content-addressed store of downloaded responses, shared by the HTTP cache (httpcache.py) and the crawl archive (archive.py)
+#
+# Both keep whole responses in one SQLite file, indexed by request fingerprint (see urls.py):
+#
+# - responses: request fingerprint -> url, status, headers, body digest and the time it was stored, the latest one wins
+# - bodies:    SHA1 of the body -> compressed body (zstd when installed, see compression.py),
+#              identical bodies (the same album listed under several categories, unchanged pages) are stored once
+#
+# The HTTP cache adds its expiration on top, the archive its replay, the layout, compression and batching live here only.
+
+# import hashlib to address bodies by their content
+import hashlib
+
+# import pickle to store the response headers, like Scrapy's DBM cache storage does
+import pickle
+
+# import time to timestamp the stored responses
+import time
+
+# import the shared compression helpers
+from fashionbroda.compression import compress, decompress
+
+# import the base class of the SQLite stores, it opens the file and batches the writes
+from fashionbroda.sqlitestore import SqliteStore
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    fingerprint TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers BLOB NOT NULL,
+    body_digest TEXT NOT NULL,
+    stored_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS responses_body ON responses (body_digest);
+CREATE TABLE IF NOT EXISTS bodies (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+SELECT_RESPONSES = (
+    "SELECT r.url, r.status, r.headers, r.stored_at, b.data "
+    "FROM responses r JOIN bodies b ON b.digest = r.body_digest"
+)
+
+
+class ResponseStore(SqliteStore):
+    """
+    Responses indexed by request fingerprint, with compressed and deduplicated bodies.
+
+    Args:
+        path (str | Path): The SQLite file, created if it does not exist
+        commit_every (int | None): Number of responses written per transaction
+    """
+
+    schema = SCHEMA
+
+    def get(self, fingerprint):
+        """
+        Return the stored response of a request fingerprint.
+
+        Returns:
+            tuple[str, int, dict, bytes, float] | None: (url, status, headers, body, stored_at), None if it was never stored
+        """
+        row = self.db.execute(
+            SELECT_RESPONSES + " WHERE r.fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        if row is None:
+            return None
+        url, status, headers, stored_at, data = row
+        return url, status, pickle.loads(headers), decompress(data), stored_at
+
+    def put(self, fingerprint, url, status, headers, body, level=None):
+        """Store a response, its body is only written if no identical body is stored yet."""
+        digest = hashlib.sha1(body).hexdigest()
+        self.begin()
+        # check first, so an already stored body is never compressed again
+        if (
+            self.db.execute(
+                "SELECT 1 FROM bodies WHERE digest = ?", (digest,)
+            ).fetchone()
+            is None
+        ):
+            self.db.execute(
+                "INSERT INTO bodies (digest, size, data) VALUES (?, ?, ?)",
+                (digest, len(body), compress(body, level)),
+            )
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses "
+            "(fingerprint, url, status, headers, body_digest, stored_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                fingerprint,
+                url,
+                status,
+                pickle.dumps(dict(headers), protocol=4),
+                digest,
+                time.time(),
+            ),
+        )
+        self.tick()
+
+    def records(self, url_like=None, limit=None):
+        """
+        Stream the stored responses, e.g. as fixture pages for bench_parse.py.
+
+        Args:
+            url_like (str | None): Only the URLs matching this SQL LIKE pattern, e.g. "%/albums/%"
+            limit (int | None): At most this many responses
+
+        Yields:
+            tuple[str, int, dict, bytes]: (url, status, headers, body)
+        """
+        sql = SELECT_RESPONSES
+        params = []
+        if url_like is not None:
+            sql += " WHERE r.url LIKE ?"
+            params.append(url_like)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        for url, status, headers, _, data in self.db.execute(sql, params):
+            yield url, status, pickle.loads(headers), decompress(data)
+
+    def prune_bodies(self):
+        """Drop the bodies no response points to anymore (the page changed and was stored again)."""
+        self.write(
+            "DELETE FROM bodies WHERE digest NOT IN (SELECT body_digest FROM responses)",
+            (),
+        )
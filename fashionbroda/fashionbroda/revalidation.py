@@ -0,0 +1,217 @@
+# Conditional revalidation of album pages and images between runs
+#
+# A recrawl used to download every album page and every expired image again, even though most of them never change.
+# ConditionalRequestMiddleware remembers the validators of every response (ETag, Last-Modified and a hash of the body)
+# in CRAWL_STATE_DIR/validators.sqlite, and the next run sends them back as If-None-Match / If-Modified-Since,
+# so the server answers 304 Not Modified with an empty body for everything that did not change:
+#
+# - album pages: the album fields of the previous run's ImageItem (image URLs and product data) are stored too,
+#   on a 304 they are attached to the response as meta["previous_album"] and parse_album re-emits them without parsing
+# - images: the ImagesPipeline only revalidates files it already has in IMAGES_STORE (see media_to_download),
+#   a 304 keeps the stored file and its path
+#
+# Requests opt in with meta["revalidate"]:
+# - True: record the validators of the response, and send the previous ones when there are any
+# - False: only record the validators (e.g. an image that is not in IMAGES_STORE yet must be downloaded in full)
+
+# import hashlib to hash response bodies
+import hashlib
+
+# import json to store the previous album fields
+import json
+
+# import time to timestamp the stored validators
+import time
+
+# import Path to build the default store path
+from pathlib import Path
+
+# import Scrapy signals to store the album fields once an item went through every pipeline
+from scrapy import signals
+
+# import Response, items yielded from start() reach item_scraped with no response, and errback items with a Failure
+from scrapy.http import Response
+
+# import the shared compression helpers, the previous album fields are stored compressed
+from fashionbroda.compression import compress, decompress
+
+# import the base class of the SQLite stores, it opens the file and batches the writes
+from fashionbroda.sqlitestore import SqliteStore
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    size INTEGER,
+    stored_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS albums (
+    url TEXT PRIMARY KEY,
+    fields BLOB NOT NULL,
+    stored_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# the album specific fields of an ImageItem, everything else comes from the album context of the current run
+PREVIOUS_ALBUM_FIELDS = ("product_images", "size_chart_images", "product_data")
+
+
+class ValidatorStore(SqliteStore):
+    """
+    Validators of every URL seen by previous runs, and the album fields of the album pages.
+
+    Args:
+        path (str | Path): The SQLite file, created if it does not exist
+        commit_every (int): Number of writes grouped in one transaction
+    """
+
+    schema = SCHEMA
+
+    def get(self, url):
+        """
+        Return the validators stored for a URL.
+
+        Returns:
+            tuple[str | None, str | None, str | None, int | None] | None: (etag, last_modified, content_hash, size)
+        """
+        return self.db.execute(
+            "SELECT etag, last_modified, content_hash, size FROM validators WHERE url = ?",
+            (url,),
+        ).fetchone()
+
+    def put(self, url, etag, last_modified, content_hash, size):
+        self.write(
+            "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?, ?)",
+            (url, etag, last_modified, content_hash, size, time.time()),
+        )
+
+    def get_album(self, url):
+        """Return the album fields stored for an album URL, or None."""
+        row = self.db.execute(
+            "SELECT fields FROM albums WHERE url = ?", (url,)
+        ).fetchone()
+        return json.loads(decompress(row[0])) if row else None
+
+    def put_album(self, url, fields):
+        self.write(
+            "INSERT OR REPLACE INTO albums VALUES (?, ?, ?)",
+            (url, compress(json.dumps(fields).encode()), time.time()),
+        )
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class ConditionalRequestMiddleware:
+    """
+    Downloader middleware that sends the previous run's validators and records the new ones.
+
+    Settings:
+        REVALIDATION_ENABLED: Turn the middleware on or off
+        REVALIDATION_PATH: Path of the SQLite store, defaults to CRAWL_STATE_DIR/validators.sqlite
+    """
+
+    def __init__(self, crawler, path):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.path = path
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        middleware = cls(
+            crawler,
+            settings.get("REVALIDATION_PATH")
+            or str(Path(settings.get("CRAWL_STATE_DIR")) / "validators.sqlite"),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.item_scraped, signal=signals.item_scraped)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.store = ValidatorStore(self.path)
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+    def enabled(self):
+        return self.store is not None and self.crawler.settings.getbool(
+            "REVALIDATION_ENABLED", True
+        )
+
+    def process_request(self, request):
+        if not request.meta.get("revalidate") or not self.enabled():
+            return None
+
+        validators = self.store.get(request.url)
+        if validators is None:
+            return None
+        etag, last_modified, _, _ = validators
+        if etag:
+            request.headers.setdefault("If-None-Match", etag)
+        if last_modified:
+            request.headers.setdefault("If-Modified-Since", last_modified)
+        # let the 304 through HttpErrorMiddleware to the callback, media requests already accept every status
+        if (etag or last_modified) and not request.meta.get("handle_httpstatus_all"):
+            handled = request.meta.get("handle_httpstatus_list", [])
+            if 304 not in handled:
+                request.meta["handle_httpstatus_list"] = [*handled, 304]
+        return None
+
+    def process_response(self, request, response):
+        if "revalidate" not in request.meta or not self.enabled():
+            return response
+
+        if response.status == 200:
+            self.store.put(
+                request.url,
+                response.headers.get("ETag", b"").decode() or None,
+                response.headers.get("Last-Modified", b"").decode() or None,
+                hashlib.sha1(response.body).hexdigest(),
+                len(response.body),
+            )
+            return response
+
+        if response.status != 304:
+            return response
+
+        validators = self.store.get(request.url)
+        size = validators[3] if validators else None
+        self.stats.inc_value("revalidation/not_modified")
+        if size:
+            self.stats.inc_value("revalidation/bytes_saved", size)
+
+        # album pages are re-emitted from the previous run's fields, images keep their stored file (see ImagesPipeline)
+        if request.meta.get("handle_httpstatus_all"):
+            return response
+        previous = self.store.get_album(request.url)
+        if previous is not None:
+            request.meta["previous_album"] = previous
+            return response
+
+        # the page did not change, but we never stored what it contained: fetch it in full once
+        self.stats.inc_value("revalidation/refetched")
+        retry = request.replace(dont_filter=True)
+        retry.headers.pop("If-None-Match", None)
+        retry.headers.pop("If-Modified-Since", None)
+        retry.meta["revalidate"] = False
+        return retry
+
+    def item_scraped(self, item, response, spider):
+        # remember the album fields of every album page we revalidate, so a 304 next run can reuse them
+        if self.store is None or not isinstance(response, Response):
+            return
+        if "revalidate" not in response.meta:
+            return
+        album_url = item.get("album_url")
+        if album_url is None or "product_images" not in item:
+            return
+        self.store.put_album(
+            album_url, {field: item.get(field) for field in PREVIOUS_ALBUM_FIELDS}
+        )
@@ -0,0 +1,265 @@
+# Adaptive revisit scheduling of the albums spider, per category
+#
+# Every albums run used to crawl every category, although a few brands get new albums daily and most barely change.
+# AlbumIndex keeps, in CRAWL_STATE_DIR/album_index.sqlite:
+#
+# - albums:     every album row (AlbumItem) seen per category, and when it was first and last seen
+# - categories: per category, when it was last crawled and its change rate,
+#               an exponential moving average (EMA) of the new albums it gets per day
+#
+# and RevisitPolicy turns the change rate into a revisit interval: the time it takes the category to get
+# REVISIT_TARGET_NEW_ALBUMS new albums, clamped between REVISIT_MIN_INTERVAL and REVISIT_MAX_STALENESS,
+# so a busy brand is crawled (almost) every run and a stable one only once every REVISIT_MAX_STALENESS at most.
+#
+# With scrapy crawl albums -a revisit=1, the categories that are not due are not fetched, their rows are re-emitted from the index,
+# so albums.json stays complete (the images spider and the tombstone diff rely on it).
+# Without it every category is crawled, and the index and change rates are still kept up to date.
+
+# import argparse for the command line interface
+import argparse
+
+# import json to store the album rows
+import json
+
+# import time to timestamp the crawls
+import time
+
+# import Path to build the default index path
+from pathlib import Path
+
+# import the base class of the SQLite stores, it opens the file and batches the writes
+from fashionbroda.sqlitestore import SqliteStore
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS albums (
+    category TEXT NOT NULL,
+    album TEXT NOT NULL,
+    row TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (category, album)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS categories (
+    category TEXT PRIMARY KEY,
+    rate REAL,
+    last_crawled REAL NOT NULL,
+    crawls INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+DAY = 86400
+
+
+class AlbumIndex(SqliteStore):
+    """
+    The albums seen per category by previous albums runs, and the crawl history of every category.
+
+    Args:
+        path (str | Path): The SQLite file, created if it does not exist
+        commit_every (int): Number of writes grouped in one transaction
+    """
+
+    schema = SCHEMA
+    commit_every = 500
+
+    def known(self, category, album):
+        """Return True if the album was already listed under the category by a previous run."""
+        return (
+            self.db.execute(
+                "SELECT 1 FROM albums WHERE category = ? AND album = ?",
+                (category, album),
+            ).fetchone()
+            is not None
+        )
+
+    def record(self, category, album, row, now=None):
+        """
+        Record an album listed under a category, and tell whether it is new.
+
+        Args:
+            category (str): The category the album was listed under
+            album (str): The album key (see planner.album_key)
+            row (dict): The album row, re-emitted when the category is not due
+            now (float | None): The crawl time, defaults to the current time
+
+        Returns:
+            bool: True if the category never listed this album before
+        """
+        now = time.time() if now is None else now
+        new = not self.known(category, album)
+        self.write(
+            "INSERT INTO albums (category, album, row, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (category, album) DO UPDATE SET row = excluded.row, last_seen = excluded.last_seen",
+            (category, album, json.dumps(row, ensure_ascii=False), now, now),
+        )
+        return new
+
+    def rows(self, category, seen_before=None):
+        """
+        Stream the album rows stored for a category.
+
+        Args:
+            category (str): The category
+            seen_before (float | None): Only the albums last seen before this time, e.g. not listed by the current run yet
+        """
+        sql = "SELECT row FROM albums WHERE category = ?"
+        params = (category,)
+        if seen_before is not None:
+            sql += " AND last_seen < ?"
+            params = (category, seen_before)
+        # fetch everything first, the caller may write to the index while it consumes the rows
+        for (row,) in self.db.execute(sql, params).fetchall():
+            yield json.loads(row)
+
+    def prune(self, category, before):
+        """Forget the albums of a fully crawled category that were not listed since `before`, they were removed."""
+        self.write(
+            "DELETE FROM albums WHERE category = ? AND last_seen < ?",
+            (category, before),
+        )
+
+    def category_state(self, category):
+        """
+        Return the crawl history of a category.
+
+        Returns:
+            tuple[float | None, float, int] | None: (rate in new albums per day, last crawl time, number of crawls),
+                None if the category was never crawled
+        """
+        return self.db.execute(
+            "SELECT rate, last_crawled, crawls FROM categories WHERE category = ?",
+            (category,),
+        ).fetchone()
+
+    def update_category(self, category, new_albums, now, alpha):
+        """
+        Fold the new albums of a finished crawl into the change rate of a category.
+
+        The first crawl of a category only records it, every album looks new then.
+
+        Args:
+            category (str): The category
+            new_albums (int): Number of albums this crawl found that the index did not know
+            now (float): The crawl time
+            alpha (float): Weight of this crawl in the moving average, between 0 and 1
+        """
+        state = self.category_state(category)
+        if state is None:
+            rate, crawls = None, 1
+        else:
+            previous_rate, last_crawled, crawls = state
+            # new albums per day since the last crawl, at least one hour apart so two back to back runs don't explode the rate
+            observed = new_albums / max((now - last_crawled) / DAY, 1 / 24)
+            rate = (
+                observed
+                if previous_rate is None
+                else alpha * observed + (1 - alpha) * previous_rate
+            )
+            crawls += 1
+        self.write(
+            "INSERT OR REPLACE INTO categories (category, rate, last_crawled, crawls) VALUES (?, ?, ?, ?)",
+            (category, rate, now, crawls),
+        )
+
+    def categories(self):
+        """Return the crawl history of every category, as (category, rate, last_crawled, crawls) rows."""
+        return self.db.execute(
+            "SELECT category, rate, last_crawled, crawls FROM categories ORDER BY category"
+        ).fetchall()
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class RevisitPolicy:
+    """
+    Decide when a category is due for a crawl again, from its change rate.
+
+    Args:
+        target_new_albums (float): Number of new albums a category should have gathered when it is revisited
+        min_interval (float): Shortest revisit interval, in seconds
+        max_staleness (float): Longest revisit interval, in seconds, every category is crawled at least this often
+    """
+
+    def __init__(self, target_new_albums, min_interval, max_staleness):
+        self.target_new_albums = target_new_albums
+        self.min_interval = min_interval
+        self.max_staleness = max_staleness
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.getfloat("REVISIT_TARGET_NEW_ALBUMS", 5),
+            settings.getfloat("REVISIT_MIN_INTERVAL", 6 * 3600),
+            settings.getfloat("REVISIT_MAX_STALENESS", 7 * DAY),
+        )
+
+    def interval(self, rate):
+        """
+        Return the revisit interval of a category, in seconds.
+
+        Args:
+            rate (float | None): New albums per day, None when the category was only crawled once
+        """
+        # crawled once: we know nothing of its rate yet, come back soon to measure it
+        if rate is None:
+            return self.min_interval
+        # no new album for a long time: only the staleness guarantee brings us back
+        if rate <= 0:
+            return self.max_staleness
+        interval = self.target_new_albums / rate * DAY
+        return min(max(interval, self.min_interval), self.max_staleness)
+
+    def is_due(self, state, now=None):
+        """
+        Return True if a category should be crawled now.
+
+        Args:
+            state (tuple | None): The category's AlbumIndex.category_state()
+            now (float | None): The current time
+        """
+        if state is None:
+            return True
+        rate, last_crawled, _ = state
+        now = time.time() if now is None else now
+        return now - last_crawled >= self.interval(rate)
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def main():
+    # default to the project's settings, the same ones the albums spider uses
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    parser = argparse.ArgumentParser(
+        description="Show the change rate and revisit schedule of every category"
+    )
+    parser.add_argument(
+        "--path",
+        default=settings.get("ALBUM_INDEX_PATH")
+        or str(Path(settings.get("CRAWL_STATE_DIR")) / "album_index.sqlite"),
+        help="ALBUM_INDEX_PATH",
+    )
+    args = parser.parse_args()
+
+    index = AlbumIndex(args.path)
+    policy = RevisitPolicy.from_settings(settings)
+    now = time.time()
+    for category, rate, last_crawled, crawls in index.categories():
+        interval = policy.interval(rate)
+        due = now - last_crawled >= interval
+        rate_text = "unknown" if rate is None else f"{rate:.2f}/day"
+        print(
+            f"{category}: {rate_text}, every {interval / 3600:.1f}h, "
+            f"last crawled {(now - last_crawled) / 3600:.1f}h ago after {crawls} crawls"
+            f"{', due' if due else ''}"
+        )
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
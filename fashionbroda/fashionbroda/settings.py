@@ -17,6 +17,9 @@ SETTINGS_PATH = Path(__file__).resolve().parent
 # Path to the project root (where scrapy.cfg is)
 BASE_DIR = SETTINGS_PATH.parent
 
+# Directory for crawl state that must outlive a single run and its JOBDIR (shared frontier, caches, indexes, ...)
+CRAWL_STATE_DIR = str(SETTINGS_PATH / "crawl_state")
+
 # *-----------------------------------------------------------------------------------------------
 
 BOT_NAME = "fashionbroda"
@@ -24,7 +27,10 @@ BOT_NAME = "fashionbroda"
 SPIDER_MODULES = ["fashionbroda.spiders"]
 NEWSPIDER_MODULE = "fashionbroda.spiders"
 
-ADDONS = {}
+ADDONS = {
+    # Switch the crawl to replay from the crawl archive when ARCHIVE_REPLAY is set (see archive.py)
+    "fashionbroda.archive.ArchiveReplayAddon": 100,
+}
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -51,6 +57,48 @@ DOWNLOAD_DELAY = 0.25  # 500 milliseconds of delay between requests to the same
 # If we set it to False, the download delay will be fixed as per DOWNLOAD_DELAY setting
 RANDOMIZE_DOWNLOAD_DELAY = True
 
+# Read the total page count from the pagination widget on the first page of each category and schedule every page at once,
+# instead of following the 'next page' link one round trip at a time (the albums spider falls back to serial following if the count can't be read)
+ALBUMS_PAGINATION_FANOUT = True
+
+# The albums spider keeps every album it lists, per category, in an album index (CRAWL_STATE_DIR/album_index.sqlite by default),
+# with the change rate of every category: a moving average of the new albums it gets per day (see revisit.py)
+# ALBUM_INDEX_PATH = str(SETTINGS_PATH / "crawl_state/album_index.sqlite")
+# With scrapy crawl albums -a revisit=1, a category is only crawled again once it should have gathered REVISIT_TARGET_NEW_ALBUMS new albums,
+# but never sooner than REVISIT_MIN_INTERVAL and never later than REVISIT_MAX_STALENESS (seconds)
+REVISIT_TARGET_NEW_ALBUMS = 5
+REVISIT_MIN_INTERVAL = 6 * 3600
+REVISIT_MAX_STALENESS = 7 * 86400
+# Weight of the latest crawl in the change rate moving average, higher reacts faster to a brand picking up or slowing down
+REVISIT_EMA_ALPHA = 0.3
+# With scrapy crawl albums -a incremental=1, stop paginating a category (newest albums come first) once a page lists
+# this many albums in a row that the album index already knows, the albums after them are re-emitted from the index
+ALBUMS_INCREMENTAL_STOP_AFTER = 10
+
+# Group the albums.json rows by album before the images crawl and merge their categories into one ImageItem,
+# so an album listed under "All categories", its brand and "Other Brands" is fetched once instead of three times,
+# the rows are grouped in a scratch file in CRAWL_STATE_DIR, so memory stays flat but the first request waits for one manifest pass
+IMAGES_DEDUPE_ALBUMS = True
+
+# Album requests and image items carry a short context id instead of the seller / category fields, which are stored once
+# in the spider's context registry (and in JOBDIR when it is set), the items are filled back in right before export
+IMAGES_INTERN_CONTEXTS = True
+
+# Number of worker processes that extract album pages off the reactor thread (see extractors.py), 0 extracts them in the
+# crawler process, set it to the spare cores so parsing no longer stalls downloads and pipelines
+IMAGES_PARSE_WORKERS = 0
+
+# The catalog spider chains fashion_broda -> albums -> images in one process and only writes the images feeds by default,
+# set this to True to also write fashion_broda.json and albums.json from the same crawl
+CATALOG_EXPORT_INTERMEDIATE = False
+
+# Backpressure for the images spider start(): pause reading the manifest while the scheduler backlog or the downloader
+# (pages and image downloads) reaches its high-water mark, and resume once both are back under their low-water marks
+START_BACKLOG_HIGH_WATER = 1000
+START_BACKLOG_LOW_WATER = 500
+START_DOWNLOADS_HIGH_WATER = 200
+START_DOWNLOADS_LOW_WATER = 100
+
 # Disable cookies (enabled by default)
 # This increases scraping speed and reduces the chance of being tracked via cookies
 COOKIES_ENABLED = False
@@ -71,6 +119,9 @@ TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 SPIDER_MIDDLEWARES = {
     # Usually empty unless you have custom logic for handling items
     # "reps_cheap.middlewares.RepsCheapSpiderMiddleware": 543,
+    # ack the shared frontier's rows once their page and its items are done, only active with FrontierScheduler (see frontier.py)
+    # Priority 0: closest to the engine, it must see the output that reaches the scraper
+    "fashionbroda.frontier.FrontierAckMiddleware": 0,
 }
 
 # Enable or disable downloader middlewares
@@ -80,14 +131,46 @@ SPIDER_MIDDLEWARES = {
 DOWNLOADER_MIDDLEWARES = {
     # 1. Disable default Scrapy UserAgent (Important!)
     "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
+    # Ack the shared frontier's rows of requests that failed for good, only active with FrontierScheduler (see frontier.py)
+    # Priority 0: its process_exception() runs last, after RetryMiddleware had its chance to retry
+    "fashionbroda.frontier.FrontierAckMiddleware": 0,
+    # Drop the requests for albums removed from the site (see tombstones.py)
+    # Priority 350: runs before anything is spent on them (session, proxy, logging)
+    "fashionbroda.tombstones.TombstoneMiddleware": 350,
     # 2. Activate YOUR custom rotation middleware
     # Priority 400: Runs early to assign User-Agent and Proxy
     "fashionbroda.middlewares.SessionMiddleware": 400,
     # 3. Request Logging (Helpful to verify it's working)
     # Priority 700: Runs after everything else to see the final headers
     "fashionbroda.middlewares.RequestIdentityLoggingMiddleware": 700,
+    # Record the downloaded pages in the crawl archive when ARCHIVE_RECORD is set (see archive.py)
+    # Priority 580: runs after HttpCompressionMiddleware (590) and RedirectMiddleware (600), so it records decoded, final pages
+    "fashionbroda.archive.ArchiveRecorderMiddleware": 580,
+    # 4. Conditional revalidation (ETag / Last-Modified) of album pages and images against the previous run
+    # Priority 850: its process_request adds If-None-Match / If-Modified-Since before the HTTP cache (900) sees the request.
+    # The cache ignores them: the request fingerprint and the default DummyPolicy don't look at request headers,
+    # a cache hit is served without reaching the server, and a 304 is never stored (see httpcache.py).
+    # Its process_response runs after the cache stored the response, so a cached 200 still refreshes the validators.
+    "fashionbroda.revalidation.ConditionalRequestMiddleware": 850,
 }
 
+# Send the previous run's validators with album and image requests, unchanged ones answer 304 and are reused,
+# the validators and album fields are kept in CRAWL_STATE_DIR/validators.sqlite
+REVALIDATION_ENABLED = True
+
+# The albums removed from the site, written by `python -m fashionbroda.tombstones` after every albums run,
+# TombstoneMiddleware skips them, defaults to scraped_data/tombstones.jsonl, a missing file skips nothing
+# TOMBSTONES_PATH = str(SETTINGS_PATH / "scraped_data/tombstones.jsonl")
+
+# Where AlbumFingerprintPipeline keeps the album fingerprints of the previous run, defaults to CRAWL_STATE_DIR/album_fingerprints.sqlite,
+# a run's fingerprints only replace the previous ones once it finished
+# ALBUM_FINGERPRINTS_PATH = str(SETTINGS_PATH / "crawl_state/album_fingerprints.sqlite")
+
+# Record the category pages, album pages and images that still fail after their retries in a dead-letter store
+# (CRAWL_STATE_DIR/deadletter.sqlite unless DEADLETTER_PATH is set), re-run only them with: scrapy crawl <spider> -a deadletter=1
+DEADLETTER_ENABLED = True
+# DEADLETTER_PATH = str(SETTINGS_PATH / "crawl_state/deadletter.sqlite")
+
 # Define the path to the rotating proxies list
 ROTATING_PROXY_LIST_PATH = str(SETTINGS_PATH / "resources/proxies.txt")
 
@@ -107,12 +190,27 @@ ROTATING_PROXY_CLOSE_SPIDER = False
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 EXTENSIONS = {
     "fashionbroda.extensions.CleanJobDirExtension": 500,
+    # sample the reactor's lag into the reactor_lag/* stats, and log the stack of whatever blocks it (see extensions.py)
+    "fashionbroda.extensions.ReactorLagMonitor": 510,
 }
 
+# seconds between two reactor lag samples
+REACTOR_LAG_INTERVAL = 0.5
+# lag in seconds from which the reactor counts as stalled, the stack of the code blocking it is then logged
+REACTOR_LAG_THRESHOLD = 2.0
+# most stacks logged per run
+REACTOR_LAG_MAX_DUMPS = 5
+
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
+    # journal the albums whose images are in flight in JOBDIR, so a resumed crawl finishes them (see journal.py)
+    "fashionbroda.pipelines.MediaJournalPipeline": 0,
     "fashionbroda.pipelines.ImagesPipeline": 1,
+    # fingerprint every album and compare it with the previous run, for the images_delta feed
+    "fashionbroda.pipelines.AlbumFingerprintPipeline": 800,
+    # fill the shared seller / category fields back into compact items, it must run last, right before the feed exports
+    "fashionbroda.pipelines.HydrateContextPipeline": 900,
 }
 
 # where to save downloaded images
@@ -136,11 +234,19 @@ IMAGES_STORE = str(
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+# enable it for development reruns with: scrapy crawl images -s HTTPCACHE_ENABLED=True
 HTTPCACHE_ENABLED = False
 # HTTPCACHE_EXPIRATION_SECS = 0
 # HTTPCACHE_DIR = "httpcache"
 # HTTPCACHE_IGNORE_HTTP_CODES = []
-# HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# compressed, content-addressed SQLite storage, see httpcache.py
+HTTPCACHE_STORAGE = "fashionbroda.httpcache.SqliteCacheStorage"
+# expiration per page type (URL regex -> seconds, first match wins, 0 never expires),
+# category listings gain new albums all the time, album pages rarely change once posted
+HTTPCACHE_TTL_POLICIES = {
+    r"/categories/": 6 * 60 * 60,
+    r"/albums/": 30 * 24 * 60 * 60,
+}
 
 # Set settings whose default value is deprecated to a future-proof value
 FEED_EXPORT_ENCODING = "utf-8"
@@ -148,6 +254,46 @@ FEED_EXPORT_ENCODING = "utf-8"
 # resume the crawl where it left off in case of interruption
 # JOBDIR = "crawls/fashionbroda_job"
 
+# Store the JOBDIR request queues in SQLite files instead of pickle chunk files, resuming only opens the files
+# and CleanJobDirExtension compacts them when a crawl is paused (JOBDIR_COMPACT), see queues.py
+SCHEDULER_DISK_QUEUE = "fashionbroda.queues.SqliteLifoDiskQueue"
+SCHEDULER_START_DISK_QUEUE = "fashionbroda.queues.SqliteFifoDiskQueue"
+# push / pop operations grouped in one transaction, a hard kill can lose at most this many
+SQLITE_QUEUE_COMMIT_EVERY = 500
+JOBDIR_COMPACT = True
+# Keep the JOBDIR dupefilter fingerprints in an indexed SQLite table (JOBDIR/requests.seen.sqlite) instead of
+# requests.seen and an in-memory set that grow with every request, an existing requests.seen is imported on resume
+DUPEFILTER_CLASS = "fashionbroda.queues.SqliteDupeFilter"
+
+# Record every page the crawl downloads in the crawl archive (CRAWL_STATE_DIR/archive.sqlite unless ARCHIVE_PATH is set),
+# then re-run the parsers offline with -s ARCHIVE_REPLAY=True, pages are served from the archive with no network access
+ARCHIVE_RECORD = False
+ARCHIVE_REPLAY = False
+# ARCHIVE_PATH = str(SETTINGS_PATH / "crawl_state/archive.sqlite")
+
+# Fingerprint requests by their canonical URL, album and category links carry tracking parameters (referrercate, isSubCate, ...)
+# that made the same album a new request on every category listing it (see urls.py)
+REQUEST_FINGERPRINTER_CLASS = "fashionbroda.urls.YupooRequestFingerprinter"
+
+# Persistent Bloom filter dupefilter in CRAWL_STATE_DIR/seen, it survives the JOBDIR cleanup so a new run skips the albums
+# (requests with meta "persist_seen") whose items earlier runs already scraped, manage it with: python -m fashionbroda.dupefilters inspect|reset|age <spider>
+# DUPEFILTER_CLASS = "fashionbroda.dupefilters.BloomDupeFilter"
+# fingerprints per generation, and the false-positive rate once a generation is full (about 18 MB per generation with these values)
+DUPEFILTER_BLOOM_CAPACITY = 10_000_000
+DUPEFILTER_BLOOM_ERROR_RATE = 0.001
+# when the newest generation is full a new one is started, and the oldest is dropped beyond this many generations
+DUPEFILTER_BLOOM_GENERATIONS = 2
+
+# Shared crawl frontier, lets several worker processes (or boxes sharing a network drive) work through one crawl:
+#   scrapy crawl images -s SCHEDULER=fashionbroda.frontier.FrontierScheduler
+# start the same command again in another terminal to add a worker
+# FRONTIER_PATH = str(Path(CRAWL_STATE_DIR) / "frontier.sqlite")
+# a leased request is handed to another worker if it is not done within this many seconds (e.g. its worker died),
+# a live worker renews the leases of the requests it is still working on
+FRONTIER_LEASE_SECS = 300
+# number of requests leased per database transaction
+FRONTIER_LEASE_BATCH = 16
+
 # * scrapy crawl "<spider_name>" -s JOBDIR=   --- this overides the JOBDIR setting in settings.py, allowing you to specify a different job directory for each crawl if needed
 
 # *---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
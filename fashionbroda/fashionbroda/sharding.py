@@ -0,0 +1,71 @@
+# Deterministic partitioning of albums across images spider processes
+#
+# One images spider process is bound to one core and one reactor. To use more cores we run N processes side by side,
+# each started with -a shard=<i> -a shards=<N>, and each one only crawls the albums whose identity hashes to its shard.
+#
+# The partition must be the same in every process and on every run, so we use a SHA1 digest of the album identity,
+# never Python's built-in hash(), which is randomized per process.
+
+# import hashlib to hash album identities deterministically
+import hashlib
+
+# import the album identity helper, so every listing of the same album lands in the same shard
+from fashionbroda.planner import album_key
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def shard_of(album_url, shards):
+    """
+    Return the shard an album belongs to.
+
+    Args:
+        album_url (str): Absolute album URL, with or without its query string
+        shards (int): Total number of shards
+
+    Returns:
+        int: A shard number between 0 and shards - 1
+    """
+    digest = hashlib.sha1(album_key(album_url).encode()).digest()
+    # the first 8 bytes of the digest are more than enough to spread albums evenly
+    return int.from_bytes(digest[:8], "big") % shards
+
+
+def parse_shard_args(shard, shards):
+    """
+    Validate the shard / shards spider arguments.
+
+    Args:
+        shard (str | int | None): The -a shard=<i> argument
+        shards (str | int | None): The -a shards=<N> argument
+
+    Returns:
+        tuple[int, int] | None: (shard, shards), or None when sharding is disabled
+
+    Raises:
+        ValueError: If only one argument is given, or the values are out of range
+    """
+    # no sharding arguments at all means this process crawls every album
+    if shard is None and shards is None:
+        return None
+    if shard is None or shards is None:
+        raise ValueError("shard and shards must be given together")
+
+    shard, shards = int(shard), int(shards)
+    if shards < 1 or not 0 <= shard < shards:
+        raise ValueError(f"shard must be between 0 and {shards - 1}, got {shard}")
+    return shard, shards
+
+
+def feed_suffix(shard, shards):
+    """
+    Return the suffix inserted into feed file names for a shard, e.g. images.shard-3-of-8.json.
+
+    Args:
+        shard (int): The shard number
+        shards (int): Total number of shards
+
+    Returns:
+        str: The file name suffix
+    """
+    return f".shard-{shard}-of-{shards}"
@@ -18,18 +18,50 @@ This should be done at system boundaries :
 
 """
 
-# import json to handle JSON data
-import json
+# import regex to read the page count out of the pagination widget
+import re
+
+# import time to timestamp the crawl in the album index
+import time
+
+# import Counter to count the new albums of every category
+from collections import Counter
+
+# import Path to build the default album index path
+from pathlib import Path
 
 # Import scrapy module to gain web scraping capabilities
 import scrapy
 
-# import scrapy exceptions to handle exceptions
-from scrapy.exceptions import CloseSpider
+# import w3lib helpers to read and build the ?page=N query parameter of category pages
+from w3lib.url import add_or_replace_parameter, url_query_parameter
 
 # import the AlbumItem class from items.py to structure the scraped data
 from fashionbroda.items import AlbumItem
 
+# import the streaming manifest reader so large feeds are never fully loaded into memory
+from fashionbroda.manifests import read_manifest
+
+# import the album identity, so an album is indexed once per category whatever its ?referrercate=
+from fashionbroda.planner import album_key
+
+# import the URL canonicalizer, album and category URLs are stored in their canonical form
+from fashionbroda.urls import canonicalize_url
+
+# import the album index and the revisit policy, to only crawl the categories that are due (see revisit.py)
+from fashionbroda.revisit import AlbumIndex, RevisitPolicy
+
+# import the spider argument flag parser
+from fashionbroda.utils import flag_enabled
+
+# import the dead-letter helpers, category pages that failed after their retries are recorded for a targeted re-run
+from fashionbroda.deadletter import (
+    close_dead_letters,
+    dead_letters,
+    record_failure,
+    record_success,
+)
+
 # import the BASE_DIR from settings.py ensuring specific path resolution
 from fashionbroda.settings import BASE_DIR
 
@@ -81,6 +113,8 @@ def validate_ctx_fields_values(raw_ctx):
         # add the validated key-value pair to the clean dictionary, stripping any leading or trailing whitespace from string values
         # this is done after checking that the string instace is not empty, to avoid calling strip on a None value, which would raise an AttributeError
         clean[key] = value.strip() if isinstance(value, str) else value
+    # keep one URL per category, whatever tracking parameters the link carried (see urls.py)
+    clean["category_link"] = canonicalize_url(clean["category_link"])
     # return the validated context data
     return clean
 
@@ -88,6 +122,57 @@ def validate_ctx_fields_values(raw_ctx):
 # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
 
+# precompiled pattern for the "N pages in total" text next to the page jump box, e.g. "共 12 页" or "12 pages"
+PAGE_TOTAL_TEXT_RE = re.compile(r"(\d+)\s*(?:页|pages?)", re.IGNORECASE)
+
+
+# create a function to read the total number of pages of a category from the pagination widget on its first page,
+# this lets parse_category schedule every page at once instead of following 'next page' links one round trip at a time
+def extract_page_total(response):
+    """
+    Read the total page count of a category listing from its pagination widget.
+
+    Args:
+        response (scrapy.http.Response): A category listing page
+
+    Returns:
+        int | None: The total number of pages, 1 if the category has no pagination at all,
+            or None if the widget exists but the count could not be read
+    """
+    # a category with a single page has no pagination widget and no 'next page' link
+    if not response.css(".pagination__main, a[title='next page']"):
+        return 1
+
+    candidates = []
+
+    # 1. the page jump box is a number input whose max attribute is the last page
+    candidates.extend(
+        response.css(".pagination__jumpwrap input[name='page']::attr(max)").getall()
+    )
+
+    # 2. the 'last page' link points at ?page=<total>
+    last_page = response.css("a[title='last page']::attr(href)").get()
+    if last_page:
+        candidates.append(url_query_parameter(response.urljoin(last_page), "page"))
+
+    # 3. the "N pages in total" text that sits next to the page jump box
+    for text in response.css(".pagination__jumpwrap ::text").getall():
+        match = PAGE_TOTAL_TEXT_RE.search(text)
+        if match:
+            candidates.append(match.group(1))
+
+    # keep the largest value that parses as a positive integer, ignore anything else
+    total = None
+    for value in candidates:
+        try:
+            value = int(str(value).strip())
+        except (ValueError, TypeError):
+            continue
+        if value > 0 and (total is None or value > total):
+            total = value
+    return total
+
+
 # Define a new spider class called AlbumsSpider that inherits from scrapy.Spider
 class AlbumsSpider(scrapy.Spider):
     # Name of the spider
@@ -131,59 +216,83 @@ class AlbumsSpider(scrapy.Spider):
 
     # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
+    # path to the manifest that lists the categories to crawl,
+    # it defaults to the fashion_broda.json feed written by the fashion_broda spider, and can be overridden with: scrapy crawl albums -a manifest=<path>
+    # both JSON arrays (the default feed format) and JSON Lines files are accepted
+    manifest = None
+
+    # adaptive revisits, scrapy crawl albums -a revisit=1 only crawls the categories that are due according to their change rate,
+    # the other categories are re-emitted from the album index (see revisit.py)
+    revisit = None
+
+    # incremental runs, scrapy crawl albums -a incremental=1 stops paginating a category once a page lists
+    # ALBUMS_INCREMENTAL_STOP_AFTER albums in a row that the album index already knows, listings put the newest albums first,
+    # the older albums of the category are re-emitted from the index
+    incremental = None
+    incremental_mode = False
+
+    # targeted re-runs, scrapy crawl albums -a deadletter=1 only requests the category pages that failed in earlier runs,
+    # from the dead-letter store instead of the manifest (see deadletter.py)
+    deadletter = None
+
+    # the album index, opened in start() and closed in closed()
+    album_index = None
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
     # create a function to read the start_urls from a json file
     # this function is an async generator that yields scrapy.Request objects
     async def start(self):
         """
         Entry point of the spider.
-        Reads category URLs from fashion_broda.json
-        and schedules category pages for scraping.
+        Streams category URLs from fashion_broda.json (or the -a manifest file)
+        and schedules category pages for scraping as each row is read.
         """
 
         # The starting URL for the spider to begin scraping, which is the categories page of the website
         # the start urls will be read from the fashion_broda.json file
 
-        # implement a try catch block to handle potential file reading errors
-        try:
-            """
-            TODO
-            # define the base directory, this is the directory where the current script is located, this is useful to ensure that we are reading the correct file, regardless of where the script is run from
-            # __file__ = path to THIS Python file (the spider file)
-            # .resolve() = convert it to an absolute path (no ../ or symlinks)
-            # .parents[1] = go UP one directory from this file, this gets us to the project root directory
-            base_dir = Path(__file__).resolve().parents[1]
-            """
-
-            # define the path to the fashion_broda.json file, which is located in the data directory in the project root directory
-            json_file_path = (
-                BASE_DIR
-                / "fashionbroda"
-                / "fashionbroda"
-                / "scraped_data"
-                / "fashion_broda.json"
-            )
+        # open the album index, every album listed by this run is recorded in it, stamped with the start of the crawl
+        self.album_index = AlbumIndex(
+            self.settings.get("ALBUM_INDEX_PATH")
+            or str(Path(self.settings.get("CRAWL_STATE_DIR")) / "album_index.sqlite")
+        )
+        self.crawl_started = time.time()
+        # the categories fetched by this run, and how many albums each one listed that the index did not know
+        self.crawled_categories = set()
+        self.new_albums = Counter()
+        # the categories an incremental run stopped early, their unseen albums may still exist so they are not pruned
+        self.partial_categories = set()
+        self.incremental_mode = flag_enabled(self.incremental)
+        revisit = flag_enabled(self.revisit)
+        policy = RevisitPolicy.from_settings(self.settings)
+
+        # in dead-letter mode only the category pages that failed before are requested, with the meta they failed with,
+        # the categories are not marked as crawled, a few pages say nothing about their change rate
+        if flag_enabled(self.deadletter):
+            store = dead_letters(self)
+            if store is None:
+                return
+            for kind, url, meta, reason, attempts in store.entries(
+                self.name, kinds=("category",)
+            ):
+                self.crawler.stats.inc_value("deadletter/replayed")
+                yield self.category_request(url, meta, dont_filter=True)
+            return
+
+        # define the path to the fashion_broda.json file, which is located in the data directory in the project root directory
+        json_file_path = self.manifest or (
+            BASE_DIR
+            / "fashionbroda"
+            / "fashionbroda"
+            / "scraped_data"
+            / "fashion_broda.json"
+        )
+
+        # stream the rows of the manifest one at a time instead of json.load()-ing the whole file,
+        # read_manifest() logs and raises CloseSpider for a missing or invalid file, just like the old try/except block did
+        data = read_manifest(json_file_path, self.logger)
 
-            # open the fashion_broda.json file and read its contents, using a with statement to ensure the file is properly closed after reading
-            # the file is opened in read mode, `r` with UTF-8 encoding to handle any special characters
-            with open(json_file_path, "r", encoding="utf-8") as json_file:
-                # load the JSON data from the file
-                # this returns a list of dictionaries, where each dictionary represents a category with its associated metadata, this is the data that we will be using to schedule the category pages for scraping
-                data = json.load(json_file)
-
-        # account for exceptions that may occur during file reading
-        # account for the file not being found error
-        except FileNotFoundError:
-            # log the error message that the JSON file was not found at the specified path, this is useful for debugging and monitoring the scraping process, to identify any issues with missing files
-            self.logger.error(f"JSON file not found at: {json_file_path}")
-            raise CloseSpider("JSON file not found")
-        # account for JSON decoding errors, which occur when the file is not in valid JSON format
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Invalid JSON format: {e}")
-            raise CloseSpider("Invalid JSON file")
-        # account for any other unexpected exceptions that may occur during file reading
-        except Exception as e:
-            self.logger.error(f"Unexpected error reading JSON file: {e}")
-            raise CloseSpider("Error reading JSON file")
         # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
         # loop through each entry in the data list
@@ -201,6 +310,19 @@ class AlbumsSpider(scrapy.Spider):
                 # if it is not active, continue without failing, onto the next category_url
                 continue
 
+            # in revisit mode, a category that is not due is not fetched, the albums it listed last time are re-emitted instead
+            category = ctx["category_link"]
+            if revisit and not policy.is_due(
+                self.album_index.category_state(category), self.crawl_started
+            ):
+                self.crawler.stats.inc_value("revisit/categories_skipped")
+                for row in self.album_index.rows(category):
+                    self.crawler.stats.inc_value("revisit/albums_reused")
+                    # the current context wins over the stored one, in case the manifest changed
+                    yield AlbumItem({**row, **ctx})
+                continue
+            self.crawled_categories.add(category)
+
             # yield a scrapy.Request for each category URL
             yield scrapy.Request(
                 # Give scrapy the URL to crawl, in this case the category URL, from the fashion_broda.json file
@@ -212,10 +334,36 @@ class AlbumsSpider(scrapy.Spider):
                 meta={"ctx": ctx},
                 # When the response is received, call the parse_category method to handle it
                 callback=self.parse_category,
+                # once its retries are exhausted, record the page in the dead-letter store
+                errback=self.category_failed,
             )
 
     # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
+    # build a category page request, with the errback that records it in the dead-letter store when it fails for good
+    def category_request(self, url, meta, **kwargs):
+        return scrapy.Request(
+            url=url,
+            meta=meta,
+            callback=self.parse_category,
+            errback=self.category_failed,
+            **kwargs,
+        )
+
+    # errback of category page requests, called when a page failed for good
+    def category_failed(self, failure):
+        meta = {
+            key: failure.request.meta[key]
+            for key in ("ctx", "page_total")
+            if key in failure.request.meta
+        }
+        record_failure(self, "category", failure, meta)
+        # a category with a missing page was not fully listed, its albums must not be pruned from the index
+        if "ctx" in meta and self.album_index is not None:
+            self.partial_categories.add(meta["ctx"]["category_link"])
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
     # create a parse method to handle the response from the category URLs and parse the album data from each category page, and then yield the album data as a dictionary
     def parse_category(self, response):
         # pass the metadata from the fashion_broda.json file to the parse_category method
@@ -229,6 +377,9 @@ class AlbumsSpider(scrapy.Spider):
             # return early to avoid processing with empty context
             return
 
+        # the page came through, forget it if an earlier run failed on it
+        record_success(self, "category", response)
+
         # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
         # page_number is not available on the page, but we can extract it from the URL, if the URL has a page number in it, we can use a regular expression to extract it, otherwise we can set it to 1 for the first page
@@ -249,6 +400,10 @@ class AlbumsSpider(scrapy.Spider):
         # select all album containers on the category page
         albums_links = response.css(".categories__children a")
 
+        # the longest run of albums the index already knew on this page, for incremental runs
+        known_in_a_row = 0
+        longest_known_run = 0
+
         # loop through each album container to extract album data
         for album in albums_links:
             # extract the album URL from the href attribute of the <a> tag
@@ -264,6 +419,8 @@ class AlbumsSpider(scrapy.Spider):
             album_url = album_url.strip()
             # convert relative album URL to absolute URL using response.urljoin, this is important to ensure that we are working with complete URLs, and to handle cases where the album URL is relative rather than absolute
             album_url = response.urljoin(album_url)
+            # then drop the tracking parameters (referrercate, isSubCate, ...), so an album has one URL whatever category lists it
+            album_url = canonicalize_url(album_url)
 
             # pack the data for the album into a dictionary, this includes the metadata from the fashion_broda.json file as well as the album URL and page number
             # create an AlbumItem instance to structure the scraped data, we can pass ctx dictionary using the double asterisks (**) to unpack its contents into the AlbumItem fields,
@@ -272,16 +429,86 @@ class AlbumsSpider(scrapy.Spider):
                 {
                     # unpack the validated ctx metadata to be passed to the albumitem for output
                     **ctx,
-                    "page_url": response.url,
+                    "page_url": canonicalize_url(response.url),
                     "page_number": active_page,
                     "album_url": album_url,
                 }
             )
+            # record the album in the album index, and count it if the category never listed it before
+            if self.album_index is not None:
+                if self.album_index.record(
+                    ctx["category_link"],
+                    album_key(album_url),
+                    dict(item),
+                    self.crawl_started,
+                ):
+                    self.new_albums[ctx["category_link"]] += 1
+                    known_in_a_row = 0
+                else:
+                    known_in_a_row += 1
+                    longest_known_run = max(longest_known_run, known_in_a_row)
+
             # yield the album item
             yield item
 
         # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
+        # read the fan-out state of this page from the meta
+        # - "page_total" missing: this is the first page of the category, nothing has been scheduled for its other pages yet
+        # - "page_total" is an int: every page up to page_total was already scheduled at once by the first page
+        # - "page_total" is None: the count could not be read, so we are following 'next page' links one at a time
+        page_total_known = "page_total" in response.meta
+        page_total = response.meta.get("page_total")
+
+        # on the first page, try to fan out: read the total page count and schedule every remaining page at once,
+        # so a 200 page category costs roughly one round trip plus 200 / CONCURRENT_REQUESTS instead of 200 round trips
+        # incremental runs never fan out, the point is to fetch as few pages as possible
+        if (
+            not page_total_known
+            and not self.incremental_mode
+            and self.settings.getbool("ALBUMS_PAGINATION_FANOUT", True)
+        ):
+            page_total = extract_page_total(response)
+            if page_total is None:
+                # log that the widget could not be read, and fall back to serial 'next page' following below
+                self.logger.info(
+                    f"Could not read the page count for {response.url}, following next page links serially"
+                )
+            else:
+                for page_number in range(active_page + 1, page_total + 1):
+                    # yield a request for every remaining page of the category
+                    yield self.category_request(
+                        # build the page URL by setting the ?page=N parameter on the current category URL
+                        add_or_replace_parameter(
+                            response.url, "page", str(page_number)
+                        ),
+                        # pass the metadata and the page count, so the fanned out pages do not fan out again
+                        {"ctx": ctx, "page_total": page_total},
+                    )
+
+        # a fanned out page only needs to follow 'next page' if it is the last page we scheduled,
+        # this keeps the crawl correct if more pages appeared after the count was read
+        if page_total is not None and active_page < page_total:
+            return
+
+        # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+        # in incremental mode, a long enough run of known albums means everything after it was already listed last time,
+        # stop here and re-emit the albums of the category this run did not reach, so albums.json stays complete
+        if self.incremental_mode and longest_known_run >= self.settings.getint(
+            "ALBUMS_INCREMENTAL_STOP_AFTER", 10
+        ):
+            category = ctx["category_link"]
+            self.crawler.stats.inc_value("incremental/categories_stopped_early")
+            self.logger.info(
+                f"Reached {longest_known_run} known albums in a row on {response.url}, not following the next pages"
+            )
+            self.partial_categories.add(category)
+            for row in self.album_index.rows(category, seen_before=self.crawl_started):
+                self.crawler.stats.inc_value("incremental/albums_reused")
+                yield AlbumItem({**row, **ctx})
+            return
+
         # get the next page link from the page
         next_page = response.css("a[title='next page']::attr(href)").get()
 
@@ -294,9 +521,31 @@ class AlbumsSpider(scrapy.Spider):
             yield response.follow(
                 # the spider will crawl the next page URL to extract more album data, this allows us to crawl through all the pages in the category until there are no more next page links
                 next_page,
-                # pass the metadata to the next page that is crawled
-                meta={"ctx": ctx},
+                # pass the metadata to the next page that is crawled, with the page count we already know (or None),
+                # so a serially followed page never tries to fan out again
+                meta={"ctx": ctx, "page_total": page_total},
                 # then call the parse_category method to handle the response from the next page,
                 # this creates a recursive crawling effect that allows us to crawl through all the pages in the category until there are no more next page links
                 callback=self.parse_category,
+                # once its retries are exhausted, record the page in the dead-letter store
+                errback=self.category_failed,
             )
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    # called by Scrapy when the spider closes, update the change rate of every category this run crawled
+    def closed(self, reason):
+        close_dead_letters(self)
+        if self.album_index is None:
+            return
+        # only a finished crawl has seen every page of its categories, an interrupted one would undercount and prune live albums
+        if reason == "finished":
+            alpha = self.settings.getfloat("REVISIT_EMA_ALPHA", 0.3)
+            for category in self.crawled_categories:
+                if category not in self.partial_categories:
+                    self.album_index.prune(category, before=self.crawl_started)
+                self.album_index.update_category(
+                    category, self.new_albums[category], self.crawl_started, alpha
+                )
+        self.album_index.close()
+        self.album_index = None
@@ -0,0 +1,237 @@
+# this spider chains the three crawl stages (fashion_broda -> albums -> images) inside a single crawler process
+# run it with : scrapy crawl catalog
+
+"""
+TODO : CONCEPTS TO PUT IN MIND
+
+Pipelining the crawl: the fashion_broda, albums and images spiders normally run as three separate `scrapy crawl` commands,
+handing off through fashion_broda.json and albums.json on disk, so each stage must finish completely before the next one starts.
+
+This spider reuses the exact same parsing callbacks, but instead of exporting the intermediate items it turns them into requests:
+- every category item from FashionBrodaSpider.parse becomes a category page request for AlbumsSpider.parse_category
+- every album item from AlbumsSpider.parse_category becomes an album page request for ImagesSpider.parse_album
+
+So album pages start downloading as soon as the first category page lands, and the intermediate JSON feeds
+become optional outputs (scrapy crawl catalog -s CATALOG_EXPORT_INTERMEDIATE=True) rather than required inputs.
+
+"""
+
+# Import scrapy module to gain web scraping capabilities
+import scrapy
+
+# import Scrapy's default feed item filter, we extend it to match item classes exactly
+from scrapy.extensions.feedexport import ItemFilter
+
+# import the item classes to tell the three stages apart
+from fashionbroda.items import AlbumItem, FashionbrodaItem, ImageItem
+
+# import the planner's album identity so an album listed under several categories is only fetched once
+from fashionbroda.planner import album_key
+
+# import the dead-letter store and the spider argument flag parser, for targeted re-runs
+from fashionbroda.deadletter import dead_letters
+from fashionbroda.utils import flag_enabled
+
+# import the three spiders whose callbacks we chain together, and their context validators
+from fashionbroda.spiders.albums import AlbumsSpider
+from fashionbroda.spiders.albums import (
+    validate_ctx_fields_values as validate_category_ctx,
+)
+from fashionbroda.spiders.fashion_broda import FashionBrodaSpider
+from fashionbroda.spiders.images import ImagesSpider
+from fashionbroda.spiders.images import (
+    validate_ctx_fields_values as validate_album_ctx,
+)
+
+# *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+# ImageItem inherits from AlbumItem, which inherits from FashionbrodaItem,
+# so Scrapy's default isinstance() based item_classes filter would export every ImageItem into the albums feed too,
+# this filter only accepts items whose class is exactly one of the configured item_classes
+class ExactItemClassFilter(ItemFilter):
+    def accepts(self, item):
+        if self.item_classes:
+            return type(item) in self.item_classes
+        return True
+
+
+# *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+# define the CatalogSpider, it inherits parse_category from AlbumsSpider and parse_album from ImagesSpider
+class CatalogSpider(AlbumsSpider, ImagesSpider):
+    # name of the spider in this case it is catalog
+    name = "catalog"
+
+    # the allowed domains for the spider to scrape
+    allowed_domains = ["fashionbroda.x.yupoo.com"]
+
+    # the crawl starts from the same categories page as the fashion_broda spider
+    start_urls = FashionBrodaSpider.start_urls
+
+    # the clean category names, mapped by position exactly like the fashion_broda spider does
+    categories = FashionBrodaSpider.categories
+
+    # categories we never crawl for albums, these are the entries marked "active": false in fashion_broda.json
+    inactive_categories = ("All categories", "Contact Info")
+
+    # only the final images feeds are written by default, the intermediate feeds are added in update_settings() when enabled
+    custom_settings = {
+        "JOBDIR": "crawls/catalog",
+        "LOG_LEVEL": "INFO",
+        "FEEDS": {
+            path: {**options, "item_classes": [ImageItem]}
+            for path, options in ImagesSpider.custom_settings["FEEDS"].items()
+        },
+    }
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    @classmethod
+    def update_settings(cls, settings):
+        # apply custom_settings first, like every other spider
+        super().update_settings(settings)
+
+        # when CATALOG_EXPORT_INTERMEDIATE is enabled, also write fashion_broda.json and albums.json,
+        # so the separate albums / images spiders can still be re-run from this crawl's output
+        if not settings.getbool("CATALOG_EXPORT_INTERMEDIATE"):
+            return
+
+        feeds = dict(cls.custom_settings["FEEDS"])
+        for spider_cls, item_cls in (
+            (FashionBrodaSpider, FashionbrodaItem),
+            (AlbumsSpider, AlbumItem),
+        ):
+            for path, options in spider_cls.custom_settings["FEEDS"].items():
+                feeds[path] = {
+                    **options,
+                    "item_classes": [item_cls],
+                    "item_filter": ExactItemClassFilter,
+                }
+        settings.set("FEEDS", feeds, priority="spider")
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # album identities we already scheduled, an album listed under several categories is only fetched the first time we see it
+        # NOTE: unlike the planned images crawl, we cannot wait for every listing before fetching, so the first category seen wins
+        self.scheduled_albums = set()
+
+    # the chained crawl starts from the categories page, not from a manifest file
+    async def start(self):
+        # with -a deadletter=1, only the category and album pages that failed before are requested (see deadletter.py)
+        if flag_enabled(self.deadletter):
+            for request in self.dead_letter_requests():
+                yield request
+            return
+
+        # albums whose images were still downloading when the crawl was stopped, see ImagesSpider.resumed_album_requests()
+        for request in self.resumed_album_requests():
+            yield request
+
+        for url in self.start_urls:
+            yield scrapy.Request(url, callback=self.parse)
+
+    # rebuild the failed category page and album requests from the dead-letter store,
+    # an album whose images failed is requested again, its stored images are not downloaded twice
+    def dead_letter_requests(self):
+        store = dead_letters(self)
+        if store is None:
+            return
+        albums = set()
+        for kind, url, meta, reason, attempts in store.entries(self.name):
+            self.crawler.stats.inc_value("deadletter/replayed")
+            if kind == "category":
+                yield self.category_request(url, meta, dont_filter=True)
+                continue
+            ctx = meta.get("ctx", {})
+            if ctx.get("album_url") in albums:
+                continue
+            albums.add(ctx.get("album_url"))
+            yield self.album_request(ctx, dont_filter=True)
+
+    # build an album page request for stage 3, with the errback that records it in the dead-letter store when it fails for good
+    def album_request(self, ctx, **kwargs):
+        return scrapy.Request(
+            url=ctx["album_url"],
+            # carry the compact context, the shared fields live once in the context registry
+            meta={
+                "ctx": self.compact_context(ctx),
+                "persist_seen": True,
+                "revalidate": True,
+            },
+            # stage 3 is ImagesSpider.parse_album, inherited as is, through the extractor worker processes when IMAGES_PARSE_WORKERS is set
+            callback=(
+                self.parse_album_offloaded
+                if self.settings.getint("IMAGES_PARSE_WORKERS")
+                else self.parse_album
+            ),
+            errback=self.album_failed,
+            # album pages jump ahead of the remaining category pages,
+            # so images start flowing right away and the scheduler queue does not fill up with albums
+            priority=1,
+            **kwargs,
+        )
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    # stage 1 : parse the categories page with the fashion_broda spider's callback, and turn each category into a category page request
+    def parse(self, response):
+        export = self.settings.getbool("CATALOG_EXPORT_INTERMEDIATE")
+
+        for item in FashionBrodaSpider.parse(self, response):
+            # optionally export the category item to fashion_broda.json
+            if export:
+                yield item
+
+            # skip the categories that do not list albums
+            if item.get("category") in self.inactive_categories:
+                continue
+
+            # validate the category context exactly like AlbumsSpider.start() does for fashion_broda.json rows
+            try:
+                ctx = validate_category_ctx(item)
+            except ValueError as e:
+                self.logger.warning(f"Invalid category : {e} in item: {dict(item)}")
+                continue
+
+            yield self.category_request(ctx["category_link"], {"ctx": ctx})
+
+    # stage 2 : parse category pages with the albums spider's callback, and turn each album into an album page request
+    def parse_category(self, response):
+        export = self.settings.getbool("CATALOG_EXPORT_INTERMEDIATE")
+
+        for result in super().parse_category(response):
+            # pagination requests go straight back to the scheduler
+            if not isinstance(result, AlbumItem):
+                yield result
+                continue
+
+            # optionally export the album item to albums.json
+            if export:
+                yield result
+
+            # validate the album context exactly like ImagesSpider.start() does for albums.json rows
+            try:
+                ctx = validate_album_ctx(result)
+            except ValueError as e:
+                self.logger.warning(f"Invalid album : {e} in item: {dict(result)}")
+                continue
+
+            # only fetch each album once, whichever category lists it first
+            key = album_key(ctx["album_url"])
+            if key in self.scheduled_albums:
+                self.crawler.stats.inc_value("catalog/duplicate_albums")
+                continue
+            self.scheduled_albums.add(key)
+
+            yield self.album_request(ctx)
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    # close what both parent spiders opened, the album index and the extractor worker processes
+    def closed(self, reason):
+        AlbumsSpider.closed(self, reason)
+        ImagesSpider.closed(self, reason)
@@ -24,6 +24,9 @@ import scrapy
 # import the FashionbrodaItem class from items.py to structure the scraped data
 from fashionbroda.items import FashionbrodaItem
 
+# import the URL canonicalizer, category links are stored in their canonical form
+from fashionbroda.urls import canonicalize_url
+
 # import the BASE_DIR from settings.py ensuring specific path resolution
 from fashionbroda.settings import BASE_DIR
 
@@ -164,6 +167,8 @@ class FashionBrodaSpider(scrapy.Spider):
             category_link = category_link.strip() if category_link else None
             # then convert relative link to absolute URL
             category_link = response.urljoin(category_link) if category_link else None
+            # and drop the tracking parameters, so a category has one URL (see urls.py)
+            category_link = canonicalize_url(category_link) if category_link else None
 
             # get the text and check if it exists
             text = node.css("::text").get()
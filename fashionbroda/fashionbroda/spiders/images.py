@@ -17,23 +17,49 @@ This should be done at system boundaries :
 
 """
 
-# import json to handle json data
-import json
-
-# import regex
-import re
-
 # *import datetime to handle date and time data
 # *from datetime import datetime
 # Import scrapy module to gain web scraping capabilities
 import scrapy
 
-# import scrapy exceptions to handle exceptions
-from scrapy.exceptions import CloseSpider
-
 # import the ImageItem class from items.py to structure the scraped data
 from fashionbroda.items import ImageItem
 
+# import the single pass album page extractor, and the worker processes that can run it off the reactor thread
+from fashionbroda.extractors import ExtractorPool, extract_album
+
+# import the start() backpressure helper that keeps the scheduler backlog bounded
+from fashionbroda.backpressure import StartBackpressure
+
+# import the context registry that stores the seller / category fields once instead of once per request
+from fashionbroda.context import ContextRegistry
+
+# import the streaming manifest reader so large feeds are never fully loaded into memory
+from fashionbroda.manifests import read_manifest
+
+# import the helpers that split albums deterministically between shard processes
+from fashionbroda.sharding import feed_suffix, parse_shard_args, shard_of
+
+# import the planner that merges the albums listed under several categories into one crawl entry
+from fashionbroda.planner import plan_albums
+
+# import the URL canonicalizer, so albums.json rows from before canonical URLs still map to one album
+from fashionbroda.urls import canonicalize_url
+
+# import the dead-letter helpers, album pages and images that failed after their retries are recorded for a targeted re-run
+from fashionbroda.deadletter import (
+    close_dead_letters,
+    dead_letters,
+    record_failure,
+    record_success,
+)
+
+# import the spider argument flag parser
+from fashionbroda.utils import flag_enabled
+
+# import the media journal reader, to finish the albums whose images were in flight when a JOBDIR crawl stopped
+from fashionbroda.journal import journal_path, pending_albums
+
 # import the BASE_DIR from settings.py ensuring specific path resolution
 from fashionbroda.settings import BASE_DIR
 
@@ -88,6 +114,20 @@ def validate_ctx_fields_values(raw_ctx):
         # add the validated key-value pair to the clean dictionary, stripping any leading or trailing whitespace from string values
         # this is done after checking that the string instace is not empty, to avoid calling strip on a None value, which would raise an AttributeError
         clean[key] = value.strip() if isinstance(value, str) else value
+
+    # an albums.json written before URLs were canonicalized still carries the tracking parameters, canonicalize them here,
+    # so the album is requested, hashed and stored under one URL (see urls.py)
+    for key in ("album_url", "category_link", "page_url"):
+        clean[key] = canonicalize_url(clean[key])
+
+    # the planner (planner.plan_albums) adds a "categories" list with every category the album is listed under,
+    # it is optional, but when it is present it must be a non-empty list so the exported item stays consistent
+    categories = raw_ctx.get("categories")
+    if categories is not None:
+        if not isinstance(categories, list) or not categories:
+            raise ValueError("Invalid field: categories")
+        clean["categories"] = categories
+
     # return the validated context data
     return clean
 
@@ -123,7 +163,8 @@ class ImagesSpider(scrapy.Spider):
                 / "fashionbroda"
                 / "fashionbroda"
                 / "scraped_data"
-                / "images.json"
+                # %(shard_suffix)s is filled in by Scrapy from the spider attribute, it is empty unless -a shard/-a shards are given
+                / "images%(shard_suffix)s.json"
             ): {
                 "format": "json",
                 "encoding": "utf8",
@@ -140,6 +181,7 @@ class ImagesSpider(scrapy.Spider):
                     "page_url",
                     "page_number",
                     "album_url",
+                    "categories",
                     "product_images",
                     "size_chart_images",
                     "product_data",
@@ -153,7 +195,8 @@ class ImagesSpider(scrapy.Spider):
                 / "fashionbroda"
                 / "fashionbroda"
                 / "scraped_data"
-                / "images_paths.json"
+                # %(shard_suffix)s is filled in by Scrapy from the spider attribute, it is empty unless -a shard/-a shards are given
+                / "images_paths%(shard_suffix)s.json"
             ): {
                 "format": "json",
                 "encoding": "utf8",
@@ -170,16 +213,85 @@ class ImagesSpider(scrapy.Spider):
                     "page_url",
                     "page_number",
                     "album_url",
+                    "categories",
                     "product_images_paths",
                     "size_chart_images_paths",
                     "product_data",
                 ],
             },
+            # ----------------------------------------
+            # DELTA output (what changed since the previous run)
+            # ----------------------------------------
+            str(
+                BASE_DIR
+                / "fashionbroda"
+                / "fashionbroda"
+                / "scraped_data"
+                # %(shard_suffix)s is filled in by Scrapy from the spider attribute, it is empty unless -a shard/-a shards are given
+                / "images_delta%(shard_suffix)s.jsonl"
+            ): {
+                # one line per album, so downstream steps can stream it and only reprocess the added and changed albums
+                "format": "jsonlines",
+                "encoding": "utf8",
+                "overwrite": True,
+                "fields": [
+                    "album_url",
+                    "album_fingerprint",
+                    "change_status",
+                ],
+            },
         },
     }
 
     # *--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
+    # path to the manifest that lists the albums to crawl,
+    # it defaults to the albums.json feed written by the albums spider, and can be overridden with: scrapy crawl images -a manifest=<path>
+    # both JSON arrays (the default feed format) and JSON Lines files are accepted
+    manifest = None
+
+    # optional sharding, scrapy crawl images -a shard=3 -a shards=8 only crawls the albums whose identity hashes to shard 3,
+    # so N processes can split one catalog between them without two of them fetching the same album (see run_shards.py)
+    shard = None
+    shards = None
+    # suffix added to the feed file names, so the shards never write to the same file
+    shard_suffix = ""
+
+    # targeted re-runs, scrapy crawl images -a deadletter=1 only requests the albums whose page or images failed
+    # in earlier runs, from the dead-letter store instead of the manifest (see deadletter.py)
+    deadletter = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # validate the shard arguments once, as early as possible, so a typo fails the crawl before anything is fetched
+        sharding = parse_shard_args(self.shard, self.shards)
+        if sharding is not None:
+            self.shard, self.shards = sharding
+            self.shard_suffix = feed_suffix(self.shard, self.shards)
+        # created on first use, once spider.state has been loaded (see context_registry)
+        self._context_registry = None
+        # the extractor worker processes, started with the first album when IMAGES_PARSE_WORKERS is set
+        self._extractor_pool = None
+
+    # the registry of shared context fields, album requests and items only carry a context id (see context.py)
+    # with JOBDIR, the registry is kept in spider.state, which Scrapy saves in JOBDIR, so it survives pause / resume
+    @property
+    def context_registry(self):
+        if self._context_registry is None:
+            state = getattr(self, "state", None)
+            self._context_registry = ContextRegistry(
+                state.setdefault("contexts", {}) if state is not None else None
+            )
+        return self._context_registry
+
+    # return the context to put in request meta and items, compact unless IMAGES_INTERN_CONTEXTS is disabled
+    def compact_context(self, ctx):
+        if not self.settings.getbool("IMAGES_INTERN_CONTEXTS", True):
+            return ctx
+        return self.context_registry.compact(ctx)
+
+    # *--------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
     # create a function to read the start_urls from the albums.json file, this is important to ensure that we are starting our scraping process with the correct URLs,
     # and to allow us to easily update the start URLs by simply updating the albums.json file
     # this function is an async function because it will be called by Scrapy when the spider starts,
@@ -188,26 +300,20 @@ class ImagesSpider(scrapy.Spider):
     async def start(self):
         """
         Entry point of the spider.
-        Reads album URLs from albums.json
-        and schedules albums for scraping.
+        Streams album URLs from albums.json (or the -a manifest file)
+        and schedules albums for scraping as each row is read.
         """
 
         # The starting URL for the spider to begin scraping, which is the categories page of the website
         # the start urls will be read from the albums.json file
 
-        # implement a try catch block to handle potential file reading errors
-        try:
-            """
-            TODO
-            # define the base directory, this is the directory where the current script is located, this is useful to ensure that we are reading the correct file, regardless of where the script is run from
-            # __file__ = path to THIS Python file (the spider file)
-            # .resolve() = convert it to an absolute path (no ../ or symlinks)
-            # .parents[1] = go UP one directory from this file, this gets us to the project root directory
-            base_dir = Path(__file__).resolve().parents[1]
-            """
-
-            # define the path to the fashion_broda.json file, which is located in the data directory in the project root directory
-            json_file_path = (
+        # in dead-letter mode only the albums that failed before are requested, each album once however many of its images failed
+        replay = flag_enabled(self.deadletter)
+        if replay:
+            data = self.iter_dead_letter_contexts()
+        else:
+            # define the path to the albums.json file, which is located in the data directory in the project root directory
+            json_file_path = self.manifest or (
                 BASE_DIR
                 / "fashionbroda"
                 / "fashionbroda"
@@ -215,30 +321,132 @@ class ImagesSpider(scrapy.Spider):
                 / "albums.json"
             )
 
-            # open the albums.json file and read its contents, using a with statement to ensure the file is properly closed after reading
-            # the file is opened in read mode, `r` with UTF-8 encoding to handle any special characters
-            with open(json_file_path, "r", encoding="utf-8") as json_file:
-                # load the JSON data from the file
-                # this returns a list of dictionaries, where each dictionary represents an album with its associated metadata, this is the data that we will be using to schedule the album pages for scraping
-                data = json.load(json_file)
-
-        # account for exceptions that may occur during file reading
-        # account for the file not being found error
-        except FileNotFoundError:
-            # log the error message that the JSON file was not found at the specified path, this is useful for debugging and monitoring the scraping process, to identify any issues with missing files
-            self.logger.error(f"JSON file not found at: {json_file_path}")
-            raise CloseSpider("JSON file not found")
-        # account for JSON decoding errors, which occur when the file is not in valid JSON format
-        except json.JSONDecodeError as e:
-            self.logger.error(f"Invalid JSON format: {e}")
-            raise CloseSpider("Invalid JSON file")
-        # account for any other unexpected exceptions that may occur during file reading
-        except Exception as e:
-            self.logger.error(f"Unexpected error reading JSON file: {e}")
-            raise CloseSpider("Error reading JSON file")
+            # stream the rows of the manifest one at a time instead of json.load()-ing the whole file,
+            # so startup is immediate and memory stays flat no matter how many albums the feed lists
+            # read_manifest() logs and raises CloseSpider for a missing or invalid file, just like the old try/except block did
+            data = read_manifest(json_file_path, self.logger)
 
         # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
+        # validate every row as it is read, invalid rows are logged and skipped
+        contexts = self.iter_valid_contexts(data)
+
+        # when sharded, keep only the albums that belong to this shard,
+        # every listing of an album hashes to the same shard, so this is safe to do before planning
+        if self.shards:
+            contexts = (
+                ctx
+                for ctx in contexts
+                if shard_of(ctx["album_url"], self.shards) == self.shard
+            )
+
+        # the same album is listed under several categories (e.g. "All categories" and its brand),
+        # so unless it is disabled we plan the crawl first: group the rows by album and merge their categories,
+        # then every album page and its images are fetched exactly once, with all its categories on the ImageItem
+        # NOTE: planning spills every row (a full ctx) to a scratch file in CRAWL_STATE_DIR before the first request,
+        # so memory stays flat but the crawl starts after one pass over the manifest,
+        # set IMAGES_DEDUPE_ALBUMS = False to stream rows straight through
+        if not replay and self.settings.getbool("IMAGES_DEDUPE_ALBUMS", True):
+            contexts = plan_albums(
+                contexts,
+                stats=self.crawler.stats,
+                tmpdir=self.settings.get("CRAWL_STATE_DIR"),
+            )
+
+        # pause between requests while the scheduler backlog or the downloader (image downloads included) is saturated,
+        # so pending requests never pile up in memory faster than CONCURRENT_REQUESTS can drain them
+        backpressure = StartBackpressure.from_crawler(self.crawler)
+
+        # finish the albums a stopped crawl left half done first, the manifest rows of those albums are filtered as seen
+        for request in self.resumed_album_requests():
+            await backpressure.wait()
+            yield request
+
+        # loop through each validated (and planned) album context
+        for ctx in contexts:
+            await backpressure.wait()
+            # yield a scrapy.Request for each album URL
+            # a replayed album may have been seen by the dupefilter of the run it failed in
+            yield self.album_request(ctx, dont_filter=replay)
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    # build the request of an album page from its validated context
+    def album_request(self, ctx, **kwargs):
+        return scrapy.Request(
+            # Give scrapy the URL to crawl, in this case the album URL, from the albums.json file
+            url=ctx["album_url"],
+            # Pass the album data as metadata to the parse method, using meta parameter
+            # NOTE : only unpack data when you are dealing with data from unknown source
+            # and unpack the album dictionary directly, to validate its contents, only if it came from an external source, but for now since I control the fashion_broda.json file, it's safe, to pass the entire album dictionary
+            # define my namespace as 'ctx'  and pass the validated context metadata, to avoid confusion with other meta data, such as scrapy default ones, these include 'download_latency', 'depth', 'redirect_urls', 'redirect_times', 'retry_times', 'max_retry_times', etc.
+            # the seller / category fields are replaced by a context id, so JOBDIR only pickles the album specific fields
+            # persist_seen lets BloomDupeFilter skip the albums earlier runs already processed, when it is enabled
+            # revalidate sends the previous run's ETag / Last-Modified, an unchanged album answers 304 (see revalidation.py)
+            meta={
+                "ctx": self.compact_context(ctx),
+                "persist_seen": True,
+                "revalidate": True,
+            },
+            # When the response is received, call the parse_album method to handle it,
+            # through the extractor worker processes when IMAGES_PARSE_WORKERS is set
+            callback=(
+                self.parse_album_offloaded
+                if self.settings.getint("IMAGES_PARSE_WORKERS")
+                else self.parse_album
+            ),
+            # once its retries are exhausted, record the album in the dead-letter store
+            errback=self.album_failed,
+            **kwargs,
+        )
+
+    # request again the albums whose images were still downloading when a JOBDIR crawl stopped (see journal.py),
+    # their album requests are already marked seen, so they go past the dupefilter
+    def resumed_album_requests(self):
+        for ctx in self.iter_valid_contexts(
+            pending_albums(journal_path(self.settings)).values()
+        ):
+            self.crawler.stats.inc_value("journal/albums_resumed")
+            yield self.album_request(ctx, dont_filter=True)
+
+    # create a generator that reads the album contexts back from the dead-letter store, one per album
+    def iter_dead_letter_contexts(self):
+        store = dead_letters(self)
+        if store is None:
+            return
+        seen = set()
+        for kind, url, meta, reason, attempts in store.entries(
+            self.name, kinds=("album", "media")
+        ):
+            ctx = meta.get("ctx", {})
+            album_url = ctx.get("album_url")
+            if album_url in seen:
+                continue
+            seen.add(album_url)
+            self.crawler.stats.inc_value("deadletter/replayed")
+            yield ctx
+
+    # errback of album requests, called when the album page failed for good
+    def album_failed(self, failure):
+        ctx = failure.request.meta.get("ctx", {})
+        # store the full context, the context ids of this run mean nothing to the run that replays it
+        try:
+            ctx = self.context_registry.hydrate(ctx)
+        except ValueError:
+            pass
+        record_failure(self, "album", failure, {"ctx": ctx})
+
+    # called by Scrapy when the spider closes
+    def closed(self, reason):
+        close_dead_letters(self)
+        if self._extractor_pool is not None:
+            self._extractor_pool.close()
+            self._extractor_pool = None
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    # create a generator that validates the manifest rows one at a time, so start() never has to hold them all
+    def iter_valid_contexts(self, data):
         # loop through each entry in the data list
         for entry in data:
             # validate that all required fields are present and non empty
@@ -249,127 +457,64 @@ class ImagesSpider(scrapy.Spider):
                 self.logger.warning(f"Invalid entry : {e} in entry: {entry}")
                 # skip this entry and continue to the next one
                 continue
-            # yield a scrapy.Request for each album URL
-            yield scrapy.Request(
-                # Give scrapy the URL to crawl, in this case the album URL, from the albums.json file
-                url=ctx["album_url"],
-                # Pass the album data as metadata to the parse method, using meta parameter
-                # NOTE : only unpack data when you are dealing with data from unknown source
-                # and unpack the album dictionary directly, to validate its contents, only if it came from an external source, but for now since I control the fashion_broda.json file, it's safe, to pass the entire album dictionary
-                # define my namespace as 'ctx'  and pass the validated context metadata, to avoid confusion with other meta data, such as scrapy default ones, these include 'download_latency', 'depth', 'redirect_urls', 'redirect_times', 'retry_times', 'max_retry_times', etc.
-                meta={"ctx": ctx},
-                # When the response is received, call the parse_album method to handle it
-                callback=self.parse_album,
-            )
+            yield ctx
+
+    # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+
+    # the callback of album pages when IMAGES_PARSE_WORKERS is set, the page is extracted in a worker process (see extractors.py)
+    # while the reactor thread goes on with downloads and pipelines, then parse_album builds the item from the plain result
+    async def parse_album_offloaded(self, response):
+        extracted = None
+        # a 304 has no body to extract
+        if response.status != 304:
+            if self._extractor_pool is None:
+                self._extractor_pool = ExtractorPool(
+                    self.settings.getint("IMAGES_PARSE_WORKERS")
+                )
+            extracted = await self._extractor_pool.extract(response)
+            self.crawler.stats.inc_value("extractor/offloaded")
+        for result in self.parse_album(response, extracted):
+            yield result
 
     # *----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
     # create a method to parse the albums
-    def parse_album(self, response):
+    # extracted is the result of extract_album() when it already ran in a worker process
+    def parse_album(self, response, extracted=None):
         # extract the album metadata from the response meta, this is the metadata that we passed from the parse method when we scheduled the album pages for scraping
         ctx = response.meta.get("ctx", {})
         # validate the extracted context data to ensure it has all required fields and is properly structured before using it in the parsing logic
         try:
-            ctx = validate_ctx_fields_values(ctx)
+            # fill the shared fields back in from the context registry first, an unknown context id raises ValueError too
+            ctx = validate_ctx_fields_values(self.context_registry.hydrate(ctx))
         except ValueError as e:
             # log a warning message if the JSON structure is invalid, this is useful for debugging and monitoring the scraping process, to identify any issues with the data
             self.logger.warning(f"Invalid context data: {e} in context: {ctx}")
             # skip further processing for this response and return early
             return
 
-        # Get individual product image links from the album page
-        product_image_url = response.xpath(
-            '//img[contains(@class,"image__portrait")]/@data-origin-src'
-        ).getall()
-
-        # this will return a list of image URLs, and we use strip to remove any leading or trailing whitespace from the URLs,
-        # which can help to ensure that we are working with clean and valid URLs when we create the full URLs for the images
-        product_image_url = [url.strip() for url in product_image_url]
-
-        # create a full URL for each image by joining the base URL with the extracted relative URLs
-        product_image = [response.urljoin(url) for url in product_image_url]
-
-        # Get the sizing-data-sheet
-        size_chart_path = response.xpath(
-            '//img[contains(@class,"image__landscape")]/@data-origin-src'
-        ).getall()
-
-        # this will return a list of image URLs, and we use strip to remove any leading or trailing whitespace from the URLs,
-        # which can help to ensure that we are working with clean and valid URLs when we create the full URLs for the images
-        size_chart_path = [url.strip() for url in size_chart_path]
-
-        # create a full URL for each sizing-data-sheet image by joining the base URL with the extracted relative URLs
-        size_chart_images = [response.urljoin(path) for path in size_chart_path]
-
-        # Get product description data, from the meta description tag in sources tab in dev tools
-        # and safeguard if the pagedoes not have a description meta tag
-        raw_description = response.xpath("//meta[@name='description']/@content").get()
-
-        product_description = raw_description.split("\n") if raw_description else []
+        # the album page came through, forget it if an earlier run failed on it
+        record_success(self, "album", response)
 
-        # Create a dictionary to hold the product description data
-        product_data = {}
-
-        # *-----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-
-        #!IMPORTANT : DO NOT DO EXTENSIVE PROCESSING HERE, KEEP IT LIGHTWEIGHT, DATA CLEANSING SHOULD BE DONE IN THE PIPELINES.PY FILE
-        """NOTE:
-            This spider performs partial normalization of product descriptions.
-            Some fields (e.g. price) may appear as strings or integers depending
-            on source formatting. All final typing, schema enforcement, and cleanup
-            MUST be handled in pipelines or post-processing.
-            
-            This approach keeps the spider efficient and focused on data extraction.
-        """
-
-        # create a loop to split the product description data into key-value pairs
-        for data in product_description:
-            # check if the data contains a colon
-            if ":" in data:
-                # split the data into key and value
-                key, value = data.split(":", 1)  # split ONLY once
-
-                # strip convert key to lowercase and replace bullet points with whitespace then strip the whitespace
-                # Remove all bullet-like Unicode characters
-                clean_key = (
-                    re.sub(r"[•●・◦◘○◉⦿⦾▪▫]", "", key).lower().strip().replace(" ", "_")
+        # a 304 Not Modified has no body, the album did not change since the previous run,
+        # so re-emit the album fields that run stored instead of parsing (see revalidation.py)
+        if response.status == 304:
+            previous = response.meta.get("previous_album")
+            if previous is None:
+                self.logger.warning(
+                    f"Album not modified but not stored: {response.url}"
                 )
+                return
+            self.crawler.stats.inc_value("revalidation/albums_reused")
+            yield ImageItem({**self.compact_context(ctx), **previous})
+            return
 
-                # strip whitespace from value
-                clean_value = value.strip()
-
-                # Try to convert price to int
-                # check whether the clean_key is 'price', using the equality operator (==)
-                if clean_key == "price":
-                    # Filter out non-numeric characters (like '$', '¥', spaces) so only digits remain
-                    # This is done using a generator expression inside the join() method, which iterates over each character in the clean_value string and includes only those that are digits, effectively removing any currency symbols or formatting characters.
-                    # then joins them into one clean numeric string that can be converted to an integer, this is important to ensure that we are working with clean and consistent price data, which can be useful for analysis and comparison later on in the data processing pipeline
-                    numeric_string = "".join(
-                        character for character in clean_value if character.isdigit()
-                    )
-
-                    # try to convert the cleaned price string to an integer
-                    try:
-                        # convert the clean numerical string to an integer
-                        clean_value = int(numeric_string)
-                    # raise a value error if conversion fails
-                    except ValueError:
-                        # instead of failing, just pass the value as is to the json output
-                        pass
-
-                # specific handling for 'sizes' to convert string to list
-                if clean_key in ("sizes", "size") and isinstance(clean_value, str):
-                    clean_value = [
-                        s for s in re.split(r"[,\-/\s]+", clean_value.strip()) if s
-                    ]
-
-                # unified empty check: set value to None if it is empty string or empty list
-                if clean_value == "" or clean_value == []:
-                    clean_value = None
-
-                # add the key-value pair to the product_data dictionary
-                # strip whitespace, convert key to lowercase and replace spaces with underscores
-                product_data[clean_key] = clean_value
+        # extract the product images, the size charts and the product description in a single pass over the page (see extractors.py),
+        # image URLs are absolute, and the description is split into key-value pairs
+        #!IMPORTANT : DO NOT DO EXTENSIVE PROCESSING HERE, KEEP IT LIGHTWEIGHT, DATA CLEANSING SHOULD BE DONE IN THE PIPELINES.PY FILE
+        product_image, size_chart_images, product_data = (
+            extracted if extracted is not None else extract_album(response)
+        )
 
         # *-----------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
@@ -378,8 +523,9 @@ class ImagesSpider(scrapy.Spider):
         # this can be done cause we safely validated that the ctx dictionary contains only the fields defined in the ImageItem class
         item = ImageItem(
             {
-                # unpack the validated ctx metadata to be passed to the imageitem for output
-                **ctx,
+                # unpack the validated ctx metadata to be passed to the imageitem for output,
+                # in its compact form: the shared fields are filled back in at export time by HydrateContextPipeline
+                **self.compact_context(ctx),
                 # add the product images to the item, this is the list of full URLs for the product images that we extracted from the album page
                 "product_images": product_image,
                 # add the size chart images to the item, this is the list of full URLs for the size chart images that we extracted from the album page
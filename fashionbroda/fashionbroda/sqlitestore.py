@@ -0,0 +1,71 @@
+# Base class of the SQLite stores the crawls keep in CRAWL_STATE_DIR
+#
+# The album index (revisit.py), the validators (revalidation.py), the dead letters (deadletter.py), the album fingerprints
+# (fingerprints.py) and the responses of the HTTP cache and the archive (responsestore.py) are each one SQLite file, opened and written the same way:
+#
+# - WAL mode with synchronous=NORMAL, readers never wait for the writer and only checkpoints are synced to disk
+# - a 60 s busy timeout, several processes (e.g. shards) may write to the same file and wait for each other's lock
+# - writes grouped in transactions of commit_every statements, so we do not pay one fsync per write,
+#   and whatever is left is committed when the store is closed
+#
+# NOTE: a hard kill can lose up to commit_every writes, every store can afford it (they are rewritten by the next run).
+
+# import sqlite3 for the store files, it is part of the standard library
+import sqlite3
+
+# import Path to create the store directory
+from pathlib import Path
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class SqliteStore:
+    """
+    One SQLite file, created with the schema of its subclass, with batched writes.
+
+    Args:
+        path (str | Path): The SQLite file, created if it does not exist
+        commit_every (int | None): Number of writes grouped in one transaction, defaults to the class's commit_every
+    """
+
+    # the CREATE ... IF NOT EXISTS statements of the store, run every time it is opened
+    schema = ""
+    commit_every = 200
+
+    def __init__(self, path, commit_every=None):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None lets us control transactions explicitly
+        self.db = sqlite3.connect(str(path), timeout=60.0, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.schema)
+        if commit_every is not None:
+            self.commit_every = commit_every
+        # writes done since the last commit
+        self.uncommitted = 0
+
+    def begin(self):
+        """Start a transaction, unless one is already open."""
+        if not self.db.in_transaction:
+            self.db.execute("BEGIN")
+
+    def tick(self):
+        """Count one write, and commit once commit_every writes were made."""
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def write(self, sql, params):
+        """Run one write statement in the current batch."""
+        self.begin()
+        self.db.execute(sql, params)
+        self.tick()
+
+    def commit(self):
+        if self.db.in_transaction:
+            self.db.execute("COMMIT")
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
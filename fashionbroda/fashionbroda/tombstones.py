@@ -0,0 +1,374 @@
+# Tombstones: the albums that disappeared from the site between two albums spider runs
+#
+# Nothing used to notice an album being removed from the site, its product stayed live with is_deleted False forever.
+# diff_snapshots() compares the albums.json of the previous run with the current one and emits every album
+# that is only in the previous snapshot as a tombstone, one JSON line per album in scraped_data/tombstones.jsonl:
+#
+#   {"album_key": "https://.../albums/123", "album_urls": ["https://.../albums/123?uid=1&referrercate=4"], "deleted_at": 1760000000}
+#
+# Both snapshots are streamed, never loaded: each one is turned into a stream of album keys sorted on disk
+# (sorted runs of chunk_size rows merged with heapq.merge, an external sort), and the two sorted streams are walked side by side,
+# so a diff of millions of albums only keeps one chunk in memory.
+#
+# The tombstones are then used by:
+# - supabaseupload.py / sdb_upload.py, which mark the products of those albums is_deleted
+# - TombstoneMiddleware, which drops any request for a tombstoned album (e.g. left in a JOBDIR queue or found by the catalog spider)
+#
+# usage (from the directory that contains scrapy.cfg), after every albums spider run:
+#   python -m fashionbroda.tombstones
+#
+# the current albums.json then becomes the previous snapshot (albums.previous.json) of the next diff.
+
+# import argparse for the command line interface
+import argparse
+
+# import heapq to merge the sorted runs
+import heapq
+
+# import json to write the tombstones
+import json
+
+# import os to swap the output files in atomically
+import os
+
+# import shutil to keep the current snapshot as the previous one of the next diff
+import shutil
+
+# import tempfile for the sorted runs of the external sort
+import tempfile
+
+# import time to timestamp the tombstones
+import time
+
+# import groupby to collect the URLs of one album from the sorted stream
+from itertools import groupby
+
+# import itemgetter to group the sorted lines by album key
+from operator import itemgetter
+
+# import Path to build the default paths
+from pathlib import Path
+
+# import Scrapy signals and the exception that drops a request
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+
+# import the streaming manifest reader, snapshots can be JSON arrays or JSON Lines files
+from fashionbroda.manifests import iter_manifest
+
+# import the album identity, so the same album listed in several categories is one album
+from fashionbroda.planner import album_key
+
+# import the BASE_DIR from settings.py ensuring specific path resolution
+from fashionbroda.settings import BASE_DIR
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# the directory the spiders write their feeds to
+SCRAPED_DATA_DIR = BASE_DIR / "fashionbroda" / "fashionbroda" / "scraped_data"
+
+# the default snapshots and output of a diff
+CURRENT_SNAPSHOT = SCRAPED_DATA_DIR / "albums.json"
+PREVIOUS_SNAPSHOT = SCRAPED_DATA_DIR / "albums.previous.json"
+TOMBSTONES_FILE = SCRAPED_DATA_DIR / "tombstones.jsonl"
+
+# number of rows sorted in memory at a time, a few hundred MB at most for long album URLs
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def sorted_album_urls(path, chunk_size=DEFAULT_CHUNK_SIZE, tmpdir=None):
+    """
+    Stream the "album key<TAB>album URL" lines of a snapshot, sorted, with an external sort.
+
+    Snapshots that fit in one chunk are sorted in memory, larger ones are cut in sorted runs written to temporary files
+    and merged back lazily.
+
+    Args:
+        path (str | Path): An albums.json snapshot (JSON array or JSON Lines)
+        chunk_size (int): Number of rows sorted in memory at a time
+        tmpdir (str | None): Directory of the sorted runs, defaults to the system temporary directory
+
+    Yields:
+        str: "album key<TAB>album URL", sorted, duplicates included
+    """
+    runs = []
+    buffer = []
+    try:
+        for row in iter_manifest(path):
+            album_url = row.get("album_url") if isinstance(row, dict) else None
+            if not album_url:
+                continue
+            # album URLs never contain tabs or newlines, and plain strings sort much faster than tuples
+            buffer.append(f"{album_key(album_url)}\t{album_url}")
+            if len(buffer) >= chunk_size:
+                runs.append(write_run(buffer, tmpdir))
+                buffer = []
+
+        # everything fit in memory, no need to go through the disk
+        if not runs:
+            buffer.sort()
+            yield from buffer
+            return
+
+        if buffer:
+            runs.append(write_run(buffer, tmpdir))
+            buffer = []
+        streams = [(line.rstrip("\n") for line in run) for run in runs]
+        yield from heapq.merge(*streams)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def write_run(buffer, tmpdir=None):
+    """Sort a chunk of "key<TAB>url" lines into a temporary file, rewound for reading."""
+    buffer.sort()
+    # the file is deleted as soon as it is closed
+    run = tempfile.TemporaryFile("w+", encoding="utf-8", dir=tmpdir)
+    run.write("\n".join(buffer))
+    run.write("\n")
+    run.seek(0)
+    return run
+
+
+def iter_albums(path, chunk_size=DEFAULT_CHUNK_SIZE, tmpdir=None):
+    """
+    Stream the albums of a snapshot in album key order, one entry per album.
+
+    Yields:
+        tuple[str, list[str]]: (album key, every distinct URL the album was listed under)
+    """
+    pairs = (
+        line.split("\t", 1)
+        for line in sorted_album_urls(path, chunk_size=chunk_size, tmpdir=tmpdir)
+    )
+    for key, group in groupby(pairs, key=itemgetter(0)):
+        # the lines are sorted, so duplicate URLs are next to each other
+        urls = []
+        for _, url in group:
+            if not urls or urls[-1] != url:
+                urls.append(url)
+        yield key, urls
+
+
+def diff_snapshots(
+    previous, current, chunk_size=DEFAULT_CHUNK_SIZE, tmpdir=None, counts=None
+):
+    """
+    Compare two album snapshots and stream the albums that are only in the previous one.
+
+    Args:
+        previous (str | Path): The albums.json of the previous run
+        current (str | Path): The albums.json of this run
+        chunk_size (int): Number of rows sorted in memory at a time
+        tmpdir (str | None): Directory of the sorted runs
+        counts (dict | None): Filled with the number of "previous" albums once the stream is exhausted
+
+    Yields:
+        tuple[str, list[str]]: (album key, album URLs) of every removed album, in album key order
+    """
+    previous_albums = iter_albums(previous, chunk_size=chunk_size, tmpdir=tmpdir)
+    current_albums = iter_albums(current, chunk_size=chunk_size, tmpdir=tmpdir)
+
+    # walk both sorted streams side by side, a previous album is removed if the current stream skips past its key
+    current_key = next(current_albums, (None, None))[0]
+    total = 0
+    for key, urls in previous_albums:
+        total += 1
+        while current_key is not None and current_key < key:
+            current_key = next(current_albums, (None, None))[0]
+        if current_key != key:
+            yield key, urls
+    if counts is not None:
+        counts["previous"] = total
+
+
+def write_tombstones(
+    previous,
+    current,
+    output,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    tmpdir=None,
+    max_ratio=None,
+):
+    """
+    Diff two album snapshots and write the removed albums to a JSON Lines file.
+
+    The file is written next to the output and swapped in at the end, so readers never see a half written file.
+
+    Args:
+        previous (str | Path): The albums.json of the previous run
+        current (str | Path): The albums.json of this run
+        output (str | Path): The tombstones file to write
+        chunk_size (int): Number of rows sorted in memory at a time
+        tmpdir (str | None): Directory of the sorted runs
+        max_ratio (float | None): Refuse to write the file when more than this share of the previous albums were removed
+
+    Returns:
+        tuple[int, int]: (number of tombstones, number of albums in the previous snapshot)
+
+    Raises:
+        ValueError: If more than max_ratio of the previous albums were removed, which usually means the current run was cut short
+    """
+    output = Path(output)
+    partial = output.with_name(f"{output.name}.partial")
+    deleted_at = int(time.time())
+    count = 0
+    counts = {}
+    with open(partial, "w", encoding="utf-8") as tombstones:
+        for key, urls in diff_snapshots(
+            previous, current, chunk_size=chunk_size, tmpdir=tmpdir, counts=counts
+        ):
+            tombstones.write(
+                json.dumps(
+                    {"album_key": key, "album_urls": urls, "deleted_at": deleted_at},
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+            count += 1
+
+    total = counts["previous"]
+    if max_ratio is not None and total and count / total > max_ratio:
+        partial.unlink()
+        raise ValueError(
+            f"{count} of {total} albums would be tombstoned, more than {max_ratio:.0%}"
+        )
+    os.replace(partial, output)
+    return count, total
+
+
+def iter_tombstones(path):
+    """
+    Stream the tombstones of a tombstones file.
+
+    Args:
+        path (str | Path): A tombstones.jsonl file, a missing or empty file means no tombstones
+
+    Yields:
+        dict: Each tombstone, {"album_key", "album_urls", "deleted_at"}
+    """
+    path = Path(path)
+    # a diff that removed no album writes an empty file
+    if not path.exists() or path.stat().st_size == 0:
+        return
+    yield from iter_manifest(path)
+
+
+def load_tombstones(path):
+    """
+    Read the album keys of a tombstones file.
+
+    Args:
+        path (str | Path): A tombstones.jsonl file, a missing or empty file means no tombstones
+
+    Returns:
+        set[str]: The tombstoned album keys
+    """
+    return {row["album_key"] for row in iter_tombstones(path)}
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class TombstoneMiddleware:
+    """
+    Downloader middleware that drops the requests for tombstoned albums.
+
+    Settings:
+        TOMBSTONES_PATH: The tombstones file, defaults to scraped_data/tombstones.jsonl, a missing file disables the middleware
+    """
+
+    def __init__(self, crawler, path):
+        self.crawler = crawler
+        self.path = path
+        self.tombstones = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(
+            crawler, crawler.settings.get("TOMBSTONES_PATH") or str(TOMBSTONES_FILE)
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.tombstones = load_tombstones(self.path)
+        if self.tombstones:
+            spider.logger.info(
+                f"Skipping {len(self.tombstones)} tombstoned albums from {self.path}"
+            )
+
+    def process_request(self, request):
+        # only album pages can be tombstoned, image and category requests go through
+        if not self.tombstones or "/albums/" not in request.url:
+            return None
+        if album_key(request.url) in self.tombstones:
+            self.crawler.stats.inc_value("tombstones/skipped")
+            raise IgnoreRequest(f"Album was removed from the site: {request.url}")
+        return None
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Diff the previous and current albums.json and write the removed albums as tombstones"
+    )
+    parser.add_argument("--previous", default=str(PREVIOUS_SNAPSHOT))
+    parser.add_argument("--current", default=str(CURRENT_SNAPSHOT))
+    parser.add_argument("--output", default=str(TOMBSTONES_FILE))
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="rows sorted in memory at a time",
+    )
+    parser.add_argument("--tmpdir", help="directory of the external sort's runs")
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=0.2,
+        help="refuse to tombstone more than this share of the previous albums (an interrupted albums run looks like mass removal)",
+    )
+    parser.add_argument("--force", action="store_true", help="ignore --max-ratio")
+    parser.add_argument(
+        "--no-rotate",
+        action="store_true",
+        help="do not keep the current snapshot as the previous one of the next diff",
+    )
+    args = parser.parse_args()
+
+    if not Path(args.current).exists():
+        raise SystemExit(f"Current snapshot not found at: {args.current}")
+
+    # the first run has nothing to compare with, it only becomes the baseline
+    if not Path(args.previous).exists():
+        shutil.copyfile(args.current, args.previous)
+        print(f"No previous snapshot, saved {args.current} as the baseline")
+        return
+
+    started = time.perf_counter()
+    try:
+        count, total = write_tombstones(
+            args.previous,
+            args.current,
+            args.output,
+            chunk_size=args.chunk_size,
+            tmpdir=args.tmpdir,
+            max_ratio=None if args.force else args.max_ratio,
+        )
+    except ValueError as e:
+        raise SystemExit(f"{e}, use --force if the removals are real")
+    print(
+        f"Wrote {count} tombstones out of {total} albums to {args.output} "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+    if not args.no_rotate:
+        shutil.copyfile(args.current, args.previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# Canonical URLs for yupoo album and category pages, and the request fingerprinter built on them
+#
+# The same album is linked from category pages as /albums/<id>?uid=1&isSubCate=false&referrercate=<category id>,
+# with a different referrercate (and sometimes no isSubCate) on every category that lists it, and category links carry
+# the same tracking parameters. Scrapy's default fingerprinter only sorts query parameters, so every variant was a new request:
+# the same album was scheduled and downloaded once per listing, and its images were stored under one album directory per URL.
+#
+# canonicalize_url() gives every yupoo page one URL:
+#
+# - album pages:    https://<host>/albums/<id>?uid=1, the form the site itself links to, whatever tracking parameters were attached
+# - category pages: https://<host>/categories/<id>, with only ?page=N kept (page 1 is the bare URL)
+# - anything else (images, other hosts): w3lib's canonical form, like Scrapy's default fingerprinter
+#
+# The spiders store canonical URLs in album_url / category_link / page_url, so the dupefilter, album hashing in
+# ImagesPipeline.file_path and the slugs built from it all agree on one identity per album.
+
+# import hashlib and json to build the request fingerprints, the same way Scrapy's default fingerprinter does
+import hashlib
+import json
+
+# import re to recognize the album and category paths
+import re
+
+# import urllib's helpers to take URLs apart and put them back together
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# import WeakKeyDictionary to cache fingerprints per request, like Scrapy does, without keeping requests alive
+from weakref import WeakKeyDictionary
+
+# import w3lib's canonical form for the URLs that are not yupoo pages
+from w3lib.url import canonicalize_url as w3lib_canonicalize_url
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+# the site and its subdomains, image hosts (photo.yupoo.com) are canonicalized the default way
+YUPOO_DOMAIN = "yupoo.com"
+
+# /albums/<id> and /categories/<id>, with or without a trailing slash
+ALBUM_PATH_RE = re.compile(r"^/albums/(\d+)/?$")
+CATEGORY_PATH_RE = re.compile(r"^/categories/(\d+)/?$")
+
+# the query parameters that change what a category page lists, everything else is tracking
+CATEGORY_QUERY_PARAMETERS = ("page",)
+
+
+def canonicalize_url(url):
+    """
+    Return the canonical form of a URL, one URL per yupoo album or category page.
+
+    Args:
+        url (str): Absolute URL
+
+    Returns:
+        str: The canonical URL
+    """
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host != YUPOO_DOMAIN and not host.endswith(f".{YUPOO_DOMAIN}"):
+        return w3lib_canonicalize_url(url)
+
+    album = ALBUM_PATH_RE.match(parts.path)
+    if album:
+        return f"https://{host}/albums/{album.group(1)}?uid=1"
+
+    category = CATEGORY_PATH_RE.match(parts.path)
+    if category:
+        query = [
+            (name, value)
+            for name, value in parse_qsl(parts.query)
+            if name in CATEGORY_QUERY_PARAMETERS
+            # the first page is the category URL itself
+            and not (name == "page" and value == "1")
+        ]
+        return urlunsplit(
+            (
+                "https",
+                host,
+                f"/categories/{category.group(1)}",
+                urlencode(sorted(query)),
+                "",
+            )
+        )
+
+    return w3lib_canonicalize_url(url)
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+class YupooRequestFingerprinter:
+    """
+    Request fingerprinter that identifies requests by their canonical URL (see canonicalize_url).
+
+    Fingerprints are computed like Scrapy's default RequestFingerprinter (method, URL and body),
+    only the URL canonicalization differs, so non-yupoo requests keep their default fingerprints.
+    """
+
+    def __init__(self, crawler=None):
+        self.cache = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def fingerprint(self, request):
+        fingerprint = self.cache.get(request)
+        if fingerprint is None:
+            data = {
+                "method": request.method,
+                "url": canonicalize_url(request.url),
+                "body": (request.body or b"").hex(),
+                "headers": {},
+            }
+            fingerprint = hashlib.sha1(
+                json.dumps(data, sort_keys=True).encode()
+            ).digest()
+            self.cache[request] = fingerprint
+        return fingerprint
@@ -0,0 +1,18 @@
+# Small helpers shared by the spiders, that belong to no crawl feature in particular
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def flag_enabled(value):
+    """
+    Read a spider argument used as an on / off flag, e.g. -a revisit=1 or -a deadletter=1.
+
+    Args:
+        value (str | bool | None): The argument, None when it was not given
+
+    Returns:
+        bool: True for 1 / true / yes / on, in any case
+    """
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
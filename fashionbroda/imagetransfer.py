@@ -7,6 +7,10 @@ import json
 import os
 from pathlib import Path
 
+# import the album identity and the tombstones reader, the images of albums removed from the site are not uploaded
+from fashionbroda.planner import album_key
+from fashionbroda.tombstones import load_tombstones
+
 # Define the path to the JSON file containing the image paths and album hashes
 images_dir = Path(
     "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/images"
@@ -21,6 +25,10 @@ json_file_path = Path(
 upload_ready_dir = Path(
     "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/image_uploads"
 )
+# the albums removed from the site since the previous albums run, written by `python -m fashionbroda.tombstones`
+tombstones_path = Path(
+    "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/tombstones.jsonl"
+)
 
 
 # define the function to link the images to the upload_ready directory
@@ -28,8 +36,15 @@ def build_upload_ready():
     with open(json_file_path, "r", encoding="utf-8") as f:
         products = json.load(f)
 
+    # a missing tombstones file means no album was removed
+    tombstones = load_tombstones(tombstones_path)
+
     # get the slug and category for each product
     for product in products:
+        # skip the albums that were removed from the site, their images are not needed anymore
+        album_url = product.get("album_url")
+        if album_url and album_key(album_url) in tombstones:
+            continue
 
         brand = product.get("category", "").strip().lower().replace(" ", "-")
         if not brand:
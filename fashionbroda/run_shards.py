@@ -0,0 +1,172 @@
+# this script runs the images spider as N shard processes and merges their feeds back into images.json / images_paths.json / images_delta.jsonl
+#
+# usage (from the directory that contains scrapy.cfg):
+#   python run_shards.py --shards 8                 # crawl with 8 processes, then merge
+#   python run_shards.py --shards 8 --merge-only    # only merge the shard feeds of a previous run
+#
+# every shard process is started with -a shard=<i> -a shards=<N>, so the albums are split deterministically by album URL hash,
+# and gets its own JOBDIR, so each shard can be paused and resumed on its own.
+
+# import argparse to read the command line options
+import argparse
+
+# import json to write the merged feeds
+import json
+
+# import subprocess to launch the shard processes, and sys to reuse the current python interpreter
+import subprocess
+import sys
+
+# import the BASE_DIR from settings.py ensuring specific path resolution
+from fashionbroda.settings import BASE_DIR
+
+# import the streaming manifest reader so merging never loads a whole shard feed into memory
+from fashionbroda.manifests import iter_manifest
+
+# import the feed suffix helper so the file names match what the spider writes
+from fashionbroda.sharding import feed_suffix
+
+# the directory the images spider writes its feeds to
+SCRAPED_DATA_DIR = BASE_DIR / "fashionbroda" / "fashionbroda" / "scraped_data"
+
+# the feeds written by every shard, and merged into one file each
+FEED_NAMES = ("images", "images_paths")
+
+# the JSON Lines feeds written by every shard, merged by appending their lines
+JSONLINES_FEED_NAMES = ("images_delta",)
+
+
+# *------------------------------------------------------------------------------------------------------------------------------------------------------
+
+
+def run_shards(shards, extra_args):
+    """
+    Launch one images spider process per shard and wait for all of them.
+
+    Args:
+        shards (int): Number of shard processes to run
+        extra_args (list[str]): Extra arguments passed to every `scrapy crawl images` command
+
+    Returns:
+        list[int]: The shards whose process exited with an error
+    """
+    processes = []
+    for shard in range(shards):
+        command = [
+            sys.executable,
+            "-m",
+            "scrapy",
+            "crawl",
+            "images",
+            "-a",
+            f"shard={shard}",
+            "-a",
+            f"shards={shards}",
+            # one JOBDIR per shard, two processes must never share a request queue on disk
+            "-s",
+            f"JOBDIR=crawls/images{feed_suffix(shard, shards)}",
+            *extra_args,
+        ]
+        print(f"Starting shard {shard}: {' '.join(command[2:])}")
+        # run from the project root, where scrapy.cfg lives
+        processes.append(subprocess.Popen(command, cwd=BASE_DIR))
+
+    # wait for every shard, and remember the ones that failed
+    failed = []
+    for shard, process in enumerate(processes):
+        if process.wait() != 0:
+            failed.append(shard)
+    return failed
+
+
+def shard_feed_exists(shard_path):
+    """Return True if a shard feed has rows to merge, a missing or empty (0 byte) file is skipped."""
+    if not shard_path.exists():
+        print(f"Warning: {shard_path} not found, skipping")
+        return False
+    # Scrapy writes an empty file for a feed with no rows (FEED_STORE_EMPTY), e.g. a shard with no changed album
+    return shard_path.stat().st_size > 0
+
+
+def merge_feeds(shards):
+    """
+    Merge the per-shard feeds into one images.json, one images_paths.json and one images_delta.jsonl.
+
+    The shard files are streamed row by row, in shard order, and the merged file is written
+    in the same layout as Scrapy's JSON (or JSON Lines) feed exporter.
+
+    Args:
+        shards (int): Number of shards to merge
+
+    Returns:
+        dict: Number of rows written per feed name
+    """
+    counts = {}
+    for feed_name in FEED_NAMES:
+        output_path = SCRAPED_DATA_DIR / f"{feed_name}.json"
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as output:
+            output.write("[")
+            for shard in range(shards):
+                shard_path = (
+                    SCRAPED_DATA_DIR / f"{feed_name}{feed_suffix(shard, shards)}.json"
+                )
+                # a shard with no albums may not have written a file at all
+                if not shard_feed_exists(shard_path):
+                    continue
+                for row in iter_manifest(shard_path):
+                    output.write(",\n" if count else "\n")
+                    output.write(json.dumps(row, ensure_ascii=False))
+                    count += 1
+            output.write("\n]")
+        counts[feed_name] = count
+        print(f"Merged {count} rows into {output_path}")
+
+    for feed_name in JSONLINES_FEED_NAMES:
+        output_path = SCRAPED_DATA_DIR / f"{feed_name}.jsonl"
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as output:
+            for shard in range(shards):
+                shard_path = (
+                    SCRAPED_DATA_DIR / f"{feed_name}{feed_suffix(shard, shards)}.jsonl"
+                )
+                if not shard_feed_exists(shard_path):
+                    continue
+                for row in iter_manifest(shard_path):
+                    output.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    count += 1
+        counts[feed_name] = count
+        print(f"Merged {count} rows into {output_path}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the images spider as N shard processes and merge their feeds"
+    )
+    parser.add_argument("--shards", type=int, required=True, help="number of shards")
+    parser.add_argument(
+        "--merge-only",
+        action="store_true",
+        help="skip the crawl and only merge the feeds of a previous sharded run",
+    )
+    # anything after the known options (e.g. -s LOG_LEVEL=DEBUG) is passed to every shard
+    args, extra_args = parser.parse_known_args()
+
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+
+    if not args.merge_only:
+        failed = run_shards(args.shards, extra_args)
+        if failed:
+            # do not merge partial output, the failed shards can be resumed from their JOBDIR and merged later with --merge-only
+            print(
+                f"Shards {failed} failed, not merging. Re-run them, then use --merge-only."
+            )
+            raise SystemExit(1)
+
+    merge_feeds(args.shards)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,13 @@ from pathlib import Path
 
 from supabase import Client, create_client
 
+# import the delta feed reader and the album identity, only the albums that changed since the previous run are uploaded
+from fashionbroda.fingerprints import changed_albums
+from fashionbroda.planner import album_key
+
+# import the tombstones reader, to read the albums removed from the site
+from fashionbroda.tombstones import iter_tombstones
+
 SUPABASE_DB_URL = ""
 SUPABASE_SECRET_KEY = ""
 SELLER_ID = "68315cdb-5674-4305-b20f-99ab05c5c526"
@@ -18,6 +25,14 @@ supabase: Client = create_client(SUPABASE_DB_URL, SUPABASE_SECRET_KEY)
 json_file_path = Path(
     "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/supabase.json"
 )
+# the added / changed / unchanged status of every album of the last images run, the unchanged ones are already in supabase
+delta_path = Path(
+    "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/images_delta.jsonl"
+)
+# the albums removed from the site since the previous albums run, written by `python -m fashionbroda.tombstones`
+tombstones_path = Path(
+    "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/tombstones.jsonl"
+)
 
 
 def upload_to_supabase():
@@ -38,7 +53,13 @@ def upload_to_supabase():
         print(f"Unexpected error reading JSON file: {e}")
         raise SystemExit("Error reading JSON file")
 
-    products = all_products
+    # without a delta feed every product is uploaded
+    changed = changed_albums(delta_path)
+    products = [
+        product
+        for product in all_products
+        if changed is None or album_key(product.get("yupoo_album_url") or "") in changed
+    ]
     print(f"✅ Processing {len(products)} of {len(all_products)} products\n")
 
     # start a counter for successful uploads
@@ -150,5 +171,35 @@ def upload_to_supabase():
     print(f"❌ Product data failed: {product_data_failed_uploads}")
 
 
+# the products of removed albums are no longer in supabase.json (the images spider skips them), so they are marked deleted by URL
+def mark_tombstones_deleted():
+    if not tombstones_path.exists():
+        print("No tombstones file, no album was removed")
+        return
+
+    marked = 0
+    failed = 0
+    for tombstone in iter_tombstones(tombstones_path):
+        # a product stores the URL its album was listed under, which may be any of the album's listing URLs
+        try:
+            response = (
+                supabase.table("fashionbroda_products")
+                .update({"is_deleted": True})
+                .in_("yupoo_album_url", tombstone["album_urls"])
+                .execute()
+            )
+        except Exception as e:
+            print(
+                f"❌ Error marking album deleted: {tombstone['album_key']}, error: {e}"
+            )
+            failed += 1
+            continue
+        marked += len(response.data or [])
+
+    print(f"🪦 Products marked deleted: {marked}")
+    print(f"❌ Tombstones failed: {failed}")
+
+
 if __name__ == "__main__":
     upload_to_supabase()
+    mark_tombstones_deleted()
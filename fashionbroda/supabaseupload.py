@@ -1,6 +1,10 @@
 import json
 from pathlib import Path
 
+# import the album identity and the tombstones reader, to mark the albums removed from the site as deleted
+from fashionbroda.planner import album_key
+from fashionbroda.tombstones import load_tombstones
+
 json_file_path = Path(
     "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/slug.json"
 )
@@ -10,6 +14,10 @@ output_path = Path(
 r2_urls = Path(
     "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/r2_paths.txt"
 )
+# the albums removed from the site since the previous albums run, written by `python -m fashionbroda.tombstones`
+tombstones_path = Path(
+    "/home/b3n/Desktop/scraped_reps/fashionbroda/fashionbroda/fashionbroda/fashionbroda/scraped_data/tombstones.jsonl"
+)
 
 
 try:
@@ -85,13 +93,17 @@ def match_r2_urls_to_products(products, create_full_r2_urls):
 # Create json data to be uploaded to supabase
 def create_supabase_json(products, match_r2_urls_to_products):
     match_r2_urls_to_products(products, create_full_r2_urls)
+    # a missing tombstones file means no album was removed
+    tombstones = load_tombstones(tombstones_path)
     supabase_data = []
     for product in products:
         new_prod = new_product(product)
         new_prod["is_active"] = (
             True  # Add the is_active key with a default value of True
         )
-        new_prod["is_deleted"] = False
+        # the product is deleted when its album was removed from the site
+        album_url = product.get("album_url")
+        new_prod["is_deleted"] = bool(album_url) and album_key(album_url) in tombstones
         new_prod["yupoo_album_url"] = product.get("album_url")
         new_prod["product_image_urls"] = product.get("product_image_urls")
         new_prod["size_chart_image_urls"] = product.get("size_chart_image_urls")
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.request import RequestFingerprinter
+
+from fashionbroda.archive import (
+    ArchiveRecorderMiddleware,
+    ArchiveReplayAddon,
+    ArchiveReplayHandler,
+)
+from fashionbroda.responsestore import ResponseStore
+
+ALBUM_URL = "https://fashionbroda.x.yupoo.com/albums/1"
+
+
+def make_crawler(tmp_path):
+    crawler = SimpleNamespace(
+        settings=Settings({"ARCHIVE_PATH": str(tmp_path / "archive.sqlite")}),
+        request_fingerprinter=RequestFingerprinter(),
+    )
+    crawler.stats = MemoryStatsCollector(crawler)
+    return crawler
+
+
+def test_recorded_pages_are_replayed_without_the_network(tmp_path):
+    crawler = make_crawler(tmp_path)
+    recorder = ArchiveRecorderMiddleware(crawler)
+    recorder.spider_opened(None)
+    body = "<html><body>album é</body></html>".encode()
+    # a redirected page is recorded under the URL the spider asked for too
+    request = Request(ALBUM_URL + "?uid=1", meta={"redirect_urls": [ALBUM_URL]})
+    response = HtmlResponse(
+        request.url,
+        request=request,
+        body=body,
+        headers={
+            "Content-Type": "text/html; charset=utf-8",
+            "Content-Encoding": "gzip",
+        },
+    )
+    assert recorder.process_response(request, response) is response
+    recorder.spider_closed(None)
+
+    handler = ArchiveReplayHandler(crawler)
+    replayed = asyncio.run(handler.download_request(Request(ALBUM_URL)))
+    missing = asyncio.run(handler.download_request(Request(ALBUM_URL + "/2")))
+    asyncio.run(handler.close())
+
+    assert replayed.status == 200 and replayed.body == body
+    assert replayed.url == ALBUM_URL and "archive" in replayed.flags
+    assert isinstance(replayed, HtmlResponse)
+    # the body was stored decoded, the wire encoding is not replayed
+    assert b"Content-Encoding" not in replayed.headers
+    assert missing.status == 404
+    assert crawler.stats.get_value("archive/replayed") == 1
+    assert crawler.stats.get_value("archive/replay_missing") == 1
+
+
+def test_identical_bodies_are_stored_once(tmp_path):
+    store = ResponseStore(tmp_path / "archive.sqlite")
+    for fingerprint in ("a", "b"):
+        store.put(fingerprint, ALBUM_URL, 200, {}, b"same body")
+    store.put("a", ALBUM_URL, 200, {}, b"new body")
+    store.prune_bodies()
+    assert store.db.execute("SELECT COUNT(*) FROM bodies").fetchone()[0] == 2
+    assert store.get("b")[3] == b"same body"
+    assert sorted(record[3] for record in store.records("%/albums/%")) == [
+        b"new body",
+        b"same body",
+    ]
+    store.close()
+
+
+def test_replay_addon_keeps_away_from_the_crawl_state(tmp_path):
+    settings = Settings(
+        {
+            "ARCHIVE_REPLAY": True,
+            "CRAWL_STATE_DIR": str(tmp_path),
+            "DEADLETTER_ENABLED": True,
+            "DOWNLOAD_HANDLERS": {},
+            "DOWNLOADER_MIDDLEWARES": {},
+        }
+    )
+    ArchiveReplayAddon().update_settings(settings)
+    assert settings["DOWNLOAD_HANDLERS"]["https"].endswith("ArchiveReplayHandler")
+    assert not settings.getbool("DEADLETTER_ENABLED")
+    assert settings["ALBUM_FINGERPRINTS_PATH"].startswith(str(tmp_path / "replay"))
@@ -0,0 +1,124 @@
+import logging
+from types import SimpleNamespace
+
+from scrapy import Request
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Response
+from scrapy.settings import Settings
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.statscollectors import MemoryStatsCollector
+from twisted.python.failure import Failure
+
+from fashionbroda.deadletter import (
+    DeadLetterStore,
+    close_dead_letters,
+    dead_letters,
+    failure_reason,
+    is_failure,
+    record_failure,
+    record_success,
+)
+
+ALBUM_URL = "https://fashionbroda.x.yupoo.com/albums/1?uid=1"
+LISTED_URL = ALBUM_URL + "&isSubCate=false&referrercate=4"
+
+
+def make_spider(tmp_path, **settings):
+    crawler = SimpleNamespace(
+        settings=Settings({"CRAWL_STATE_DIR": str(tmp_path), **settings})
+    )
+    crawler.stats = MemoryStatsCollector(crawler)
+    return SimpleNamespace(
+        name="images", crawler=crawler, logger=logging.getLogger("images")
+    )
+
+
+def make_failure(exception, request):
+    failure = Failure(exception)
+    failure.request = request
+    return failure
+
+
+def test_record_adds_up_attempts_and_keeps_the_first_failure(tmp_path):
+    store = DeadLetterStore(tmp_path / "deadletter.sqlite")
+    store.record("images", "album", LISTED_URL, {"ctx": 1}, "HTTP 503", 3, now=10)
+    store.record("images", "album", ALBUM_URL, {"ctx": 2}, "HTTP 502", 1, now=20)
+    store.record("images", "media", ALBUM_URL, {}, "HTTP 404", now=5)
+    store.record("albums", "category", ALBUM_URL, {}, "HTTP 404", now=5)
+
+    # one entry per canonical URL, with the last meta and reason
+    assert store.entries("images") == [
+        ("media", ALBUM_URL, {}, "HTTP 404", 1),
+        ("album", ALBUM_URL, {"ctx": 2}, "HTTP 502", 4),
+    ]
+    assert store.entries("images", kinds=("album",)) == [
+        ("album", ALBUM_URL, {"ctx": 2}, "HTTP 502", 4)
+    ]
+    first_failed = store.db.execute(
+        "SELECT first_failed FROM letters WHERE kind = 'album'"
+    ).fetchone()[0]
+    assert first_failed == 10
+    assert store.summary() == [
+        ("albums", "category", "HTTP 404", 1, 1),
+        ("images", "album", "HTTP 502", 1, 4),
+        ("images", "media", "HTTP 404", 1, 1),
+    ]
+    store.close()
+
+
+def test_remove_and_purge(tmp_path):
+    path = tmp_path / "deadletter.sqlite"
+    store = DeadLetterStore(path)
+    store.record("images", "album", LISTED_URL, {}, "HTTP 503")
+    store.record("images", "album", ALBUM_URL.replace("/1?", "/2?"), {}, "HTTP 503")
+    store.record("albums", "category", ALBUM_URL, {}, "HTTP 503")
+    # a success under any URL of the album removes its entry
+    store.remove("images", "album", ALBUM_URL)
+    store.close()
+
+    store = DeadLetterStore(path)
+    assert [url for _, url, *_ in store.entries("images")] == [
+        ALBUM_URL.replace("/1?", "/2?")
+    ]
+    store.purge("images")
+    assert store.entries("images") == []
+    assert len(store.entries("albums")) == 1
+    store.close()
+
+
+def test_only_real_failures_are_recorded():
+    request = Request(ALBUM_URL)
+    http_error = make_failure(
+        HttpError(Response(ALBUM_URL, status=503), "Ignoring non-200 response"),
+        request,
+    )
+    assert is_failure(http_error)
+    assert failure_reason(http_error) == "HTTP 503"
+    timeout = make_failure(TimeoutError("took too long"), request)
+    assert is_failure(timeout)
+    assert failure_reason(timeout) == "TimeoutError: took too long"
+    # dropped on purpose, e.g. a tombstoned album
+    assert not is_failure(make_failure(IgnoreRequest(), request))
+
+
+def test_errbacks_record_and_successes_remove(tmp_path):
+    spider = make_spider(tmp_path)
+    request = Request(ALBUM_URL, meta={"retry_times": 2, "redirect_urls": [LISTED_URL]})
+    record_failure(spider, "album", make_failure(TimeoutError(), request), {"ctx": 1})
+    record_failure(spider, "album", make_failure(IgnoreRequest(), request), {})
+    assert dead_letters(spider).entries("images") == [
+        ("album", ALBUM_URL, {"ctx": 1}, "TimeoutError", 3)
+    ]
+    assert spider.crawler.stats.get_value("deadletter/album") == 1
+
+    record_success(spider, "album", Response(LISTED_URL, request=Request(LISTED_URL)))
+    assert dead_letters(spider).entries("images") == []
+    close_dead_letters(spider)
+
+
+def test_disabled_dead_letters_are_not_recorded(tmp_path):
+    spider = make_spider(tmp_path, DEADLETTER_ENABLED=False)
+    failure = make_failure(TimeoutError(), Request(ALBUM_URL))
+    record_failure(spider, "album", failure, {})
+    assert dead_letters(spider) is None
+    assert not (tmp_path / "deadletter.sqlite").exists()
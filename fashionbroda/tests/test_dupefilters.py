@@ -0,0 +1,89 @@
+import hashlib
+from types import SimpleNamespace
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.request import RequestFingerprinter
+from twisted.python.failure import Failure
+
+from fashionbroda.dupefilters import (
+    BloomDupeFilter,
+    BloomFilter,
+    GenerationalBloomFilter,
+)
+from fashionbroda.items import ImageItem
+
+ALBUM_URL = "https://fashionbroda.x.yupoo.com/albums/1"
+
+
+def fingerprint(n):
+    return hashlib.sha1(str(n).encode()).digest()
+
+
+def test_bloom_filter_has_no_false_negatives_and_persists(tmp_path):
+    path = tmp_path / "gen.bloom"
+    bloom = BloomFilter(path, capacity=1000, error_rate=0.01)
+    added = [fingerprint(n) for n in range(1000)]
+    assert not any(bloom.add(fp) for fp in added)
+    bloom.close()
+
+    reopened = BloomFilter(path)
+    assert reopened.count == 1000 and reopened.full
+    assert all(fp in reopened for fp in added)
+    false_positives = sum(fingerprint(n) in reopened for n in range(1000, 11_000))
+    assert false_positives < 10_000 * 0.03
+    reopened.close()
+
+
+def test_generations_rotate_and_forget_the_oldest(tmp_path):
+    bloom = GenerationalBloomFilter(tmp_path, capacity=10, generations=2)
+    for n in range(25):
+        bloom.add(fingerprint(n))
+    assert len(bloom.generation_paths()) == 2
+    # the first generation (fingerprints 0-9) was dropped, the newest ones are kept
+    assert all(fingerprint(n) in bloom for n in range(10, 25))
+    bloom.close()
+
+
+def open_dupefilter(tmp_path):
+    crawler = SimpleNamespace(
+        settings=Settings({"CRAWL_STATE_DIR": str(tmp_path)}),
+        request_fingerprinter=RequestFingerprinter(),
+        spider=SimpleNamespace(name="images"),
+    )
+    crawler.stats = MemoryStatsCollector(crawler)
+    dupefilter = BloomDupeFilter(crawler)
+    dupefilter.open()
+    return dupefilter
+
+
+def album_request():
+    return Request(ALBUM_URL, meta={"persist_seen": True})
+
+
+def test_album_is_remembered_once_its_item_and_images_are_done(tmp_path):
+    dupefilter = open_dupefilter(tmp_path)
+    request = album_request()
+    response = HtmlResponse(ALBUM_URL, request=request)
+    assert not dupefilter.request_seen(request)
+
+    # an errback item, or an album with a failed image, is not remembered
+    dupefilter.item_scraped(ImageItem(album_url=ALBUM_URL), Failure(ValueError()), None)
+    dupefilter.item_scraped(
+        ImageItem(album_url=ALBUM_URL, failed_images=1), response, None
+    )
+    assert len(dupefilter.bloom) == 0
+    assert dupefilter.crawler.stats.get_value("dupefilter/persistent_incomplete") == 1
+
+    dupefilter.item_scraped(
+        ImageItem(album_url=ALBUM_URL, failed_images=0), response, None
+    )
+    dupefilter.close("finished")
+
+    # the next run skips it
+    dupefilter = open_dupefilter(tmp_path)
+    assert dupefilter.request_seen(album_request())
+    assert not dupefilter.request_seen(Request(ALBUM_URL))
+    dupefilter.close("finished")
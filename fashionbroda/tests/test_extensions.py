@@ -0,0 +1,39 @@
+import random
+
+import pytest
+
+from fashionbroda.extensions import LagHistogram
+
+
+def nearest_rank(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, max(0, round(fraction * len(samples)) - 1))]
+
+
+def test_empty_histogram_has_zero_percentiles():
+    histogram = LagHistogram()
+    assert histogram.percentile(0.99) == 0
+    assert histogram.max == 0
+
+
+@pytest.mark.parametrize("fraction", [0.5, 0.9, 0.99, 1.0])
+def test_histogram_percentiles_are_within_growth_of_exact(fraction):
+    rng = random.Random(0)
+    samples = [rng.expovariate(20) for _ in range(10_000)] + [0.0, 3.5, 900.0]
+    histogram = LagHistogram()
+    for lag in samples:
+        histogram.add(lag)
+
+    exact = nearest_rank(samples, fraction)
+    estimate = histogram.percentile(fraction)
+    assert histogram.count == len(samples)
+    assert histogram.max == max(samples)
+    assert exact <= estimate <= max(exact * histogram.growth, histogram.smallest)
+
+
+def test_histogram_size_is_fixed():
+    histogram = LagHistogram()
+    size = len(histogram.counts)
+    for lag in range(100_000):
+        histogram.add(lag / 100)
+    assert len(histogram.counts) == size
@@ -0,0 +1,46 @@
+import pytest
+from scrapy.http import HtmlResponse
+
+from bench_parse import SITE, album_page, fixture_pages, xpath_extract_album
+from fashionbroda.extractors import extract_album
+
+ALBUM_URL = f"{SITE}/albums/1?uid=1"
+
+# pages the fixture generator does not produce: the corners where a single pass could drift from the XPath version
+EDGE_PAGES = {
+    "description_without_content": album_page(1).replace(
+        '<meta name="description"', '<meta name="description"><meta name="description"'
+    ),
+    "no_description": "<html><body><img class='image__portrait' data-origin-src='/a.jpg'></body></html>",
+    "empty_description": '<html><head><meta name="description" content=""></head></html>',
+    "both_classes_and_base_href": (
+        '<html><head><base href="https://photo.yupoo.com/base/"></head><body>'
+        '<img class="image__portrait image__landscape" data-origin-src=" x.jpg ">'
+        '<img class="image__portrait" src="no-origin.jpg"></body></html>'
+    ),
+}
+
+
+def response(body, url=ALBUM_URL):
+    if isinstance(body, str):
+        body = body.encode()
+    return HtmlResponse(url=url, body=body, encoding="utf-8")
+
+
+@pytest.mark.parametrize("url, body", fixture_pages(5)["album"])
+def test_extractor_matches_xpath_on_fixture_pages(url, body):
+    page = response(body, url)
+    assert extract_album(page) == xpath_extract_album(page)
+
+
+@pytest.mark.parametrize("name", EDGE_PAGES)
+def test_extractor_matches_xpath_on_edge_pages(name):
+    page = response(EDGE_PAGES[name])
+    assert extract_album(page) == xpath_extract_album(page)
+
+
+def test_description_meta_without_content_is_skipped():
+    _, _, product_data = extract_album(
+        response(EDGE_PAGES["description_without_content"])
+    )
+    assert product_data["price"] == 1280
@@ -0,0 +1,52 @@
+import json
+
+from fashionbroda.fingerprints import (
+    AlbumFingerprintStore,
+    album_fingerprint,
+    changed_albums,
+)
+from fashionbroda.planner import album_key
+
+ALBUM_URL = "https://fashionbroda.x.yupoo.com/albums/1?uid=1"
+
+
+def test_fingerprints_are_only_promoted_by_a_finished_run(tmp_path):
+    path = tmp_path / "album_fingerprints.sqlite"
+    album = {"product_images": ["a.jpg"], "product_data": {"b": 1, "a": 2}}
+    fingerprint = album_fingerprint(album)
+    assert fingerprint == album_fingerprint(
+        {"product_data": {"a": 2, "b": 1}, "product_images": ["a.jpg"]}
+    )
+
+    store = AlbumFingerprintStore(path)
+    assert store.classify(ALBUM_URL, fingerprint) == "added"
+    store.close(promote=False)
+
+    # the interrupted run did not become the reference
+    store = AlbumFingerprintStore(path)
+    assert store.classify(ALBUM_URL, fingerprint) == "added"
+    store.close(promote=True)
+
+    store = AlbumFingerprintStore(path, commit_every=1)
+    assert store.classify(ALBUM_URL, fingerprint) == "unchanged"
+    assert store.classify(ALBUM_URL, "other") == "changed"
+    store.close(promote=False)
+
+
+def test_changed_albums_reads_the_delta_feed(tmp_path):
+    delta = tmp_path / "images_delta.jsonl"
+    assert changed_albums(delta) is None
+
+    rows = [
+        {"album_url": ALBUM_URL, "change_status": "added"},
+        {"album_url": "https://x.yupoo.com/albums/2", "change_status": "unchanged"},
+        {"album_url": "https://x.yupoo.com/albums/3", "change_status": "changed"},
+    ]
+    delta.write_text("\n".join(json.dumps(row) for row in rows), encoding="utf-8")
+    assert changed_albums(delta) == {
+        album_key(ALBUM_URL),
+        album_key("https://x.yupoo.com/albums/3"),
+    }
+
+    delta.write_text("", encoding="utf-8")
+    assert changed_albums(delta) == set()
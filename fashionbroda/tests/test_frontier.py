@@ -0,0 +1,79 @@
+from fashionbroda.frontier import SqliteFrontier
+
+
+def make_frontier(tmp_path):
+    return SqliteFrontier(tmp_path / "frontier.sqlite")
+
+
+def test_push_skips_fingerprints_seen_by_any_worker(tmp_path):
+    frontier = make_frontier(tmp_path)
+    assert frontier.push("albums", 0, b"a", fingerprint="fp-a")
+    assert not frontier.push("albums", 0, b"a again", fingerprint="fp-a")
+    # dont_filter requests have no fingerprint and are always stored
+    assert frontier.push("albums", 0, b"b")
+    assert frontier.push("albums", 0, b"b")
+    # fingerprints are scoped by spider
+    assert frontier.push("images", 0, b"a", fingerprint="fp-a")
+    assert frontier.count("albums") == 3
+    frontier.reset_seen("albums")
+    assert frontier.push("albums", 0, b"a", fingerprint="fp-a")
+    frontier.close()
+
+
+def test_lease_hides_rows_until_ack_or_expiry(tmp_path):
+    frontier = make_frontier(tmp_path)
+    frontier.push("albums", 0, b"low")
+    frontier.push("albums", 5, b"high")
+    frontier.push("albums", 0, b"low 2")
+
+    # highest priority first, then insertion order
+    leased = frontier.lease("albums", "w1", 60, batch=2)
+    assert [payload for _, payload in leased] == [b"high", b"low"]
+    # a second worker only sees what is not leased
+    other = frontier.lease("albums", "w2", 60, batch=10)
+    assert [payload for _, payload in other] == [b"low 2"]
+    assert frontier.lease("albums", "w3", 60) == []
+
+    # acked rows are gone for good
+    for row_id, _ in leased:
+        frontier.ack(row_id)
+    assert frontier.count("albums") == 1
+    assert frontier.has_rows("albums")
+    assert not frontier.has_rows("images")
+    frontier.close()
+
+
+def test_expired_leases_are_leased_again(tmp_path):
+    frontier = make_frontier(tmp_path)
+    frontier.push("albums", 0, b"page")
+    # a worker that died holding a lease: it expired right away
+    [(row_id, _)] = frontier.lease("albums", "dead", -1)
+    assert frontier.lease("albums", "w2", 60) == [(row_id, b"page")]
+    attempts = frontier.db.execute(
+        "SELECT attempts FROM requests WHERE id = ?", (row_id,)
+    ).fetchone()[0]
+    assert attempts == 2
+    frontier.close()
+
+
+def test_renew_extends_only_the_leases_of_the_owner(tmp_path):
+    frontier = make_frontier(tmp_path)
+    frontier.push("albums", 0, b"mine")
+    frontier.push("albums", 0, b"theirs")
+    frontier.lease("albums", "w1", 60)
+    frontier.lease("albums", "w2", 60)
+    # both leases expired, only w1 renews its own
+    frontier.db.execute("UPDATE requests SET lease_expires = 0")
+    frontier.renew("albums", "w1", 60)
+    assert frontier.lease("albums", "w3", 60, batch=10) == [(2, b"theirs")]
+    frontier.close()
+
+
+def test_release_hands_the_leases_back(tmp_path):
+    frontier = make_frontier(tmp_path)
+    frontier.push("albums", 0, b"page")
+    frontier.lease("albums", "w1", 60)
+    assert frontier.lease("albums", "w2", 60) == []
+    frontier.release("albums", "w1")
+    assert [payload for _, payload in frontier.lease("albums", "w2", 60)] == [b"page"]
+    frontier.close()
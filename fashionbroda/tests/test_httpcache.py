@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+from scrapy import Request
+from scrapy.http import HtmlResponse, Response
+from scrapy.settings import Settings
+from scrapy.utils.request import RequestFingerprinter
+
+from fashionbroda.httpcache import SqliteCacheStorage
+
+CATEGORY_URL = "https://fashionbroda.x.yupoo.com/categories/1?page=2"
+ALBUM_URL = "https://fashionbroda.x.yupoo.com/albums/1"
+POLICIES = {r"/categories/": 3600, r"/albums/": 0}
+
+
+def open_storage(tmp_path, **settings):
+    storage = SqliteCacheStorage(Settings({"HTTPCACHE_DIR": str(tmp_path), **settings}))
+    spider = SimpleNamespace(
+        name="albums",
+        crawler=SimpleNamespace(request_fingerprinter=RequestFingerprinter()),
+    )
+    storage.open_spider(spider)
+    return storage, spider
+
+
+def store(storage, spider, url, body=b"page"):
+    request = Request(url)
+    response = HtmlResponse(
+        url, body=body, headers={"Content-Type": "text/html; charset=utf-8"}
+    )
+    storage.store_response(spider, request, response)
+    return request
+
+
+def age(storage, secs):
+    # pretend every cached response was stored secs seconds earlier
+    storage.store.commit()
+    storage.store.db.execute("UPDATE responses SET stored_at = stored_at - ?", (secs,))
+
+
+def test_ttl_for_picks_the_first_matching_policy(tmp_path):
+    storage, spider = open_storage(
+        tmp_path, HTTPCACHE_TTL_POLICIES=POLICIES, HTTPCACHE_EXPIRATION_SECS=60
+    )
+    assert storage.ttl_for(CATEGORY_URL) == 3600
+    assert storage.ttl_for(ALBUM_URL) == 0
+    # no policy matches, the global expiration applies
+    assert storage.ttl_for("https://fashionbroda.x.yupoo.com/") == 60
+    storage.close_spider(spider)
+
+
+def test_responses_expire_per_url_policy(tmp_path):
+    storage, spider = open_storage(
+        tmp_path, HTTPCACHE_TTL_POLICIES=POLICIES, HTTPCACHE_EXPIRATION_SECS=60
+    )
+    category = store(storage, spider, CATEGORY_URL)
+    album = store(storage, spider, ALBUM_URL)
+    home = store(storage, spider, "https://fashionbroda.x.yupoo.com/")
+
+    cached = storage.retrieve_response(spider, category)
+    assert isinstance(cached, HtmlResponse) and cached.body == b"page"
+
+    # two minutes later only the default expiration has run out
+    age(storage, 120)
+    assert storage.retrieve_response(spider, category) is not None
+    assert storage.retrieve_response(spider, home) is None
+    # two hours later the category page has expired too, albums never expire
+    age(storage, 7200)
+    assert storage.retrieve_response(spider, category) is None
+    assert storage.retrieve_response(spider, album).body == b"page"
+    storage.close_spider(spider)
+
+
+def test_image_responses_are_not_stored(tmp_path):
+    storage, spider = open_storage(tmp_path)
+    request = Request("https://photo.yupoo.com/fashionbroda/1/big.jpg")
+    storage.store_response(
+        spider,
+        request,
+        Response(request.url, body=b"jpg", headers={"Content-Type": "image/jpeg"}),
+    )
+    assert storage.retrieve_response(spider, request) is None
+    storage.close_spider(spider)
+
+
+def test_cache_survives_reopening(tmp_path):
+    storage, spider = open_storage(tmp_path)
+    request = store(storage, spider, ALBUM_URL)
+    storage.close_spider(spider)
+
+    storage, spider = open_storage(tmp_path)
+    assert storage.retrieve_response(spider, request).body == b"page"
+    storage.close_spider(spider)
@@ -0,0 +1,86 @@
+import pickle
+
+import pytest
+from itemadapter import ItemAdapter, is_item
+from scrapy.exporters import JsonLinesItemExporter
+
+from fashionbroda.items import AlbumItem, FashionbrodaItem, ImageItem, SlotItem
+
+ALBUM_URL = "https://fashionbroda.x.yupoo.com/albums/1?uid=1"
+
+
+def test_fields_are_the_slots_of_the_class_and_its_parents():
+    assert list(FashionbrodaItem.fields) == [
+        "seller",
+        "contact",
+        "category",
+        "category_text",
+        "category_link",
+    ]
+    assert list(AlbumItem.fields)[-3:] == ["page_url", "page_number", "album_url"]
+    assert set(AlbumItem.fields) < set(ImageItem.fields)
+    # slotted items have no __dict__
+    assert not hasattr(ImageItem(), "__dict__")
+
+
+def test_slot_item_behaves_like_a_scrapy_item():
+    item = AlbumItem(seller="broda", album_url=ALBUM_URL)
+    assert item["seller"] == "broda" and item.get("page_url") is None
+    assert "seller" in item and "page_url" not in item
+    # declared fields are exported in declaration order
+    item["page_number"] = 2
+    assert list(item) == ["seller", "page_number", "album_url"]
+    assert dict(item) == {"seller": "broda", "page_number": 2, "album_url": ALBUM_URL}
+    assert len(item) == 3
+    assert item.setdefault("contact", "wechat") == "wechat"
+    assert item.pop("contact") == "wechat" and "contact" not in item
+
+    with pytest.raises(KeyError):
+        item["page_url"]
+    # methods are not fields
+    with pytest.raises(KeyError):
+        item["get"]
+    with pytest.raises(KeyError, match="does not support field: title"):
+        item["title"] = "x"
+    with pytest.raises(KeyError):
+        del item["page_url"]
+
+    copy = item.copy()
+    copy["seller"] = "other"
+    assert type(copy) is AlbumItem and item["seller"] == "broda"
+    assert pickle.loads(pickle.dumps(item)) == item
+
+
+def test_slot_items_go_through_item_adapter():
+    item = ImageItem(album_url=ALBUM_URL, product_images=["a.jpg"])
+    assert is_item(item)
+    adapter = ItemAdapter(item)
+    assert list(adapter.field_names()) == list(ImageItem.fields)
+    assert adapter.asdict() == {"album_url": ALBUM_URL, "product_images": ["a.jpg"]}
+    assert ItemAdapter.get_field_names_from_class(ImageItem) == list(ImageItem.fields)
+    assert dict(ItemAdapter.get_field_meta_from_class(ImageItem, "ctx_id")) == {}
+
+    adapter["failed_images"] = 0
+    assert item["failed_images"] == 0
+    del adapter["product_images"]
+    assert "product_images" not in item and len(adapter) == 2
+    with pytest.raises(KeyError):
+        adapter["title"] = "x"
+
+
+def test_feed_exporters_write_slot_items(tmp_path):
+    path = tmp_path / "albums.jsonl"
+    with open(path, "wb") as f:
+        exporter = JsonLinesItemExporter(f)
+        exporter.start_exporting()
+        exporter.export_item(AlbumItem(album_url=ALBUM_URL, seller="broda"))
+        exporter.finish_exporting()
+    assert path.read_text(encoding="utf8") == (
+        f'{{"seller": "broda", "album_url": "{ALBUM_URL}"}}\n'
+    )
+
+
+def test_base_class_has_no_fields():
+    assert SlotItem.fields == {}
+    with pytest.raises(KeyError):
+        SlotItem(seller="broda")
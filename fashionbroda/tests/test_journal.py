@@ -0,0 +1,66 @@
+from scrapy.settings import Settings
+
+from fashionbroda.journal import MediaJournal, journal_path, pending_albums
+
+ALBUM_1 = "https://fashionbroda.x.yupoo.com/albums/1?uid=1"
+ALBUM_2 = "https://fashionbroda.x.yupoo.com/albums/2?uid=1"
+ALBUM_3 = "https://fashionbroda.x.yupoo.com/albums/3?uid=1"
+
+
+def test_journal_path_needs_a_jobdir(tmp_path):
+    assert journal_path(Settings()) is None
+    assert journal_path(Settings({"JOBDIR": str(tmp_path)})) == (
+        tmp_path / "media_journal.jsonl"
+    )
+    assert pending_albums(None) == {}
+    assert pending_albums(tmp_path / "missing.jsonl") == {}
+
+
+def test_pending_albums_are_the_ones_never_done(tmp_path):
+    path = tmp_path / "media_journal.jsonl"
+    journal = MediaJournal(path)
+    journal.pending(ALBUM_1, {"album_url": ALBUM_1})
+    journal.pending(ALBUM_2, {"album_url": ALBUM_2, "title": "é"})
+    journal.done(ALBUM_1)
+    journal.pending(ALBUM_3, {"album_url": ALBUM_3})
+    journal.close()
+    assert pending_albums(path) == {
+        ALBUM_2: {"album_url": ALBUM_2, "title": "é"},
+        ALBUM_3: {"album_url": ALBUM_3},
+    }
+    assert list(pending_albums(path)) == [ALBUM_2, ALBUM_3]
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    path = tmp_path / "media_journal.jsonl"
+    journal = MediaJournal(path)
+    journal.pending(ALBUM_1, {"album_url": ALBUM_1})
+    journal.pending(ALBUM_2, {"album_url": ALBUM_2})
+    journal.close()
+    # the process was killed while writing the "done" line of the first album
+    with open(path, "a", encoding="utf8") as f:
+        f.write('{"op": "done", "alb')
+    assert list(pending_albums(path)) == [ALBUM_1, ALBUM_2]
+
+    # reopening the journal drops the truncated line, new lines are not glued to it
+    journal = MediaJournal(path)
+    journal.done(ALBUM_1)
+    journal.close()
+    assert list(pending_albums(path)) == [ALBUM_2]
+
+
+def test_opening_compacts_the_journal_to_its_pending_albums(tmp_path):
+    path = tmp_path / "media_journal.jsonl"
+    journal = MediaJournal(path)
+    for album in (ALBUM_1, ALBUM_2, ALBUM_3):
+        journal.pending(album, {"album_url": album})
+    journal.done(ALBUM_1)
+    journal.done(ALBUM_3)
+    journal.close()
+    assert len(path.read_text(encoding="utf8").splitlines()) == 5
+
+    MediaJournal(path).close()
+    assert path.read_text(encoding="utf8").splitlines() == [
+        MediaJournal.line("pending", ALBUM_2, {"album_url": ALBUM_2}).rstrip("\n")
+    ]
+    assert not path.with_name(path.name + ".partial").exists()
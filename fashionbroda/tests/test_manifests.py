@@ -0,0 +1,66 @@
+import io
+import json
+
+import pytest
+
+from fashionbroda.manifests import iter_json_array, iter_manifest
+
+# chunk sizes small enough to cut every value of the documents below at every possible position
+CHUNK_SIZES = (1, 2, 3, 5, 7, 64 * 1024)
+
+DOCUMENTS = [
+    "[]",
+    " \n[ ] ",
+    "﻿[1]",
+    "[1.5e-3, -2]",
+    "[12345, 0.25, -1E+10, 3e2]",
+    '[{"album_url": "https://x/albums/1", "sizes": ["S", "M"]}, "a,]b", null, true, false]',
+    '[\n  {"a": [1, 2, {"b": "\\u00e9\\"]"}]},\n  {"c": -0.5}\n]\n',
+]
+
+
+def read(document, chunk_size, **kwargs):
+    return list(iter_json_array(io.StringIO(document), chunk_size=chunk_size, **kwargs))
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_json_array_matches_json_loads_at_every_chunk_size(document, chunk_size):
+    assert read(document, chunk_size) == json.loads(document.lstrip("﻿"))
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize(
+    "document", ["[1 2]", "[1x]", "[1,", '[{"a": 1}', "[", "", "{}", "[1,]"]
+)
+def test_malformed_json_array_raises(document, chunk_size):
+    with pytest.raises(json.JSONDecodeError):
+        read(document, chunk_size)
+
+
+def test_malformed_element_does_not_buffer_the_rest_of_the_file():
+    # an unterminated string swallows everything after it, the reader gives up once the element exceeds the cap
+    document = '["unterminated, ' + "x" * 10_000 + "]"
+    source = io.StringIO(document)
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(source, chunk_size=16, max_element_size=256))
+    assert source.tell() < 1024
+
+
+@pytest.mark.parametrize("content", ["", "  \n", "[]"])
+def test_empty_manifest_has_no_rows(tmp_path, content):
+    path = tmp_path / "feed.jsonl"
+    path.write_text(content, encoding="utf-8")
+    assert list(iter_manifest(path)) == []
+
+
+def test_manifest_formats(tmp_path):
+    rows = [{"album_url": "https://x/albums/1"}, {"album_url": "https://x/albums/2"}]
+    array = tmp_path / "feed.json"
+    array.write_text(json.dumps(rows), encoding="utf-8")
+    lines = tmp_path / "feed.jsonl"
+    lines.write_text(
+        "\n".join(json.dumps(row) for row in rows) + "\n\n", encoding="utf-8"
+    )
+    assert list(iter_manifest(array, chunk_size=3)) == rows
+    assert list(iter_manifest(lines)) == rows
@@ -0,0 +1,47 @@
+from fashionbroda.planner import plan_albums
+
+
+def listing(album, category, page_number=1):
+    return {
+        "seller": "fashionbroda",
+        "contact": "+00",
+        "category": category,
+        "category_text": category,
+        "category_link": f"https://x.yupoo.com/categories/{category}",
+        "page_url": f"https://x.yupoo.com/categories/{category}?page={page_number}",
+        "page_number": page_number,
+        "album_url": f"https://x.yupoo.com/albums/{album}?uid=1&referrercate={category}",
+    }
+
+
+def test_listings_are_merged_per_album_in_order_of_first_appearance(tmp_path):
+    rows = [
+        listing(2, "All categories"),
+        listing(1, "All categories"),
+        listing(2, "Dior"),
+        listing(1, "Other Brands"),
+        listing(2, "Dior", page_number=2),
+        listing(3, "Gucci"),
+    ]
+
+    plans = list(plan_albums(rows, tmpdir=tmp_path))
+
+    assert [plan["album_url"] for plan in plans] == [
+        rows[2]["album_url"],
+        rows[3]["album_url"],
+        rows[5]["album_url"],
+    ]
+    # the more specific listing becomes the primary context, every category is recorded once
+    assert plans[0]["category"] == "Dior"
+    assert plans[1]["category"] == "Other Brands"
+    assert [m["category"] for m in plans[0]["categories"]] == ["All categories", "Dior"]
+    assert [m["category"] for m in plans[1]["categories"]] == [
+        "All categories",
+        "Other Brands",
+    ]
+    # the scratch file is gone once the plan was read
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_empty_manifest(tmp_path):
+    assert list(plan_albums([], tmpdir=tmp_path)) == []
@@ -0,0 +1,43 @@
+from scrapy import Request
+
+from fashionbroda.queues import DUPEFILTER_FILE, SqliteDupeFilter, compact_queue_files
+
+
+def test_dupefilter_persists_fingerprints_across_resumes(tmp_path):
+    dupefilter = SqliteDupeFilter(str(tmp_path), commit_every=2)
+    assert not dupefilter.request_seen(Request("https://x/albums/1"))
+    assert dupefilter.request_seen(Request("https://x/albums/1"))
+    assert not dupefilter.request_seen(Request("https://x/albums/2"))
+    assert not dupefilter.request_seen(Request("https://x/albums/3"))
+    dupefilter.close("shutdown")
+
+    # nothing is kept in memory, and nothing is written to requests.seen
+    assert not dupefilter.fingerprints
+    assert not (tmp_path / "requests.seen").exists()
+
+    resumed = SqliteDupeFilter(str(tmp_path))
+    assert resumed.request_seen(Request("https://x/albums/3"))
+    assert not resumed.request_seen(Request("https://x/albums/4"))
+    resumed.close("shutdown")
+
+    assert compact_queue_files(tmp_path)[0] == 1
+
+
+def test_dupefilter_imports_requests_seen(tmp_path):
+    seen = SqliteDupeFilter()
+    fingerprint = seen.request_fingerprint(Request("https://x/albums/1"))
+    (tmp_path / "requests.seen").write_text(fingerprint + "\n\n", encoding="utf-8")
+
+    dupefilter = SqliteDupeFilter(str(tmp_path))
+    assert dupefilter.request_seen(Request("https://x/albums/1"))
+    assert not dupefilter.request_seen(Request("https://x/albums/2"))
+    dupefilter.close("finished")
+    assert not (tmp_path / "requests.seen").exists()
+    assert (tmp_path / DUPEFILTER_FILE).exists()
+
+
+def test_dupefilter_without_jobdir_stays_in_memory():
+    dupefilter = SqliteDupeFilter()
+    assert not dupefilter.request_seen(Request("https://x/albums/1"))
+    assert dupefilter.request_seen(Request("https://x/albums/1"))
+    dupefilter.close("finished")
@@ -0,0 +1,118 @@
+from types import SimpleNamespace
+
+from scrapy import Request
+from scrapy.extensions.httpcache import DummyPolicy
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.request import RequestFingerprinter
+
+from fashionbroda.httpcache import SqliteCacheStorage
+from fashionbroda.items import ImageItem
+from fashionbroda.revalidation import ConditionalRequestMiddleware
+
+ALBUM_URL = "https://fashionbroda.x.yupoo.com/albums/1"
+
+
+def open_middleware(tmp_path):
+    crawler = SimpleNamespace(settings=Settings())
+    crawler.stats = MemoryStatsCollector(crawler)
+    middleware = ConditionalRequestMiddleware(
+        crawler, str(tmp_path / "validators.sqlite")
+    )
+    middleware.spider_opened(None)
+    return middleware
+
+
+def album_item():
+    return ImageItem(
+        album_url=ALBUM_URL,
+        product_images=["https://photo.yupoo.com/1.jpg"],
+        size_chart_images=[],
+        product_data={"price": "10"},
+    )
+
+
+def test_item_scraped_without_response_is_ignored(tmp_path):
+    # items yielded from start() (e.g. albums re-emitted by a revisit run) reach item_scraped with response=None
+    middleware = open_middleware(tmp_path)
+    middleware.item_scraped(album_item(), None, None)
+    assert middleware.store.get_album(ALBUM_URL) is None
+    middleware.spider_closed(None)
+
+
+def test_validators_are_sent_back_and_304_reuses_the_album(tmp_path):
+    middleware = open_middleware(tmp_path)
+    request = Request(ALBUM_URL, meta={"revalidate": True})
+    assert middleware.process_request(request) is None
+    assert b"If-None-Match" not in request.headers
+
+    response = HtmlResponse(
+        ALBUM_URL,
+        request=request,
+        body=b"<html></html>",
+        headers={"ETag": '"v1"', "Last-Modified": "Mon, 05 Jan 2026 10:00:00 GMT"},
+    )
+    assert middleware.process_response(request, response) is response
+    middleware.item_scraped(album_item(), response, None)
+
+    # the next run sends the validators back, and lets the 304 reach the callback
+    request = Request(ALBUM_URL, meta={"revalidate": True})
+    middleware.process_request(request)
+    assert request.headers[b"If-None-Match"] == b'"v1"'
+    assert request.headers[b"If-Modified-Since"] == b"Mon, 05 Jan 2026 10:00:00 GMT"
+    assert 304 in request.meta["handle_httpstatus_list"]
+
+    not_modified = HtmlResponse(ALBUM_URL, status=304, request=request)
+    assert middleware.process_response(request, not_modified) is not_modified
+    assert request.meta["previous_album"]["product_data"] == {"price": "10"}
+    assert middleware.stats.get_value("revalidation/not_modified") == 1
+    assert middleware.stats.get_value("revalidation/bytes_saved") == len(
+        b"<html></html>"
+    )
+    middleware.spider_closed(None)
+
+
+def test_304_without_stored_album_is_fetched_in_full(tmp_path):
+    middleware = open_middleware(tmp_path)
+    request = Request(ALBUM_URL, meta={"revalidate": True})
+    ok = HtmlResponse(ALBUM_URL, request=request, body=b"x", headers={"ETag": "e"})
+    middleware.process_response(request, ok)
+
+    request = Request(ALBUM_URL, meta={"revalidate": True})
+    middleware.process_request(request)
+    retry = middleware.process_response(
+        request, HtmlResponse(ALBUM_URL, status=304, request=request)
+    )
+    assert isinstance(retry, Request)
+    assert retry.dont_filter and retry.meta["revalidate"] is False
+    assert b"If-None-Match" not in retry.headers
+    middleware.spider_closed(None)
+
+
+def test_http_cache_ignores_conditional_headers(tmp_path):
+    # ConditionalRequestMiddleware (850) adds its headers before HttpCacheMiddleware (900) looks the request up
+    plain = Request(ALBUM_URL)
+    conditional = Request(
+        ALBUM_URL,
+        headers={"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 05 Jan 2026"},
+    )
+    fingerprinter = RequestFingerprinter()
+    assert fingerprinter.fingerprint(plain) == fingerprinter.fingerprint(conditional)
+    policy = DummyPolicy(Settings())
+    assert policy.should_cache_request(conditional)
+
+    storage = SqliteCacheStorage(Settings({"HTTPCACHE_DIR": str(tmp_path)}))
+    spider = SimpleNamespace(
+        name="images", crawler=SimpleNamespace(request_fingerprinter=fingerprinter)
+    )
+    storage.open_spider(spider)
+    storage.store_response(
+        spider, conditional, HtmlResponse(ALBUM_URL, status=304, request=conditional)
+    )
+    assert storage.retrieve_response(spider, plain) is None
+    storage.store_response(
+        spider, conditional, HtmlResponse(ALBUM_URL, body=b"page", request=conditional)
+    )
+    assert storage.retrieve_response(spider, plain).body == b"page"
+    storage.close_spider(spider)
@@ -0,0 +1,95 @@
+import pytest
+
+from fashionbroda.revisit import DAY, AlbumIndex, RevisitPolicy
+from fashionbroda.utils import flag_enabled
+
+HOUR = 3600
+
+
+def test_album_index_records_rows_and_prunes_removed_albums(tmp_path):
+    index = AlbumIndex(tmp_path / "album_index.sqlite")
+    assert index.record("nike", "1", {"album": 1}, now=100)
+    assert not index.record("nike", "1", {"album": 1, "title": "new"}, now=200)
+    assert index.record("nike", "2", {"album": 2}, now=100)
+    # albums are scoped by category
+    assert index.record("adidas", "1", {"album": 1}, now=100)
+    assert index.known("nike", "1") and not index.known("nike", "3")
+
+    # the latest row wins
+    assert sorted(index.rows("nike"), key=lambda row: row["album"]) == [
+        {"album": 1, "title": "new"},
+        {"album": 2},
+    ]
+    assert list(index.rows("nike", seen_before=150)) == [{"album": 2}]
+    index.prune("nike", before=150)
+    assert not index.known("nike", "2") and index.known("adidas", "1")
+    index.close()
+
+
+def test_album_index_survives_reopening(tmp_path):
+    path = tmp_path / "album_index.sqlite"
+    index = AlbumIndex(path)
+    index.record("nike", "1", {"album": 1})
+    index.update_category("nike", 1, now=100, alpha=0.5)
+    index.close()
+
+    index = AlbumIndex(path)
+    assert index.known("nike", "1")
+    assert index.categories() == [("nike", None, 100, 1)]
+    index.close()
+
+
+def test_change_rate_is_a_moving_average_of_new_albums_per_day(tmp_path):
+    index = AlbumIndex(tmp_path / "album_index.sqlite")
+    # the first crawl only records the category
+    index.update_category("nike", 40, now=0, alpha=0.5)
+    assert index.category_state("nike") == (None, 0, 1)
+    index.update_category("nike", 4, now=DAY, alpha=0.5)
+    assert index.category_state("nike") == (4, DAY, 2)
+    index.update_category("nike", 2, now=2 * DAY, alpha=0.5)
+    assert index.category_state("nike") == (3, 2 * DAY, 3)
+    # two runs back to back count as one hour apart
+    index.update_category("nike", 1, now=2 * DAY + 1, alpha=1)
+    assert index.category_state("nike")[0] == 24
+    assert index.category_state("adidas") is None
+    index.close()
+
+
+def test_revisit_interval_is_clamped():
+    policy = RevisitPolicy(
+        target_new_albums=5, min_interval=6 * HOUR, max_staleness=7 * DAY
+    )
+    assert policy.interval(None) == 6 * HOUR
+    assert policy.interval(0) == 7 * DAY
+    assert policy.interval(1) == 5 * DAY
+    assert policy.interval(100) == 6 * HOUR
+    assert policy.interval(0.01) == 7 * DAY
+
+
+def test_is_due():
+    policy = RevisitPolicy(
+        target_new_albums=5, min_interval=6 * HOUR, max_staleness=7 * DAY
+    )
+    # never crawled
+    assert policy.is_due(None)
+    assert not policy.is_due((1, 0, 2), now=4 * DAY)
+    assert policy.is_due((1, 0, 2), now=5 * DAY)
+
+
+@pytest.mark.parametrize(
+    "value, enabled",
+    [
+        ("1", True),
+        ("True", True),
+        (" yes ", True),
+        ("on", True),
+        (True, True),
+        ("0", False),
+        ("no", False),
+        ("", False),
+        (None, False),
+        (False, False),
+    ],
+)
+def test_flag_enabled(value, enabled):
+    assert flag_enabled(value) is enabled
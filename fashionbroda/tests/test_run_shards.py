@@ -0,0 +1,26 @@
+import json
+
+import run_shards
+from fashionbroda.sharding import feed_suffix
+
+
+def test_merge_feeds_skips_empty_and_missing_shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_shards, "SCRAPED_DATA_DIR", tmp_path)
+    rows = [{"album_url": "https://x/albums/1"}, {"album_url": "https://x/albums/2"}]
+
+    # shard 0 has rows, shard 1 wrote empty feeds (FEED_STORE_EMPTY), shard 2 wrote nothing
+    for name in run_shards.FEED_NAMES:
+        (tmp_path / f"{name}{feed_suffix(0, 3)}.json").write_text(json.dumps(rows))
+        (tmp_path / f"{name}{feed_suffix(1, 3)}.json").write_text("[]")
+    for name in run_shards.JSONLINES_FEED_NAMES:
+        (tmp_path / f"{name}{feed_suffix(0, 3)}.jsonl").write_text(
+            "".join(json.dumps(row) + "\n" for row in rows)
+        )
+        (tmp_path / f"{name}{feed_suffix(1, 3)}.jsonl").write_bytes(b"")
+
+    counts = run_shards.merge_feeds(3)
+
+    assert counts == {"images": 2, "images_paths": 2, "images_delta": 2}
+    assert json.loads((tmp_path / "images.json").read_text()) == rows
+    delta = (tmp_path / "images_delta.jsonl").read_text().splitlines()
+    assert [json.loads(line) for line in delta] == rows
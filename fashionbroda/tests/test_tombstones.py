@@ -0,0 +1,39 @@
+import json
+
+from fashionbroda.tombstones import load_tombstones, write_tombstones
+
+ALBUMS = [
+    {"album_url": "https://x.yupoo.com/albums/1?uid=1&referrercate=4", "category": "A"},
+    {"album_url": "https://x.yupoo.com/albums/1?uid=1&referrercate=5", "category": "B"},
+    {"album_url": "https://x.yupoo.com/albums/2?uid=1", "category": "A"},
+]
+
+
+def snapshot(path, rows):
+    path.write_text(json.dumps(rows), encoding="utf-8")
+    return path
+
+
+def test_no_removal_round_trip(tmp_path):
+    albums = snapshot(tmp_path / "albums.json", ALBUMS)
+    output = tmp_path / "tombstones.jsonl"
+
+    assert write_tombstones(albums, albums, output) == (0, 2)
+    assert output.exists()
+    assert load_tombstones(output) == set()
+
+
+def test_removed_album_round_trip(tmp_path):
+    previous = snapshot(tmp_path / "albums.previous.json", ALBUMS)
+    current = snapshot(tmp_path / "albums.json", ALBUMS[2:])
+    output = tmp_path / "tombstones.jsonl"
+
+    # chunk_size=1 goes through the sorted runs on disk
+    assert write_tombstones(previous, current, output, chunk_size=1) == (1, 2)
+    (tombstone,) = [json.loads(line) for line in output.read_text().splitlines()]
+    assert tombstone["album_urls"] == [row["album_url"] for row in ALBUMS[:2]]
+    assert load_tombstones(output) == {tombstone["album_key"]}
+
+
+def test_missing_tombstones_file(tmp_path):
+    assert load_tombstones(tmp_path / "tombstones.jsonl") == set()
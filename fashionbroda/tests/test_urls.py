@@ -0,0 +1,60 @@
+import pytest
+from scrapy import Request
+from scrapy.utils.request import RequestFingerprinter
+
+from fashionbroda.urls import YupooRequestFingerprinter, canonicalize_url
+
+HOST = "https://fashionbroda.x.yupoo.com"
+
+
+@pytest.mark.parametrize(
+    "url, canonical",
+    [
+        # the tracking parameters of every listing are dropped
+        (
+            f"{HOST}/albums/123?uid=1&isSubCate=false&referrercate=4",
+            f"{HOST}/albums/123?uid=1",
+        ),
+        (f"{HOST}/albums/123?referrercate=5", f"{HOST}/albums/123?uid=1"),
+        (f"{HOST}/albums/123/", f"{HOST}/albums/123?uid=1"),
+        ("http://FashionBroda.x.yupoo.com/albums/123", f"{HOST}/albums/123?uid=1"),
+        # category pages only keep the page number, page 1 is the bare URL
+        (
+            f"{HOST}/categories/7?isSubCate=false&page=3&referrercate=4",
+            f"{HOST}/categories/7?page=3",
+        ),
+        (f"{HOST}/categories/7?page=1", f"{HOST}/categories/7"),
+        (f"{HOST}/categories/7/", f"{HOST}/categories/7"),
+        # anything else gets w3lib's canonical form
+        (f"{HOST}/search?b=2&a=1", f"{HOST}/search?a=1&b=2"),
+        (
+            "https://example.com/albums/1?b=2&a=1",
+            "https://example.com/albums/1?a=1&b=2",
+        ),
+    ],
+)
+def test_canonicalize_url(url, canonical):
+    assert canonicalize_url(url) == canonical
+
+
+def test_every_listing_of_an_album_has_one_fingerprint():
+    fingerprinter = YupooRequestFingerprinter()
+    album = fingerprinter.fingerprint(Request(f"{HOST}/albums/123?uid=1"))
+    assert (
+        fingerprinter.fingerprint(
+            Request(f"{HOST}/albums/123?uid=1&isSubCate=false&referrercate=4")
+        )
+        == album
+    )
+    assert fingerprinter.fingerprint(Request(f"{HOST}/albums/124?uid=1")) != album
+    # the method and body are part of the fingerprint
+    assert (
+        fingerprinter.fingerprint(Request(f"{HOST}/albums/123", method="POST")) != album
+    )
+
+
+def test_other_requests_keep_scrapys_fingerprint():
+    request = Request("https://photo.yupoo.com/fashionbroda/1/big.jpg?b=2&a=1")
+    assert YupooRequestFingerprinter().fingerprint(
+        request
+    ) == RequestFingerprinter().fingerprint(request)